@@ -0,0 +1,186 @@
+"""
+Benchmark: translation engine throughput and scaling
+====================================================
+Runs the test corpus under several settings profiles, and synthetic families
+of growing size (nested fractions, sums of squared sines, unit terms and
+matrices), through translate(). Reports ops/sec, p50 and p99 per case and how
+p50 grows with the size of each family, and writes it all as JSON.
+
+Every case is measured in --rounds interleaved rounds and reported by its
+median round. With --baseline every case is compared with an earlier run,
+and the exit status is 1 when one got slower on all three counts: its median
+p50 by more than --threshold, and by more than --min-delta-us, and even its
+fastest round slower than the baseline's slowest. Timings are machine
+specific, so save the baseline on the machine you compare on.
+
+Usage (from the python/ directory):
+    python benchmarks/bench_engine.py --output benchmarks/baseline.json
+    python benchmarks/bench_engine.py --baseline benchmarks/baseline.json [--threshold 0.25] [--quick]
+
+On a shared CI runner, where neighbours come and go between rounds, use more
+rounds and wider margins for both runs:
+    python benchmarks/bench_engine.py --rounds 7 --output baseline.json
+    python benchmarks/bench_engine.py --rounds 7 --threshold 0.5 --min-delta-us 50 --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from src.translatelatex import translate  # noqa: E402
+    from compare_engines import corpus  # noqa: E402
+
+PROFILES = {
+    'default': {},
+    'SC': {'TI_on': False, 'SC_on': True},
+    'constants': {'constants_on': True, 'e_on': True, 'i_on': True},
+    'all_on': {'SC_on': True, 'constants_on': True, 'coulomb_on': True, 'e_on': True, 'i_on': True, 'g_on': True},
+}
+
+
+def nested_frac(depth):
+    expression = "x"
+    for _ in range(depth):
+        expression = r"\frac{1}{" + expression + "+1}"
+    return expression
+
+
+def sin_squared_sum(terms):
+    return "+".join(r"\sin ^2\left(" + str(term) + r"x\right)" for term in range(1, terms + 1))
+
+
+def units(count):
+    return r"\cdot ".join(str(number) + r"\ \text{kg}" for number in range(1, count + 1))
+
+
+def matrix(size):
+    rows = ["&".join(str(row * size + column) for column in range(size)) for row in range(size)]
+    return r"\begin{matrix}" + r"\\".join(rows) + r"\end{matrix}"
+
+
+# family: (generator, sizes), run with the default settings
+FAMILIES = {
+    'nested_frac': (nested_frac, (1, 2, 4, 8, 16, 32)),
+    'sin_squared_sum': (sin_squared_sum, (1, 4, 16, 64)),
+    'units': (units, (1, 4, 16, 64)),
+    'matrix': (matrix, (2, 4, 8, 16)),
+}
+
+
+def measure(expressions, settings, engine, samples, max_seconds):
+    """Times single translate() calls, cycling through the expressions."""
+    durations = []
+    for expression in expressions:
+        translate(expression, engine=engine, **settings)
+    deadline = perf_counter() + max_seconds
+    while len(durations) < samples and (len(durations) < len(expressions) or perf_counter() < deadline):
+        expression = expressions[len(durations) % len(expressions)]
+        start = perf_counter()
+        translate(expression, engine=engine, **settings)
+        durations.append(perf_counter() - start)
+    durations.sort()
+    return {
+        'calls': len(durations),
+        'ops_per_sec': round(len(durations) / sum(durations), 1),
+        'p50_us': round(percentile(durations, 50) * 1e6, 2),
+        'p99_us': round(percentile(durations, 99) * 1e6, 2),
+    }
+
+
+def percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(math.ceil(len(ordered) * percent / 100)) - 1)]
+
+
+def growth(sizes, p50s):
+    """Exponent k of p50 ~ size^k between consecutive sizes."""
+    return [round(math.log(p50s[i + 1] / p50s[i]) / math.log(sizes[i + 1] / sizes[i]), 2)
+            for i in range(len(sizes) - 1)]
+
+
+def compare(results, baseline, threshold, min_delta_us):
+    regressions = []
+    for case, result in results['cases'].items():
+        before = baseline.get('cases', {}).get(case)
+        if before is None:
+            continue
+        ratio = result['p50_us'] / before['p50_us']
+        result['vs_baseline'] = round(ratio, 3)
+        # A baseline from before the rounds were kept only has its p50
+        rounds_apart = min(result['rounds_p50_us']) > max(before.get('rounds_p50_us', [before['p50_us']]))
+        if ratio > 1 + threshold and result['p50_us'] - before['p50_us'] > min_delta_us and rounds_apart:
+            regressions.append((case, before['p50_us'], result['p50_us'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', default='regex', help='translation backend, see translatelatex.ENGINES')
+    parser.add_argument('--samples', type=int, default=300, help='timed calls per case')
+    parser.add_argument('--rounds', type=int, default=5, help='measure every case this often and report the median round')
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='stop sampling a slow case after this long')
+    parser.add_argument('--quick', action='store_true', help='50 samples per case, one round (three with --baseline)')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed p50 slowdown, 0.25 = 25%%')
+    parser.add_argument('--min-delta-us', type=float, default=20.0, help='ignore p50 slowdowns smaller than this')
+    args = parser.parse_args()
+    samples = 50 if args.quick else args.samples
+    if args.quick:
+        args.rounds = 3 if args.baseline else 1
+
+    results = {'python': platform.python_version(), 'machine': platform.machine(),
+               'engine': args.engine, 'cases': {}, 'growth': {}}
+    expressions = corpus()
+    cases = {f'corpus/{profile}': (expressions, settings, max(samples, len(expressions)))
+             for profile, settings in PROFILES.items()}
+    for family, (generator, sizes) in FAMILIES.items():
+        cases.update((f'{family}/{size}', ([generator(size)], {}, samples)) for size in sizes)
+
+    # Noise on a shared machine comes in bursts, so every case is measured in
+    # several interleaved rounds and reported by the round with the median p50
+    rounds = {case: [] for case in cases}
+    for _ in range(max(1, args.rounds)):
+        for case, (case_expressions, settings, case_samples) in cases.items():
+            rounds[case].append(measure(case_expressions, settings, args.engine, case_samples, args.max_seconds))
+    for case, measured in rounds.items():
+        measured.sort(key=lambda result: result['p50_us'])
+        results['cases'][case] = dict(measured[(len(measured) - 1) // 2],
+                                      rounds_p50_us=[result['p50_us'] for result in measured])
+    for family, (generator, sizes) in FAMILIES.items():
+        p50s = [results['cases'][f'{family}/{size}']['p50_us'] for size in sizes]
+        results['growth'][family] = {'sizes': list(sizes), 'p50_us': p50s, 'exponents': growth(sizes, p50s)}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_delta_us)
+
+    print(f"{'case':<22} {'calls':>6} {'ops/sec':>10} {'p50 (us)':>10} {'p99 (us)':>10} {'vs base':>8}")
+    for case, result in results['cases'].items():
+        ratio = f"{result['vs_baseline']:.2f}x" if 'vs_baseline' in result else ''
+        print(f"{case:<22} {result['calls']:>6} {result['ops_per_sec']:>10.1f} "
+              f"{result['p50_us']:>10.1f} {result['p99_us']:>10.1f} {ratio:>8}")
+    print()
+    for family, curve in results['growth'].items():
+        print(f"{family:<16} p50 ~ size^k, k = {', '.join(map(str, curve['exponents']))}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    for case, before, after, ratio in regressions:
+        print(f"REGRESSION {case}: p50 {before:.1f} us -> {after:.1f} us ({ratio:.2f}x)")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Benchmark: docs export overhead, per-export loops vs the shared export loop
+===========================================================================
+Runs back to back export-like jobs, each fetching --pages pages from a local
+stand-in HTTP server, in two ways:
+
+  thread_per_job  a new thread, event loop and aiohttp session per job, as
+                  /docs-exporter/export did before export_loop.py
+  export_loop     coroutines on one ExportLoop sharing its session
+
+and reports the time to the first byte of a job (startup), the time per job,
+and the TCP connections the server accepted per job. --connect-delay holds
+every new connection for that long, standing in for DNS and the TLS
+handshake of a real documentation site.
+
+Usage (from the python/ directory):
+    python benchmarks/bench_exports.py [--jobs 50] [--pages 20] [--connect-delay 0.02]
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import sys
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+
+import aiohttp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from export_loop import ExportLoop  # noqa: E402
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    connections = 0
+    connect_delay = 0.0
+    body = b''
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+        sleep(self.connect_delay)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def fetch_pages(session, base_url, pages, started):
+    async def fetch(number):
+        async with session.get(f"{base_url}/page/{number}") as response:
+            text = await response.text()
+            if started['at'] is None:
+                started['at'] = perf_counter()
+            return text
+    return await asyncio.gather(*(fetch(number) for number in range(pages)))
+
+
+def thread_per_job(base_url, pages, started):
+    done = Future()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def job():
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=15)) as session:
+                return await fetch_pages(session, base_url, pages, started)
+        try:
+            done.set_result(loop.run_until_complete(job()))
+        except Exception as e:
+            done.set_exception(e)
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return done
+
+
+def shared_loop(export_loop):
+    def submit(base_url, pages, started):
+        async def job():
+            return await fetch_pages(await export_loop.session(), base_url, pages, started)
+        return export_loop.submit(job())
+    return submit
+
+
+def measure(submit, base_url, jobs, pages):
+    startups, durations = [], []
+    connections = PageHandler.connections
+    for _ in range(jobs):
+        started = {'at': None}
+        start = perf_counter()
+        submit(base_url, pages, started).result(60)
+        durations.append(perf_counter() - start)
+        startups.append(started['at'] - start)
+    startups.sort()
+    durations.sort()
+    return {
+        'startup_p50_ms': round(percentile(startups, 50) * 1000, 2),
+        'job_p50_ms': round(percentile(durations, 50) * 1000, 2),
+        'job_p99_ms': round(percentile(durations, 99) * 1000, 2),
+        'connections_per_job': round((PageHandler.connections - connections) / jobs, 2),
+    }
+
+
+def percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(math.ceil(len(ordered) * percent / 100)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=50, help='exports per mode')
+    parser.add_argument('--pages', type=int, default=20, help='pages fetched per export')
+    parser.add_argument('--page-bytes', type=int, default=20000)
+    parser.add_argument('--connect-delay', type=float, default=0.02, help='seconds the server holds a new connection')
+    args = parser.parse_args()
+
+    PageHandler.body = b'x' * args.page_bytes
+    PageHandler.connect_delay = args.connect_delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    export_loop = ExportLoop(max_jobs=4, limit_per_host=15)
+    results = {}
+    try:
+        # One warm-up job each, the export loop keeps its connections from it
+        for mode, submit in (('thread_per_job', thread_per_job), ('export_loop', shared_loop(export_loop))):
+            measure(submit, base_url, 1, args.pages)
+            results[mode] = measure(submit, base_url, args.jobs, args.pages)
+    finally:
+        export_loop.stop()
+        server.shutdown()
+
+    print(f"{'mode':<16} {'startup p50':>12} {'job p50':>10} {'job p99':>10} {'conns/job':>10}")
+    for mode, result in results.items():
+        print(f"{mode:<16} {result['startup_p50_ms']:>10.2f}ms {result['job_p50_ms']:>8.2f}ms "
+              f"{result['job_p99_ms']:>8.2f}ms {result['connections_per_job']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: MultiReplacer vs. the sequential str.replace() loop
+==============================================================
+Times the symbol, Greek letter, arrow and constant tables on inputs of
+growing length and checks that both approaches give the same text. Only the
+Greek letter table is translated with a MultiReplacer: the others measured
+within a few percent of the loop, or slower on plain input.
+
+Usage (from the python/ directory):
+    python benchmarks/bench_replacer.py [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from translatelatex import (  # noqa: E402
+    MultiReplacer, SYMBOLS, GREEK_LETTERS, CONSTANTS, ARROWS
+)
+
+TABLES = {
+    'symbols': SYMBOLS,
+    'greek': GREEK_LETTERS,
+    'arrows': ARROWS,
+    'constants': {constant: TIconstant.replace("_", "⁃") for constant, TIconstant in CONSTANTS.items()},
+}
+
+SAMPLE = (r"\lim _{x\rightarrow \infty }\left(\frac{\alpha \cdot \sin \left(x\right)}{\beta \pm x}\right)"
+          r"+\int _{0}^{\pi }e^{-\lambda t}dt\Rightarrow F=k\frac{q_1q_2}{r^2}\cdot m_e")
+PLAIN = "x+y^2-3z\\cdot "
+
+INPUTS = {
+    'sample x1': SAMPLE,
+    'sample x100': SAMPLE * 100,
+    'sample x1000': SAMPLE * 1000,
+    'plain x1000': PLAIN * 1000,
+}
+
+
+def sequential(table, expression):
+    for key, value in table.items():
+        expression = expression.replace(key, value)
+    return expression
+
+
+def best_time(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'table':<10} {'input':<13} {'chars':>8} {'loop (us)':>11} {'multi (us)':>11} {'speedup':>8}")
+    for table_name, table in TABLES.items():
+        replacer = MultiReplacer(table)
+        for input_name, expression in INPUTS.items():
+            assert replacer.replace(expression) == sequential(table, expression)
+            number = max(1, 20000 // len(expression))
+            loop = best_time(lambda: sequential(table, expression), number, args.repeat)
+            multi = best_time(lambda: replacer.replace(expression), number, args.repeat)
+            print(f"{table_name:<10} {input_name:<13} {len(expression):>8} "
+                  f"{loop * 1e6:>11.1f} {multi * 1e6:>11.1f} {loop / multi:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Benchmark: POST /translate through the fast path and through Flask
+==================================================================
+Calls the WSGI app in process, without a socket, so what is measured is the
+per-request overhead of the server around the translation. Every case runs
+through server.TranslateFastPath and through the translate_expression view
+behind it, and reports requests/sec, p50 and p99 of each and the speedup.
+
+Cases: one expression answered from the cache, the test corpus with the
+cache off (a translation per request), and a request rejected before it is
+translated. Before timing, sample requests are sent down both paths and
+their status, headers and bodies compared, the exit status is 1 on a
+difference.
+
+Usage (from the python/ directory):
+    python benchmarks/bench_server.py [--samples 2000] [--rounds 3] [--quick]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('FLASK_SECRET_KEY', 'bench_server')
+# The request log goes to logs/ under the working directory
+os.chdir(tempfile.mkdtemp(prefix='bench_server_'))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import server  # noqa: E402
+    from compare_engines import corpus  # noqa: E402
+
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+# Response headers whose values are durations
+TIMED_HEADERS = ('Server-Timing',)
+
+# name: (body, headers) sent to both paths before timing
+SAMPLES = {
+    'ok': ({'expression': r'\frac{1}{2}+\sin ^2\left(x\right)'}, {}),
+    'settings': ({'expression': r'e^{i\pi }+g', 'e_on': True, 'i_on': True, 'g_on': True, 'TI_on': False}, {}),
+    'origin': ({'expression': r'\sqrt{x}'}, {'Origin': 'chrome-extension://abc'}),
+    'unicode': ({'expression': 'é\\cdot 2'}, {}),
+    'timings': ({'expression': r'\frac{a}{b}', 'timings': True}, {}),
+    'not_a_dict': (['x'], {}),
+    'not_a_string': ({'expression': 5}, {}),
+    'too_long': ({'expression': 'x' * 30000}, {}),
+    'too_deep': ({'expression': '(' * 200 + ')' * 200}, {}),
+}
+
+
+def environ(body, headers=None, path='/translate', raw=None):
+    """A WSGI environ for POST path, the body is bytes read again on every call."""
+    content = raw if raw is not None else json.dumps(body).encode()
+    base = EnvironBuilder(path=path, method='POST', data=content, content_type='application/json',
+                          headers=dict({'X-Forwarded-For': '203.0.113.7'}, **(headers or {}))).get_environ()
+    return base, content
+
+
+def call(wsgi_app, request):
+    base, content = request
+    environ = dict(base, **{'wsgi.input': io.BytesIO(content)})
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = headers
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return response['status'], response['headers'], body
+
+
+def comparable(response):
+    # The response without the durations, which differ from call to call
+    status, headers, body = response
+    body = json.loads(body)
+    timed = TIMED_HEADERS
+    if isinstance(body.get('timings'), dict):
+        body['timings'] = sorted(body['timings'])
+        timed += ('Content-Length',)
+    return status, sorted((name, '' if name in timed else value) for name, value in headers), body
+
+
+def check(fast, view):
+    """Names of the sample requests the two paths answer differently."""
+    requests = {name: environ(body, headers) for name, (body, headers) in SAMPLES.items()}
+    requests['trailing_slash'] = environ(SAMPLES['ok'][0], path='/translate/')
+    requests['invalid_json'] = environ(None, raw=b'{"expression": ')
+    requests['empty_body'] = environ(None, raw=b'')
+    requests['body_too_large'] = environ(None, raw=b' ' * (server.admission.max_body_bytes + 1))
+    differences = []
+    # Uncached, so that both paths translate and time the stages
+    entries, server.translation_cache.max_entries = server.translation_cache.max_entries, 0
+    try:
+        for name, request in requests.items():
+            expected, got = comparable(call(view, request)), comparable(call(fast, request))
+            if expected != got:
+                differences.append(name)
+                print(f"DIFFERENT {name}:\n  view: {expected}\n  fast: {got}")
+    finally:
+        server.translation_cache.max_entries = entries
+    return differences
+
+
+def measure(wsgi_app, requests, samples):
+    durations = []
+    for request in requests[:samples]:
+        call(wsgi_app, request)
+    while len(durations) < samples:
+        request = requests[len(durations) % len(requests)]
+        start = perf_counter()
+        call(wsgi_app, request)
+        durations.append(perf_counter() - start)
+    durations.sort()
+    return {
+        'requests_per_sec': round(len(durations) / sum(durations), 1),
+        'p50_us': round(percentile(durations, 50) * 1e6, 2),
+        'p99_us': round(percentile(durations, 99) * 1e6, 2),
+    }
+
+
+def percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(math.ceil(len(ordered) * percent / 100)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=2000, help='timed requests per case and path')
+    parser.add_argument('--rounds', type=int, default=3, help='measure every case this often and keep the fastest round')
+    parser.add_argument('--quick', action='store_true', help='300 samples per case, one round')
+    args = parser.parse_args()
+    samples = 300 if args.quick else args.samples
+    if args.quick:
+        args.rounds = 1
+
+    fast = server.app.wsgi_app
+    if not isinstance(fast, server.TranslateFastPath):
+        fast = server.TranslateFastPath(fast)
+    view = fast.wsgi_app
+
+    differences = check(fast, view)
+
+    cache = server.translation_cache
+    cases = {
+        'cached': ([environ({'expression': r'\frac{1}{2}+\sin ^2\left(x\right)'})], cache.max_entries),
+        'uncached': ([environ({'expression': expression}) for expression in corpus()], 0),
+        'rejected': ([environ({'expression': 'x' * 30000})], cache.max_entries),
+    }
+    results = {}
+    entries = cache.max_entries
+    try:
+        for _ in range(args.rounds):
+            for case, (requests, max_entries) in cases.items():
+                cache.max_entries = max_entries
+                for path, wsgi_app in (('view', view), ('fast', fast)):
+                    result = measure(wsgi_app, requests, samples)
+                    best = results.get((case, path))
+                    if best is None or result['p50_us'] < best['p50_us']:
+                        results[(case, path)] = result
+    finally:
+        cache.max_entries = entries
+
+    print(f"{'case':<10} {'path':<5} {'req/sec':>10} {'p50 (us)':>10} {'p99 (us)':>10} {'speedup':>8}")
+    for case in cases:
+        for path in ('view', 'fast'):
+            result = results[(case, path)]
+            speedup = result['requests_per_sec'] / results[(case, 'view')]['requests_per_sec']
+            print(f"{case:<10} {path:<5} {result['requests_per_sec']:>10.1f} "
+                  f"{result['p50_us']:>10.1f} {result['p99_us']:>10.1f} {speedup:>7.2f}x")
+    return 1 if differences else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Differential runner: tree backend vs. the regex pipeline
+========================================================
+Translates every expression of the test corpus under every settings profile
+with both backends and reports how many the tree backend handles itself,
+whether any output differs and how long both take.
+
+Expressions the tree backend does not support fall back to the regex
+pipeline, so a mismatch always means a tree backend bug. The exit status is
+1 when there is one.
+
+Usage (from the python/ directory):
+    python benchmarks/compare_engines.py [--file expressions.txt] [--default-profile] [--repeat N]
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import sys
+import timeit
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from src.translatelatex import get_engine  # noqa: E402
+    from src.translatetree import Unsupported  # noqa: E402
+    from tests import test_translatelatex  # noqa: E402
+
+FLAGS = ('TI_on', 'SC_on', 'constants_on', 'coulomb_on', 'e_on', 'i_on', 'g_on', 'units_on')
+
+
+def corpus():
+    expressions = []
+    for name in dir(test_translatelatex):
+        if name.endswith('_TESTS'):
+            expressions.extend(test_case.latex_input for test_case in getattr(test_translatelatex, name))
+    return list(dict.fromkeys(expressions))
+
+
+def profiles(default_only):
+    if default_only:
+        return [dict(TI_on=True, SC_on=False, constants_on=False, coulomb_on=False,
+                     e_on=False, i_on=False, g_on=False, units_on=True)]
+    return [dict(zip(FLAGS, values)) for values in itertools.product((True, False), repeat=len(FLAGS))]
+
+
+def run(engine, expression, backend):
+    try:
+        return engine.translate(expression, backend)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', help='extra expressions, one per line')
+    parser.add_argument('--default-profile', action='store_true', help='only the default settings instead of all 256 profiles')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    expressions = corpus()
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            expressions.extend(line.rstrip('\n') for line in f if line.strip())
+
+    cases = handled = 0
+    mismatches = []
+    fallbacks = Counter()
+    regex_time = tree_time = handled_regex_time = handled_tree_time = 0.0
+    for settings in profiles(args.default_profile):
+        engine = get_engine(**settings)
+        for expression in expressions:
+            cases += 1
+            expected = run(engine, expression, 'regex')
+            result = run(engine, expression, 'tree')
+            if result != expected:
+                mismatches.append((settings, expression, expected, result))
+
+            regex = best_time(lambda: engine.translate(expression), args.repeat)
+            tree = best_time(lambda: engine.translate(expression, 'tree'), args.repeat)
+            regex_time += regex
+            tree_time += tree
+            try:
+                engine.tree.translate(engine.prepare(expression))
+            except Unsupported as e:
+                fallbacks[str(e)] += 1
+            except Exception as e:
+                fallbacks[type(e).__name__] += 1
+            else:
+                handled += 1
+                handled_regex_time += regex
+                handled_tree_time += tree
+
+    for settings, expression, expected, result in mismatches[:20]:
+        active = ' '.join(flag for flag in FLAGS if settings[flag])
+        print(f"MISMATCH [{active}] {expression!r}\n  regex: {expected!r}\n  tree:  {result!r}")
+
+    print(f"{len(expressions)} expressions x {cases // max(1, len(expressions))} profiles = {cases} cases")
+    print(f"handled by tree: {handled} ({handled / max(1, cases):.1%}), mismatches: {len(mismatches)}")
+    print(f"all cases:       regex {regex_time * 1e3:9.1f} ms   tree {tree_time * 1e3:9.1f} ms   "
+          f"{regex_time / max(tree_time, 1e-9):.2f}x")
+    print(f"handled cases:   regex {handled_regex_time * 1e3:9.1f} ms   tree {handled_tree_time * 1e3:9.1f} ms   "
+          f"{handled_regex_time / max(handled_tree_time, 1e-9):.2f}x")
+    if fallbacks:
+        print("most common fallback reasons: " + ", ".join(f"{reason} ({count})" for reason, count in fallbacks.most_common(8)))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import re
+import threading
+from itertools import accumulate
+
+# Everything but the brackets, whose nesting translation time grows with
+NOT_BRACKETS = re.compile(r'[^{}()\[\]]+')
+BRACKET_DEPTH = {'{': 1, '(': 1, '[': 1, '}': -1, ')': -1, ']': -1}
+
+
+def nesting_depth(expression):
+    """Deepest nesting of {}, () and [] brackets in the expression."""
+    return max(accumulate(map(BRACKET_DEPTH.__getitem__, NOT_BRACKETS.sub('', expression))), default=0)
+
+
+class Rejected(Exception):
+    """A request turned away before it is translated, answered with {'error': message}."""
+
+    def __init__(self, message, status=400, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class AdmissionControl:
+    """
+    Limits checked before a translation is queued, and the counts of the
+    requests they turned away.
+
+    Bodies over max_body_bytes, expressions over max_length characters or
+    nested deeper than max_depth brackets are rejected. With max_backlog
+    translations queued or running, new ones are shed with a 503 and a
+    Retry-After header. A limit of 0 disables it.
+    """
+
+    def __init__(self, max_body_bytes=1024 * 1024, max_length=20000, max_depth=100, max_backlog=32, retry_after=1):
+        self.max_body_bytes = max_body_bytes
+        self.max_length = max_length
+        self.max_depth = max_depth
+        self.max_backlog = max_backlog
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.backlog = 0
+        self.shed = 0
+        self.rejected = {'body_too_large': 0, 'too_long': 0, 'too_deep': 0}
+
+    def _reject(self, reason, message, status=400):
+        with self._lock:
+            self.rejected[reason] += 1
+        return Rejected(message, status)
+
+    def check_body(self, length):
+        """Call with the Content-Length before the body is read, and with the bytes read so far."""
+        if self.max_body_bytes and length is not None and length > self.max_body_bytes:
+            raise self._reject('body_too_large', f'Request body over {self.max_body_bytes} bytes.', 413)
+
+    def check_expression(self, expression):
+        if self.max_length and len(expression) > self.max_length:
+            raise self._reject('too_long', 'Expression too long. Please use shorter expressions.')
+        if self.max_depth and nesting_depth(expression) > self.max_depth:
+            raise self._reject('too_deep', 'Expression nested too deeply. Please use a simpler expression.')
+
+    def check_backlog(self, count=1):
+        """
+        Sheds the request when count more translations, at most max_backlog,
+        would take the executor past max_backlog.
+        """
+        with self._lock:
+            if not self.max_backlog or self.backlog + min(count, self.max_backlog) <= self.max_backlog:
+                return
+            self.shed += 1
+        raise Rejected('Server busy. Please try again shortly.', 503, {'Retry-After': str(self.retry_after)})
+
+    def track(self, future):
+        """Counts an executor future in the backlog until it is done or cancelled."""
+        with self._lock:
+            self.backlog += 1
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        with self._lock:
+            self.backlog -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backlog': self.backlog,
+                'max_backlog': self.max_backlog,
+                'shed': self.shed,
+                'rejected': dict(self.rejected),
+            }
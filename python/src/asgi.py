@@ -0,0 +1,205 @@
+"""
+ASGI entry point: uvicorn asgi:app
+
+/translate, /translate/batch and the docs exporter's progress streams are
+served here as coroutines. A translation awaits the executor future and a
+progress stream awaits its next update, so a waiting client holds no thread.
+Every other request goes to the Flask app in server.py, which a2wsgi runs
+on its own thread pool, and answers the same as under gunicorn.
+"""
+
+import asyncio
+import json
+import os
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from time import time, monotonic
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import Headers, MultiDict
+
+import server
+from server import (Rejected, TranslationTimeout, TRANSLATION_TIMEOUT, translation_cache, admission,
+                    submit_translation, admit_batch, submit_batch, finish_batch_item, batch_outcomes,
+                    client_ip, translation_request, translation_response, batch_request, batch_response,
+                    translation_get_request, cacheable_headers, not_modified, cors_headers, json_body)
+from docs_exporter_blueprint import progress_events, PROGRESS_HEADERS
+
+# Threads running the Flask routes, as gunicorn's --threads did
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', '8'))
+flask_app = WSGIMiddleware(server.app, workers=WSGI_THREADS)
+
+PROGRESS_PREFIX = '/docs-exporter/progress/'
+
+
+async def await_translation(future, timeout):
+    # future is a cached result or the executor future of submit_translation
+    if isinstance(future, str):
+        return future
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), max(0, timeout))
+    except (asyncio.TimeoutError, FuturesTimeoutError, TranslationTimeout):
+        future.cancel()
+        raise server.TimeoutError("Translation timeout")
+
+
+async def translate_async(expression, timeout, timings=None, **settings):
+    result = await await_translation(submit_translation(expression, monotonic() + timeout, timings, **settings),
+                                     timeout)
+    translation_cache.put(expression, settings, result)
+    return result
+
+
+async def batch_async(items, timeout):
+    # run_batch_with_timeout, awaiting the futures
+    deadline = monotonic() + timeout
+    outcomes, waiting = admit_batch(items)
+    running = {}
+    submit_batch(waiting, deadline, running, outcomes)
+    while running:
+        awaited = {asyncio.wrap_future(future): future for future in running}
+        done, _ = await asyncio.wait(awaited, timeout=max(0, deadline - monotonic()),
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            finish_batch_item(awaited[future], running.pop(awaited[future]), outcomes)
+        submit_batch(waiting, deadline, running, outcomes)
+    return batch_outcomes(items, waiting, running, outcomes)
+
+
+async def read_json(headers, receive):
+    # The request body parsed as JSON, None when it is not. A body over the
+    # size limit is rejected from its Content-Length, or once that much arrived.
+    content_length = headers.get('Content-Length', type=int)
+    admission.check_body(content_length)
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        admission.check_body(len(body))
+        more_body = message.get('more_body', False)
+    try:
+        return json.loads(body)
+    except (ValueError, RecursionError):
+        return None
+
+
+def encode_headers(headers):
+    return [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+
+
+async def send_json(send, request_headers, body, status=200, headers=None):
+    content = json_body(body)
+    response_headers = dict(headers or {})
+    if 'Access-Control-Allow-Origin' not in response_headers:
+        response_headers.update(cors_headers(request_headers))
+    response_headers['Content-Type'] = 'application/json'
+    response_headers['Content-Length'] = str(len(content))
+    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(response_headers)})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def send_empty(send, status, headers):
+    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def translate_endpoint(headers, receive, send):
+    start_time = time()
+    real_ip = client_ip(headers)
+    try:
+        expression, settings, timings_requested, timings = translation_request(await read_json(headers, receive))
+        outcome = await translate_async(expression, TRANSLATION_TIMEOUT, timings=timings, **settings)
+    except Rejected as e:
+        return await send_json(send, headers, {'error': str(e)}, e.status, e.headers)
+    except Exception as e:
+        outcome = e
+    body, status, response_headers = translation_response(real_ip, expression, settings, outcome,
+                                                          timings, timings_requested, start_time)
+    await send_json(send, headers, body, status, response_headers)
+
+
+async def translate_get_endpoint(headers, args, send):
+    start_time = time()
+    real_ip = client_ip(headers)
+    try:
+        expression, settings, etag = translation_get_request(args)
+        if not_modified(headers.get('If-None-Match'), etag):
+            return await send_empty(send, 304, cacheable_headers(etag))
+        outcome = await translate_async(expression, TRANSLATION_TIMEOUT, **settings)
+    except Rejected as e:
+        return await send_json(send, headers, {'error': str(e)}, e.status, dict(e.headers, **{'Cache-Control': 'no-store'}))
+    except Exception as e:
+        outcome = e
+    body, status, response_headers = translation_response(real_ip, expression, settings, outcome, None, False, start_time)
+    response_headers.update(cacheable_headers(etag) if status == 200 else {'Cache-Control': 'no-store'})
+    await send_json(send, headers, body, status, response_headers)
+
+
+async def batch_endpoint(headers, receive, send):
+    start_time = time()
+    real_ip = client_ip(headers)
+    try:
+        items, results = batch_request(await read_json(headers, receive))
+        outcomes = await batch_async([(expression, settings) for _, expression, settings in items],
+                                     TRANSLATION_TIMEOUT)
+    except Rejected as e:
+        return await send_json(send, headers, {'error': str(e)}, e.status, e.headers)
+    await send_json(send, headers, batch_response(real_ip, items, results, outcomes, start_time))
+
+
+async def progress_endpoint(progress_id, receive, send):
+    # Streams until the export finishes or the client goes away
+    async def stream():
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream; charset=utf-8')] +
+                               [(name.encode(), value.encode()) for name, value in PROGRESS_HEADERS.items()]})
+        async for event in progress_events(progress_id):
+            await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    streaming = asyncio.ensure_future(stream())
+    watching = asyncio.ensure_future(disconnected())
+    await asyncio.wait((streaming, watching), return_when=asyncio.FIRST_COMPLETED)
+    for task in (streaming, watching):
+        task.cancel()
+    await asyncio.gather(streaming, watching, return_exceptions=True)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        path = scope['path']
+        method = scope['method']
+        headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+        if method == 'POST' and path in ('/translate', '/translate/'):
+            return await translate_endpoint(headers, receive, send)
+        if method == 'GET' and path in ('/translate', '/translate/'):
+            args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+            if 'expr' in args:
+                return await translate_get_endpoint(headers, args, send)
+        if method == 'POST' and path == '/translate/batch':
+            return await batch_endpoint(headers, receive, send)
+        progress_id = path[len(PROGRESS_PREFIX):] if path.startswith(PROGRESS_PREFIX) else ''
+        if method == 'GET' and progress_id and '/' not in progress_id:
+            return await progress_endpoint(progress_id, receive, send)
+    await flask_app(scope, receive, send)
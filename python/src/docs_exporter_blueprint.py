@@ -1,12 +1,16 @@
 import sys
 import os
 from pathlib import Path
-from flask import Blueprint, render_template, request, redirect, url_for, flash, Response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, send_file
 import time
 import asyncio
+import inspect
 import json
 import threading
 import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # Add the docs-exporter folder to Python path to import the core module
 docs_exporter_path = Path(__file__).parent.parent.parent / 'docs-exporter'
@@ -14,16 +18,243 @@ sys.path.insert(0, str(docs_exporter_path))
 
 # Import the DocsExporter class from the standalone app
 from app import DocsExporter
+from progress_store import make_progress_store, start_sweeper, start_watcher, discard_file
+from export_loop import ExportLoop
+from page_cache import PageCache
 
 # Create Blueprint
 docs_exporter_bp = Blueprint('docs_exporter', __name__, 
                              url_prefix='/docs-exporter',
                              template_folder='../../docs-exporter/templates')
 
-# Global progress tracking
-progress_data = {}
+# Progress and results of the exports. The default SQLite store is shared by
+# all worker processes, PROGRESS_STORE=memory only works with a single worker.
+PROGRESS_STORE = os.environ.get('PROGRESS_STORE', 'sqlite')
+PROGRESS_DB = os.environ.get('PROGRESS_DB', str(Path(__file__).parent / 'build' / 'progress.sqlite3'))
+PROGRESS_TTL = int(os.environ.get('PROGRESS_TTL', '3600'))  # seconds an unfetched result is kept
+# Seconds an unfinished export's entry is kept without an update, left behind
+# when the worker running it died or restarted
+PROGRESS_UNFINISHED_TTL = int(os.environ.get('PROGRESS_UNFINISHED_TTL', str(24 * 3600)))
+# Budget for the retained results, the oldest finished exports are evicted beyond it
+PROGRESS_MAX_BYTES = int(os.environ.get('PROGRESS_MAX_BYTES', str(64 * 1024 * 1024)))
+PROGRESS_SWEEP_INTERVAL = int(os.environ.get('PROGRESS_SWEEP_INTERVAL', '60'))
+progress_store = make_progress_store(PROGRESS_STORE, PROGRESS_DB, PROGRESS_TTL, PROGRESS_MAX_BYTES,
+                                     PROGRESS_UNFINISHED_TTL)
+if (PROGRESS_TTL or PROGRESS_UNFINISHED_TTL) and PROGRESS_SWEEP_INTERVAL:
+    start_sweeper(progress_store, PROGRESS_SWEEP_INTERVAL)
+
+# Exports run as coroutines on one event loop thread per worker, sharing its
+# keep-alive HTTP connections. The session is handed to DocsExporter when it
+# takes one, otherwise the exporter opens its own connections per export, as
+# the current one does, so its exports share the loop but not connections.
+# At most EXPORT_MAX_JOBS run at once, the others wait in line, and together
+# they keep at most EXPORT_MAX_FETCHES requests in flight, shared fairly, so
+# the exports can't crowd out /translate in the same worker.
+EXPORT_MAX_JOBS = int(os.environ.get('EXPORT_MAX_JOBS', '4'))
+EXPORT_MAX_FETCHES = int(os.environ.get('EXPORT_MAX_FETCHES', '15'))
+EXPORT_LIMIT_PER_HOST = int(os.environ.get('EXPORT_LIMIT_PER_HOST', '15'))
+export_loop = ExportLoop(max_jobs=EXPORT_MAX_JOBS, limit_per_host=EXPORT_LIMIT_PER_HOST,
+                         max_fetches=EXPORT_MAX_FETCHES)
+EXPORTER_TAKES_SESSION = 'session' in inspect.signature(DocsExporter).parameters
+
+def exporter_concurrency():
+    """
+    max_concurrent_requests for one export. The shared session's connector
+    keeps all exports within EXPORT_MAX_FETCHES; an exporter opening its own
+    connections is only held to it by this, so each running export gets its share.
+    """
+    if EXPORTER_TAKES_SESSION:
+        return min(15, EXPORT_MAX_FETCHES)
+    return max(1, EXPORT_MAX_FETCHES // EXPORT_MAX_JOBS)
+
+# Fetched pages are kept with their ETag and Last-Modified between exports and
+# revalidated with conditional GETs, an unchanged page is neither downloaded
+# nor parsed again. Only opened when DocsExporter takes one, which the current
+# exporter doesn't, so it is off until it does; 0 turns it off too.
+PAGE_CACHE_DB = os.environ.get('PAGE_CACHE_DB', str(Path(__file__).parent / 'build' / 'pages.sqlite3'))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+EXPORTER_TAKES_PAGE_CACHE = 'page_cache' in inspect.signature(DocsExporter).parameters
+page_cache = (PageCache(PAGE_CACHE_DB, PAGE_CACHE_MAX_BYTES)
+              if PAGE_CACHE_MAX_BYTES and EXPORTER_TAKES_PAGE_CACHE else None)
+
+# Finished exports are written here and streamed from /download/<progress_id>,
+# the store only keeps a preview. The result page shows the whole file up to
+# RESULT_INLINE_BYTES, beyond it the preview and a link to the download.
+PROGRESS_SPOOL_DIR = os.environ.get('PROGRESS_SPOOL_DIR', str(Path(__file__).parent / 'build' / 'exports'))
+RESULT_PREVIEW_CHARS = 20000
+RESULT_INLINE_BYTES = int(os.environ.get('RESULT_INLINE_BYTES', str(2 * 1024 * 1024)))
+SPOOL_CHUNK_CHARS = 1024 * 1024  # encoded and written at a time
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Fields of the progress kept from the browser
+PROGRESS_PRIVATE_FIELDS = ('result_file',)
+
+# Streams of this process waiting for an update: progress_id -> {wake function}
+progress_waiters = {}
 progress_lock = threading.Lock()
 
+# Streams send an update as soon as notify_progress wakes them. With a shared
+# store, one watcher thread per worker checks the file's data_version every
+# PROGRESS_WATCH_INTERVAL seconds while the worker has streams open, and when
+# another worker wrote to it, wakes the streams whose entry has a new version.
+# A stream only reads the store when it is woken or its heartbeat is due.
+PROGRESS_WATCH_INTERVAL = float(os.environ.get('PROGRESS_WATCH_INTERVAL', '0.05'))
+progress_watcher = None
+progress_watching = threading.Event()  # Set while progress_waiters isn't empty
+watched_versions = {}  # progress_id -> version the watcher last saw, only used by the watcher
+PROGRESS_HEARTBEAT = 15  # seconds between keep-alive comments on an idle stream
+PROGRESS_START_TIMEOUT = 60  # seconds a stream waits for its export to appear
+PROGRESS_HEADERS = {
+    'Cache-Control': 'no-cache, no-transform',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',  # Disable nginx buffering
+    'Access-Control-Allow-Origin': '*',
+}
+
+def notify_progress(progress_id):
+    """
+    Wakes the streams of progress_id in this process. Streams on other
+    workers are woken by their watcher within PROGRESS_WATCH_INTERVAL.
+    """
+    with progress_lock:
+        wakers = list(progress_waiters.get(progress_id, ()))
+    for wake in wakers:
+        wake()
+
+def update_progress_data(progress_id, **fields):
+    """Merges fields into the export's progress and wakes its streams"""
+    if progress_store.update(progress_id, fields):
+        notify_progress(progress_id)
+    else:
+        # The entry expired while the export ran, nobody can download its result
+        discard_file(fields.get('result_file'))
+
+# The export loop hands its progress writes to this one thread, in order, so a
+# slow or locked store write never holds up the other exports on the loop
+progress_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='progress-writer')
+
+def update_progress_soon(progress_id, **fields):
+    """update_progress_data on the writer thread, for the export loop; returns its future"""
+    return progress_writer.submit(update_progress_data, progress_id, **fields)
+
+def wake_changed_progress():
+    """Wakes the streams whose entry got a new version, called by the watcher after a write to the store"""
+    with progress_lock:
+        waiting = {progress_id: list(waiters) for progress_id, waiters in progress_waiters.items()}
+    for progress_id in set(watched_versions) - set(waiting):
+        del watched_versions[progress_id]
+    for progress_id, wakers in waiting.items():
+        entry = progress_store.get_newer(progress_id, watched_versions.get(progress_id))
+        version = entry[0] if entry else None
+        # A stream the watcher sees for the first time may have read the entry before this write
+        if progress_id in watched_versions and watched_versions[progress_id] == version:
+            continue
+        watched_versions[progress_id] = version
+        for wake in wakers:
+            wake()
+
+@contextmanager
+def progress_waiter(progress_id, wake):
+    """Registers wake to be called on every update of progress_id while the stream is open"""
+    global progress_watcher
+    with progress_lock:
+        progress_waiters.setdefault(progress_id, set()).add(wake)
+        if progress_store.shared:
+            progress_watching.set()
+            if progress_watcher is None:
+                progress_watcher = start_watcher(progress_store, PROGRESS_WATCH_INTERVAL, wake_changed_progress,
+                                                 progress_watching)
+    try:
+        yield
+    finally:
+        with progress_lock:
+            waiters = progress_waiters.get(progress_id)
+            waiters.discard(wake)
+            if not waiters:
+                del progress_waiters[progress_id]
+                if not progress_waiters:
+                    progress_watching.clear()
+
+def progress_state():
+    """What a stream carries from one next_progress_event call to the next"""
+    now = time.monotonic()
+    return {'version': None, 'heartbeat_at': now + PROGRESS_HEARTBEAT, 'give_up_at': now + PROGRESS_START_TIMEOUT}
+
+def next_progress_event(progress_id, state):
+    """
+    Next Server-Sent Event of a progress stream, None when there is nothing
+    to send yet, and whether it is the last one. Only a new version of the
+    progress is read and sent, otherwise a heartbeat when one is due.
+    """
+    now = time.monotonic()
+    entry = progress_store.get_newer(progress_id, state['version'])
+    if entry is None:
+        # Progress not found yet, keep waiting
+        if now >= state['give_up_at']:
+            return f"data: {json.dumps({'error': 'Progress not found', 'finished': True})}\n\n", True
+    elif entry[1] is not None:
+        state['version'], data = entry
+        state['heartbeat_at'] = now + PROGRESS_HEARTBEAT
+        event = {field: value for field, value in data.items() if field not in PROGRESS_PRIVATE_FIELDS}
+        return f"data: {json.dumps(event)}\n\n", data.get('finished', False)
+
+    if now >= state['heartbeat_at']:
+        # Send heartbeat to keep connection alive
+        state['heartbeat_at'] = now + PROGRESS_HEARTBEAT
+        return ": heartbeat\n\n", False
+    return None, False
+
+def progress_wait_timeout(state):
+    """Seconds a stream sleeps unless it is woken, until the next heartbeat"""
+    return max(0, state['heartbeat_at'] - time.monotonic())
+
+async def progress_events(progress_id):
+    """
+    The events of progress_stream for the ASGI server (asgi.py). Waits for
+    notify_progress on the event loop, so an open stream holds no thread.
+    """
+    loop = asyncio.get_running_loop()
+    updated = asyncio.Event()
+
+    def wake():
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(updated.set)
+
+    with progress_waiter(progress_id, wake):
+        # Send initial heartbeat
+        yield ": heartbeat\n\n"
+        state = progress_state()
+        while True:
+            updated.clear()
+            event, finished = next_progress_event(progress_id, state)
+            if event:
+                yield event
+            if finished:
+                return
+            try:
+                await asyncio.wait_for(updated.wait(), progress_wait_timeout(state))
+            except asyncio.TimeoutError:
+                pass
+
+def spool_result(progress_id, content):
+    """Writes an export's result to PROGRESS_SPOOL_DIR a chunk at a time, returns (filename, bytes)"""
+    os.makedirs(PROGRESS_SPOOL_DIR, exist_ok=True)
+    filename = os.path.join(PROGRESS_SPOOL_DIR, f'{progress_id}.txt')
+    with open(filename + '.tmp', 'wb') as f:
+        for start in range(0, len(content), SPOOL_CHUNK_CHARS):
+            f.write(content[start:start + SPOOL_CHUNK_CHARS].encode('utf-8'))
+    os.replace(filename + '.tmp', filename)
+    return filename, os.path.getsize(filename)
+
+def gzip_chunks(f):
+    """The file compressed on the fly, DOWNLOAD_CHUNK_BYTES read at a time"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b''):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
 @docs_exporter_bp.route('/')
 def index():
     return render_template('docs_exporter/index.html')
@@ -32,46 +263,25 @@ def index():
 def progress_stream(progress_id):
     """Server-Sent Events endpoint for real-time progress updates"""
     def event_stream():
-        # Send initial heartbeat
-        yield f": heartbeat\n\n"
-        
-        last_data = None
-        retry_count = 0
-        max_retries = 120  # 60 seconds total (120 * 0.5s)
-        
-        while retry_count < max_retries:
-            with progress_lock:
-                if progress_id in progress_data:
-                    data = progress_data[progress_id]
-                    
-                    # Only send if data changed or it's finished
-                    if data != last_data or data.get('finished', False):
-                        yield f"data: {json.dumps(data)}\n\n"
-                        last_data = data.copy()
-                    else:
-                        # Send heartbeat to keep connection alive
-                        yield f": heartbeat\n\n"
-                    
-                    # Clean up and close if finished
-                    if data.get('finished', False):
-                        break
-                    
-                    retry_count = 0  # Reset retry count when data exists
-                else:
-                    # Progress not found yet, keep waiting
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        yield f"data: {json.dumps({'error': 'Progress not found', 'finished': True})}\n\n"
-                        break
-                    yield f": waiting\n\n"
-            
-            time.sleep(0.5)  # Update every 500ms
-    
+        # Blocks between updates instead of polling, see next_progress_event
+        updated = threading.Event()
+        with progress_waiter(progress_id, updated.set):
+            # Send initial heartbeat
+            yield ": heartbeat\n\n"
+
+            state = progress_state()
+            while True:
+                updated.clear()
+                event, finished = next_progress_event(progress_id, state)
+                if event:
+                    yield event
+                # Clean up and close if finished
+                if finished:
+                    break
+                updated.wait(progress_wait_timeout(state))
+
     response = Response(event_stream(), mimetype="text/event-stream")
-    response.headers['Cache-Control'] = 'no-cache, no-transform'
-    response.headers['Connection'] = 'keep-alive'
-    response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx buffering
-    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers.update(PROGRESS_HEADERS)
     return response
 
 @docs_exporter_bp.route('/exporting')
@@ -123,72 +333,78 @@ def export():
     progress_id = str(uuid.uuid4())
     
     # Initialize progress tracking
-    with progress_lock:
-        progress_data[progress_id] = {
-            'completed': 0,
-            'total': len(selected_urls),
-            'message': 'Initializing...',
-            'finished': False,
-            'errors': [],
-            'content': None
-        }
+    progress_store.create(progress_id, {
+        'completed': 0,
+        'total': len(selected_urls),
+        'message': 'Initializing...',
+        'queue_position': None,
+        'finished': False,
+        'errors': []
+    })
     
-    # Start export in background thread for maximum speed
-    def run_export():
+    # Runs on the worker's export loop, which reuses its connections between exports
+    async def run_export():
+        update_progress_soon(progress_id, queue_position=None, message='Starting export...')
+        options = {}
+        if EXPORTER_TAKES_SESSION:
+            options['session'] = await export_loop.session()
+        job_cache = page_cache.for_job(export_loop.fetch_slot) if page_cache else None
+        if job_cache:
+            options['page_cache'] = job_cache
+
         # Use optimized settings for maximum speed
         exporter = DocsExporter(
             base_url, 
-            max_concurrent_requests=15,  # High concurrency
-            delay_between_requests=0.1   # Minimal delay
+            max_concurrent_requests=exporter_concurrency(),  # High concurrency, within the shared budget
+            delay_between_requests=0.1,  # Minimal delay
+            **options
         )
         
+        def with_cache_counts(message):
+            counts = job_cache.describe() if job_cache else ''
+            return f'{message} ({counts})' if counts else message
+
         # Set progress callback
         def update_progress(completed, total, message):
-            with progress_lock:
-                if progress_id in progress_data:
-                    progress_data[progress_id].update({
-                        'completed': completed,
-                        'total': total,
-                        'message': message
-                    })
+            update_progress_soon(progress_id, completed=completed, total=total, message=with_cache_counts(message))
         
         exporter.set_progress_callback(update_progress)
         
-        # Run async function in event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
         try:
-            combined_content, errors, rejections = loop.run_until_complete(
-                exporter.export_selected_pages_async(selected_urls, compress_links)
-            )
+            combined_content, errors, rejections = await exporter.export_selected_pages_async(
+                selected_urls, compress_links)
             
-            # Update final progress
-            with progress_lock:
-                if progress_id in progress_data:
-                    progress_data[progress_id].update({
-                        'completed': len(selected_urls),
-                        'total': len(selected_urls),
-                        'message': 'Export completed!',
-                        'finished': True,
-                        'errors': errors,
-                        'rejections': rejections,
-                        'content': combined_content
-                    })
+            # Spool the result to disk, off the loop, the store only keeps a preview
+            result_file, result_bytes = await asyncio.get_running_loop().run_in_executor(
+                None, spool_result, progress_id, combined_content)
+            preview = combined_content[:RESULT_PREVIEW_CHARS]
+            truncated = len(combined_content) > RESULT_PREVIEW_CHARS
+            del combined_content
+
+            # Update final progress, after the progress updates still queued for the writer
+            await asyncio.wrap_future(update_progress_soon(progress_id,
+                                                           completed=len(selected_urls),
+                                                           total=len(selected_urls),
+                                                           message=with_cache_counts('Export completed!'),
+                                                           finished=True,
+                                                           errors=errors,
+                                                           rejections=rejections,
+                                                           preview=preview,
+                                                           truncated=truncated,
+                                                           result_file=result_file,
+                                                           result_bytes=result_bytes))
         except Exception as e:
-            with progress_lock:
-                if progress_id in progress_data:
-                    progress_data[progress_id].update({
-                        'message': f'Error: {str(e)}',
-                        'finished': True,
-                        'errors': [str(e)]
-                    })
-        finally:
-            loop.close()
+            await asyncio.wrap_future(update_progress_soon(progress_id,
+                                                           message=f'Error: {str(e)}',
+                                                           finished=True,
+                                                           errors=[str(e)]))
     
-    # Start background thread
-    thread = threading.Thread(target=run_export)
-    thread.daemon = True
-    thread.start()
+    def queued(position):
+        update_progress_soon(progress_id, queue_position=position,
+                             message=f'Waiting for other exports to finish, position {position} in line')
+
+    # Queue it, EXPORT_MAX_JOBS exports run at once
+    export_loop.submit(run_export(), on_queued=queued)
     
     # Redirect to progress page
     return redirect(url_for('docs_exporter.exporting', progress_id=progress_id))
@@ -196,25 +412,60 @@ def export():
 @docs_exporter_bp.route('/result/<progress_id>')
 def result(progress_id):
     """Show results after export completion"""
-    with progress_lock:
-        if progress_id not in progress_data:
-            flash('Export session not found')
-            return redirect(url_for('docs_exporter.index'))
-        
-        data = progress_data[progress_id]
-        if not data.get('finished', False):
-            return redirect(url_for('docs_exporter.exporting', progress_id=progress_id))
-        
-        # Get results and clean up
-        content = data.get('content')
-        errors = data.get('errors', [])
-        rejections = data.get('rejections', [])
-        
-        # Clean up progress data
-        del progress_data[progress_id]
+    # Kept until PROGRESS_TTL or the byte budget drops it, for the download
+    data = progress_store.get(progress_id)
+    if data is None:
+        flash('Export session not found')
+        return redirect(url_for('docs_exporter.index'))
+
+    if not data.get('finished', False):
+        return redirect(url_for('docs_exporter.exporting', progress_id=progress_id))
+
+    # Get results, the whole file when it is small enough, else the preview and a link to the download
+    content = data.get('preview')
+    truncated = data.get('truncated', False)
+    errors = data.get('errors', [])
+    rejections = data.get('rejections', [])
     
     if errors:
         for error in errors:
             flash(error)
     
-    return render_template('docs_exporter/result.html', content=content, errors=errors, rejections=rejections)
+    download_url = url_for('docs_exporter.download', progress_id=progress_id) if data.get('result_file') else None
+    if truncated and download_url and data.get('result_bytes', 0) <= RESULT_INLINE_BYTES:
+        try:
+            with open(data['result_file'], encoding='utf-8') as f:
+                content, truncated = f.read(), False
+        except FileNotFoundError:
+            pass  # Dropped by the store meanwhile, the preview is all there is
+    if truncated and download_url:
+        link = url_for('docs_exporter.download', progress_id=progress_id, _external=True)
+        flash(f'Showing the first {RESULT_PREVIEW_CHARS:,} characters, download the whole export '
+              f'({data.get("result_bytes", 0):,} bytes) from {link}')
+    return render_template('docs_exporter/result.html', content=content, errors=errors, rejections=rejections,
+                           truncated=truncated, download_url=download_url,
+                           result_bytes=data.get('result_bytes', 0))
+
+@docs_exporter_bp.route('/download/<progress_id>')
+def download(progress_id):
+    """Streams the whole result from its spool file, gzip-compressed on the fly if the client accepts it"""
+    data = progress_store.get(progress_id) or {}
+    try:
+        # Opened before anything else, the store may drop it any time
+        f = open(data['result_file'], 'rb') if data.get('result_file') else None
+    except FileNotFoundError:
+        f = None
+    if f is None:
+        flash('Export session not found')
+        return redirect(url_for('docs_exporter.index'))
+
+    if request.accept_encodings['gzip']:
+        response = Response(gzip_chunks(f), mimetype='text/plain')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Content-Disposition'] = 'attachment; filename=docs-export.txt'
+    else:
+        response = send_file(f, mimetype='text/plain', as_attachment=True, download_name='docs-export.txt')
+        response.content_length = data['result_bytes']
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,207 @@
+import asyncio
+import contextvars
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+
+class Job:
+    __slots__ = ('fetching',)
+
+    def __init__(self):
+        self.fetching = 0
+
+
+# The job a coroutine runs for, inherited by the tasks it starts
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class ExportLoop:
+    """
+    One event loop thread per worker process running the docs exports,
+    instead of a new thread and event loop for every export.
+
+    submit() queues a coroutine on the loop and returns a concurrent future.
+    At most max_jobs run at once, the others wait in submission order and
+    on_queued(position) tells them their place in line whenever it changes.
+
+    The jobs share max_fetches requests in flight: a job takes one with
+    fetch_slot(), and a freed slot goes to the waiting job with the fewest
+    requests in flight, so a large export can't hold back the small ones.
+    session() is the loop's aiohttp session, shared by the jobs: its
+    connections stay open between them (keepalive_timeout), at most
+    limit_per_host to a host and max_fetches overall, and DNS answers are
+    cached for dns_ttl seconds.
+
+    The thread starts on the first submit(), so a worker forked from a
+    process that imported this module gets its own.
+    """
+
+    def __init__(self, max_jobs=4, limit_per_host=8, max_fetches=16, keepalive_timeout=30, dns_ttl=300):
+        self.max_jobs = max_jobs
+        self.limit_per_host = limit_per_host
+        self.max_fetches = max_fetches
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.loop = None
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+        self._queue = deque()  # (turn future, on_queued) of the jobs waiting to start
+        self._fetch_waiters = OrderedDict()  # Job -> deque of futures waiting for a fetch slot
+        self._default_job = Job()
+        self.running = 0
+        self.completed = 0
+        self.fetching = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, name='export-loop', daemon=True)
+            self._thread.start()
+
+    def submit(self, coroutine, on_queued=None):
+        """
+        Runs the coroutine on the loop once a job slot is free, returns its
+        concurrent.futures.Future. on_queued(position), called on the loop,
+        is told the job's place in line while it waits, 1 being next.
+        """
+        self._start()
+        return asyncio.run_coroutine_threadsafe(self._run(coroutine, on_queued), self.loop)
+
+    async def _run(self, coroutine, on_queued):
+        if self.running >= self.max_jobs or self._queue:
+            turn = self.loop.create_future()
+            self._queue.append((turn, on_queued))
+            self._report_positions(len(self._queue) - 1)
+            try:
+                await turn  # _job_done counted it as running
+            except asyncio.CancelledError:
+                if turn.done() and not turn.cancelled():
+                    self._job_done()
+                elif (turn, on_queued) in self._queue:
+                    index = self._queue.index((turn, on_queued))
+                    del self._queue[index]
+                    self._report_positions(index)
+                coroutine.close()
+                raise
+        else:
+            self.running += 1
+
+        current_job.set(Job())
+        try:
+            return await coroutine
+        finally:
+            self._job_done()
+
+    def _job_done(self):
+        self.running -= 1
+        self.completed += 1
+        changed = False
+        while self._queue and self.running < self.max_jobs:
+            turn, _ = self._queue.popleft()
+            if turn.cancelled():
+                continue
+            self.running += 1
+            turn.set_result(None)
+            changed = True
+        if changed:
+            self._report_positions()
+
+    def _report_positions(self, start=0):
+        # The jobs from start on, whose place in line changed
+        for position in range(start + 1, len(self._queue) + 1):
+            on_queued = self._queue[position - 1][1]
+            if on_queued is not None:
+                try:
+                    on_queued(position)
+                except Exception:
+                    pass  # Only a progress message
+
+    @asynccontextmanager
+    async def fetch_slot(self):
+        """One of the max_fetches requests in flight, for the job this is called from."""
+        job = current_job.get() or self._default_job
+        if self.fetching < self.max_fetches and not self._fetch_waiters:
+            self._grant(job)
+        else:
+            granted = self.loop.create_future()
+            self._fetch_waiters.setdefault(job, deque()).append(granted)
+            try:
+                await granted  # _release granted it
+            except asyncio.CancelledError:
+                if granted.done() and not granted.cancelled():
+                    self._release(job)
+                else:
+                    waiters = self._fetch_waiters.get(job)
+                    if waiters is not None and granted in waiters:
+                        waiters.remove(granted)
+                        if not waiters:
+                            del self._fetch_waiters[job]
+                raise
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    def _grant(self, job):
+        self.fetching += 1
+        job.fetching += 1
+
+    def _release(self, job):
+        self.fetching -= 1
+        job.fetching -= 1
+        while self._fetch_waiters and self.fetching < self.max_fetches:
+            # The waiting job with the fewest requests in flight, the first in line on a tie
+            waiting = min(self._fetch_waiters, key=lambda waiting: waiting.fetching)
+            waiters = self._fetch_waiters.pop(waiting)
+            granted = waiters.popleft()
+            if waiters:
+                self._fetch_waiters[waiting] = waiters  # To the back of the line
+            if granted.cancelled():
+                continue
+            self._grant(waiting)
+            granted.set_result(None)
+
+    async def session(self):
+        """The shared aiohttp session, call from a job."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_fetches, limit_per_host=self.limit_per_host,
+                                             ttl_dns_cache=self.dns_ttl, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def stats(self):
+        return {
+            'max_jobs': self.max_jobs,
+            'running': self.running,
+            'queued': len(self._queue),
+            'completed': self.completed,
+            'max_fetches': self.max_fetches,
+            'fetching': self.fetching,
+        }
+
+    def stop(self, timeout=5):
+        """Closes the session and stops the loop, the jobs still running are cancelled."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+
+        async def close():
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+            if self._session is not None:
+                await self._session.close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close(), self.loop).result(timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            thread.join(timeout)
+            self.loop.close()
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from contextlib import nullcontext
+from os import path, makedirs
+from time import time
+
+try:
+    from .progress_store import immediate
+except ImportError:
+    from progress_store import immediate
+
+# PRAGMA user_version of the SQLite file's layout
+SCHEMA_VERSION = 1
+
+
+class PageCache:
+    """
+    Fetched documentation pages, keyed on their URL, in an SQLite file shared
+    by every worker process and kept between exports.
+
+    A page is stored with its ETag and Last-Modified and the result of
+    parsing it, and revalidated with a conditional GET on the next fetch:
+    a 304 skips both the download and the parse. Pages the server gives no
+    validators for, or marks no-store, are not stored. Beyond max_bytes the
+    least recently used pages are evicted. The hits, misses and evicted
+    counts are this process's.
+
+    fetch() runs on the export loop, so its reads and writes of the file go
+    to the loop's default executor; get() and put() block.
+    """
+
+    def __init__(self, filename, max_bytes=128 * 1024 * 1024):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        directory = path.dirname(path.abspath(filename))
+        if not path.exists(directory):
+            makedirs(directory)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit, transactions are opened explicitly
+            connection = sqlite3.connect(self.filename, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            # Only a cache, a file of another layout is started over. Checked before taking the
+            # write lock, so opening a connection doesn't wait for another worker's write.
+            if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                with immediate(connection):
+                    if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                        connection.execute('DROP TABLE IF EXISTS pages')
+                        connection.execute('CREATE TABLE pages (url TEXT PRIMARY KEY, etag TEXT, '
+                                           'last_modified TEXT, parsed TEXT NOT NULL, size INTEGER NOT NULL, '
+                                           'used REAL NOT NULL)')
+                        connection.execute('CREATE INDEX pages_used ON pages (used)')
+                        connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._local.connection = connection
+        return connection
+
+    def get(self, url):
+        """(etag, last_modified, parsed) of the stored page, None when there is none."""
+        row = self._connection().execute('SELECT etag, last_modified, parsed FROM pages WHERE url = ?',
+                                         (url,)).fetchone()
+        return (row[0], row[1], json.loads(row[2])) if row else None
+
+    def put(self, url, etag, last_modified, parsed):
+        encoded = json.dumps(parsed)
+        size = len(url) + len(encoded)
+        connection = self._connection()
+        with immediate(connection):
+            connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                               (url, etag, last_modified, encoded, size, time()))
+            self._evict(connection, url)
+
+    def _touch(self, url):
+        self._connection().execute('UPDATE pages SET used = ? WHERE url = ?', (time(), url))
+
+    def _evict(self, connection, keep):
+        # Least recently used first, never the page just stored
+        if not self.max_bytes:
+            return
+        retained = connection.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if retained <= self.max_bytes:
+            return
+        for url, size in connection.execute('SELECT url, size FROM pages WHERE url != ? ORDER BY used',
+                                            (keep,)).fetchall():
+            connection.execute('DELETE FROM pages WHERE url = ?', (url,))
+            self.evicted += 1
+            retained -= size
+            if retained <= self.max_bytes:
+                return
+
+    async def fetch(self, session, url, parse, **kwargs):
+        """
+        parse(html) of the page at url, fetched with the aiohttp session, and
+        whether it came from the cache. parse's result must be JSON
+        serialisable; kwargs go to session.get.
+        """
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(None, self.get, url)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if stored is not None:
+            if stored[0]:
+                headers['If-None-Match'] = stored[0]
+            if stored[1]:
+                headers['If-Modified-Since'] = stored[1]
+
+        async with session.get(url, headers=headers, **kwargs) as response:
+            if response.status == 304 and stored is not None:
+                self.hits += 1
+                await loop.run_in_executor(None, self._touch, url)
+                return stored[2], True
+            response.raise_for_status()
+            html = await response.text()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            no_store = 'no-store' in response.headers.get('Cache-Control', '').lower()
+
+        self.misses += 1
+        parsed = parse(html)
+        if (etag or last_modified) and not no_store:
+            await loop.run_in_executor(None, self.put, url, etag, last_modified, parsed)
+        return parsed, False
+
+    def for_job(self, fetch_slot=None):
+        """
+        A view of the cache counting one export's hits and misses. Each of its
+        requests holds a fetch_slot(), ExportLoop.fetch_slot for the shared budget.
+        """
+        return JobPageCache(self, fetch_slot)
+
+    def stats(self):
+        pages, retained = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages').fetchone()
+        return {
+            'pages': pages,
+            'retained_bytes': retained,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted,
+        }
+
+
+class JobPageCache:
+    """The page cache as one export sees it, with that export's hits and misses."""
+
+    def __init__(self, cache, fetch_slot=None):
+        self.cache = cache
+        self.fetch_slot = fetch_slot
+        self.hits = 0
+        self.misses = 0
+
+    async def fetch(self, session, url, parse, **kwargs):
+        async with self.fetch_slot() if self.fetch_slot else nullcontext():
+            parsed, hit = await self.cache.fetch(session, url, parse, **kwargs)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return parsed, hit
+
+    def describe(self):
+        """For the progress messages, empty before the first page."""
+        if not self.hits and not self.misses:
+            return ''
+        return f"{self.hits} unchanged from cache, {self.misses} downloaded"
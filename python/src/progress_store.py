@@ -0,0 +1,346 @@
+import json
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import path, makedirs, remove
+from time import time, sleep
+
+# PRAGMA user_version of the SQLite file's layout
+SCHEMA_VERSION = 4
+
+
+def discard_file(filename):
+    if filename:
+        try:
+            remove(filename)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def immediate(connection):
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can't both read the old entry
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+class ProgressStore:
+    """
+    Progress and results of docs exports, keyed on their progress id.
+
+    Finished entries not updated for ttl seconds, exports whose result nobody
+    fetched, are dropped by sweep() and whenever an export starts. Unfinished
+    ones, which may wait in line for longer, only after unfinished_ttl seconds
+    without an update: their export is gone, e.g. with the worker that ran it.
+    When the entries take more than max_bytes, the finished ones are evicted
+    oldest first; unfinished exports are never evicted. A limit of 0 disables
+    it.
+
+    An entry can keep its result in a file, named by its result_file field
+    with result_bytes bytes. The file counts toward max_bytes and is deleted
+    with the entry.
+    """
+
+    # Whether other processes update the entries, so streams can't rely on notify_progress alone
+    shared = False
+
+    def __init__(self, ttl=3600, max_bytes=64 * 1024 * 1024, unfinished_ttl=24 * 3600):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.unfinished_ttl = unfinished_ttl
+        self.expired = 0
+        self.evicted = 0
+
+    def _cutoffs(self, now):
+        # (finished, unfinished), entries last updated before these times expire
+        return (now - self.ttl if self.ttl else float('-inf'),
+                now - self.unfinished_ttl if self.unfinished_ttl else float('-inf'))
+
+
+class Entry:
+    __slots__ = ('data', 'updated', 'version', 'size')
+
+    def __init__(self, data, updated, version):
+        self.data = data
+        self.updated = updated
+        self.version = version
+        # The strings dominate, and the result file
+        self.size = (sum(sys.getsizeof(value) for value in data.values() if isinstance(value, str)) +
+                     data.get('result_bytes', 0))
+
+
+class MemoryProgressStore(ProgressStore):
+    """Keeps the entries in this process, so it only works with a single worker."""
+
+    def __init__(self, ttl=3600, max_bytes=64 * 1024 * 1024, unfinished_ttl=24 * 3600):
+        super().__init__(ttl, max_bytes, unfinished_ttl)
+        self._entries = OrderedDict()  # progress_id -> Entry, least recently updated first
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+    def _put(self, progress_id, entry):
+        previous = self._entries.pop(progress_id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+            if previous.data.get('result_file') != entry.data.get('result_file'):
+                discard_file(previous.data.get('result_file'))
+        self._entries[progress_id] = entry
+        self._bytes += entry.size
+
+    def _remove(self, progress_id):
+        entry = self._entries.pop(progress_id)
+        self._bytes -= entry.size
+        discard_file(entry.data.get('result_file'))
+
+    def _expire(self, now):
+        finished_before, unfinished_before = self._cutoffs(now)
+        expired = []
+        for progress_id, entry in self._entries.items():
+            if entry.updated >= max(finished_before, unfinished_before):
+                break
+            if entry.updated < (finished_before if entry.data.get('finished') else unfinished_before):
+                expired.append(progress_id)
+        for progress_id in expired:
+            self._remove(progress_id)
+        self.expired += len(expired)
+
+    def _evict(self, keep):
+        # Oldest finished first, never the entry just written
+        if not self.max_bytes or self._bytes <= self.max_bytes:
+            return
+        for progress_id in [key for key, entry in self._entries.items() if entry.data.get('finished') and key != keep]:
+            self._remove(progress_id)
+            self.evicted += 1
+            if self._bytes <= self.max_bytes:
+                return
+
+    def create(self, progress_id, data):
+        now = time()
+        with self._lock:
+            self._expire(now)
+            self._put(progress_id, Entry(dict(data), now, 1))
+            self._evict(progress_id)
+
+    def update(self, progress_id, fields):
+        """Merges fields into the entry and bumps its version, False when there is none."""
+        with self._lock:
+            entry = self._entries.get(progress_id)
+            if entry is None:
+                return False
+            self._put(progress_id, Entry(dict(entry.data, **fields), time(), entry.version + 1))
+            self._evict(progress_id)
+            return True
+
+    def get_newer(self, progress_id, version):
+        """(version, entry) with entry None when the version is unchanged, None when there is none."""
+        with self._lock:
+            entry = self._entries.get(progress_id)
+            if entry is None:
+                return None
+            return entry.version, (dict(entry.data) if entry.version != version else None)
+
+    def get(self, progress_id):
+        """A copy of the entry, None when there is none."""
+        with self._lock:
+            entry = self._entries.get(progress_id)
+            return dict(entry.data) if entry else None
+
+    def sweep(self):
+        with self._lock:
+            self._expire(time())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'jobs': len(self._entries),
+                'running': sum(1 for entry in self._entries.values() if not entry.data.get('finished')),
+                'retained_bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
+
+
+class SQLiteProgressStore(ProgressStore):
+    """
+    Keeps the entries in an SQLite file, shared by every worker process on
+    the machine, so a progress stream or result request can land on another
+    worker than the export. Each thread gets its own connection, opened on
+    first use, and updates are read-modify-write in an immediate transaction
+    so concurrent writers don't lose fields. The expired and evicted counts
+    are this process's.
+    """
+
+    shared = True
+
+    def __init__(self, filename, ttl=3600, max_bytes=64 * 1024 * 1024, unfinished_ttl=24 * 3600):
+        super().__init__(ttl, max_bytes, unfinished_ttl)
+        self.filename = filename
+        self._local = threading.local()
+        directory = path.dirname(path.abspath(filename))
+        if not path.exists(directory):
+            makedirs(directory)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit, transactions are opened explicitly
+            connection = sqlite3.connect(self.filename, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with immediate(connection):
+                # The entries only live for an export, a file of an older layout is started over
+                if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                    connection.execute('DROP TABLE IF EXISTS progress')
+                    connection.execute('CREATE TABLE progress (id TEXT PRIMARY KEY, data TEXT NOT NULL, '
+                                       'updated REAL NOT NULL, version INTEGER NOT NULL, '
+                                       'finished INTEGER NOT NULL, size INTEGER NOT NULL, file TEXT)')
+                    connection.execute('CREATE INDEX progress_updated ON progress (updated)')
+                    connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._local.connection = connection
+        return connection
+
+    def _expire(self, connection, now):
+        if not self.ttl and not self.unfinished_ttl:
+            return
+        for progress_id, filename in connection.execute('SELECT id, file FROM progress '
+                                                        'WHERE updated < CASE WHEN finished THEN ? ELSE ? END',
+                                                        self._cutoffs(now)).fetchall():
+            connection.execute('DELETE FROM progress WHERE id = ?', (progress_id,))
+            discard_file(filename)
+            self.expired += 1
+
+    def _evict(self, connection, keep):
+        # Oldest finished first, never the entry just written
+        if not self.max_bytes:
+            return
+        retained = connection.execute('SELECT COALESCE(SUM(size), 0) FROM progress').fetchone()[0]
+        if retained <= self.max_bytes:
+            return
+        for progress_id, size, filename in connection.execute('SELECT id, size, file FROM progress '
+                                                              'WHERE finished AND id != ? ORDER BY updated',
+                                                              (keep,)).fetchall():
+            connection.execute('DELETE FROM progress WHERE id = ?', (progress_id,))
+            discard_file(filename)
+            self.evicted += 1
+            retained -= size
+            if retained <= self.max_bytes:
+                return
+
+    def create(self, progress_id, data):
+        now = time()
+        encoded = json.dumps(data)
+        connection = self._connection()
+        with immediate(connection):
+            self._expire(connection, now)
+            connection.execute('INSERT OR REPLACE INTO progress VALUES (?, ?, ?, 1, ?, ?, ?)',
+                               (progress_id, encoded, now, bool(data.get('finished')),
+                                len(encoded) + data.get('result_bytes', 0), data.get('result_file')))
+            self._evict(connection, progress_id)
+
+    def update(self, progress_id, fields):
+        """Merges fields into the entry and bumps its version, False when there is none."""
+        connection = self._connection()
+        with immediate(connection):
+            row = connection.execute('SELECT data, file FROM progress WHERE id = ?', (progress_id,)).fetchone()
+            if row is None:
+                return False
+            data = dict(json.loads(row[0]), **fields)
+            encoded = json.dumps(data)
+            connection.execute('UPDATE progress SET data = ?, updated = ?, version = version + 1, finished = ?, '
+                               'size = ?, file = ? WHERE id = ?',
+                               (encoded, time(), bool(data.get('finished')), len(encoded) + data.get('result_bytes', 0),
+                                data.get('result_file'), progress_id))
+            if row[1] != data.get('result_file'):
+                discard_file(row[1])
+            self._evict(connection, progress_id)
+            return True
+
+    def get_newer(self, progress_id, version):
+        """(version, entry) with entry None when the version is unchanged, None when there is none."""
+        row = self._connection().execute('SELECT version, CASE WHEN version IS NOT ? THEN data END FROM progress '
+                                          'WHERE id = ?', (version, progress_id)).fetchone()
+        if row is None:
+            return None
+        return row[0], (json.loads(row[1]) if row[1] is not None else None)
+
+    def get(self, progress_id):
+        """The entry, None when there is none."""
+        row = self._connection().execute('SELECT data FROM progress WHERE id = ?', (progress_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def sweep(self):
+        connection = self._connection()
+        with immediate(connection):
+            self._expire(connection, time())
+
+    def data_version(self):
+        """Changes whenever another connection commits to the file, a cheap check for other workers' updates."""
+        return self._connection().execute('PRAGMA data_version').fetchone()[0]
+
+    def stats(self):
+        jobs, running, retained = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(NOT finished), 0), COALESCE(SUM(size), 0) FROM progress').fetchone()
+        return {
+            'jobs': jobs,
+            'running': running,
+            'retained_bytes': retained,
+            'max_bytes': self.max_bytes,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+
+def make_progress_store(kind, filename, ttl=3600, max_bytes=64 * 1024 * 1024, unfinished_ttl=24 * 3600):
+    """The store for PROGRESS_STORE, 'sqlite' (shared between workers) or 'memory' (one worker)."""
+    if kind == 'memory':
+        return MemoryProgressStore(ttl, max_bytes, unfinished_ttl)
+    if kind == 'sqlite':
+        return SQLiteProgressStore(filename, ttl, max_bytes, unfinished_ttl)
+    raise ValueError(f"Unknown progress store {kind!r}, expected sqlite or memory")
+
+
+def start_sweeper(store, interval):
+    """Daemon thread dropping the store's expired entries every interval seconds, even with no new exports."""
+    def sweep():
+        while True:
+            sleep(interval)
+            try:
+                store.sweep()
+            except sqlite3.Error:
+                pass  # The file is busy, next interval
+    thread = threading.Thread(target=sweep, name='progress-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+def start_watcher(store, interval, on_change, active):
+    """
+    Daemon thread calling on_change() whenever another connection committed
+    to the SQLite store's file, checked with data_version() every interval
+    seconds while the active event is set; it blocks while it is not. Also
+    called whenever it starts watching, as the file may have changed since.
+    """
+    def watch():
+        while True:
+            active.wait()
+            version = None
+            while active.is_set():
+                try:
+                    current = store.data_version()
+                    if current != version:
+                        on_change()
+                        version = current
+                except sqlite3.Error:
+                    pass  # The file is busy, the next interval
+                sleep(interval)
+    thread = threading.Thread(target=watch, name='progress-watcher', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from os import path, makedirs
+
+# Request fields cut to LOG_EXPRESSION_CHARS when written
+LONG_FIELDS = ('expression', 'result')
+
+
+class RequestFormatter(logging.Formatter):
+    """
+    Formats the request log as text lines or as JSON lines.
+
+    Request records are logged with a dict of fields as their only argument,
+    e.g. app_logger.info("%(ip)s | %(expression)s", fields), and the message is
+    only built here, on the writer thread. The expression and result are cut to
+    max_chars (0 keeps them whole), and JSON lines carry the fields themselves
+    plus the expression's length and a hash that identifies it in full.
+    """
+
+    def __init__(self, json_lines=False, max_chars=1000):
+        super().__init__('%(asctime)s | %(levelname)s | %(message)s')
+        self.json_lines = json_lines
+        self.max_chars = max_chars
+
+    def cut(self, value):
+        if not self.max_chars or len(value) <= self.max_chars:
+            return value
+        return f"{value[:self.max_chars]}... (+{len(value) - self.max_chars} chars)"
+
+    def format(self, record):
+        if not isinstance(record.args, dict):
+            if self.json_lines:
+                return json.dumps({'time': self.formatTime(record), 'level': record.levelname,
+                                   'message': record.getMessage()})
+            return super().format(record)
+
+        fields = dict(record.args)
+        for name in LONG_FIELDS:
+            if isinstance(fields.get(name), str):
+                fields[name] = self.cut(fields[name])
+        if not self.json_lines:
+            return f"{self.formatTime(record)} | {record.levelname} | {record.msg % fields}"
+
+        expression = record.args.get('expression')
+        if isinstance(expression, str):
+            fields['expression_hash'] = hashlib.sha256(expression.encode()).hexdigest()[:16]
+            fields['length'] = len(expression)
+        if 'latency_ms' in fields:
+            fields['latency_ms'] = round(fields['latency_ms'], 3)
+        return json.dumps(dict({'time': self.formatTime(record), 'level': record.levelname}, **fields),
+                          ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Passes a random sample_rate share of the INFO records and every warning and error."""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.sample_rate
+
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue for the writer thread, unformatted, and
+    drops them when the queue is full rather than wait for a stalled disk.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting is the listener's job, the record stays in this process
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RequestQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room on a full queue instead of failing to stop
+        self.queue.put(self._sentinel)
+
+
+class RequestLog:
+    """
+    Writes a logger's records to app.log, and its errors also to error.log,
+    from a background thread.
+
+    With max_bytes 0 the files are only appended to, and reopened when they
+    are moved away, so several worker processes can share them and an
+    external logrotate rotates them. Otherwise they rotate at max_bytes and
+    keep `backups` old files, which only works with a single process: two
+    processes rotating the same file lose lines or write to the wrong file.
+    """
+
+    def __init__(self, logger, directory='logs', json_lines=False, max_chars=1000, sample_rate=1.0,
+                 max_bytes=0, backups=5, queue_size=10000):
+        if not path.exists(directory):
+            makedirs(directory)
+        formatter = RequestFormatter(json_lines, max_chars)
+        handlers = []
+        for name, level in (('app.log', logging.INFO), ('error.log', logging.ERROR)):
+            if max_bytes:
+                handler = logging.handlers.RotatingFileHandler(path.join(directory, name), maxBytes=max_bytes,
+                                                               backupCount=backups, encoding='utf-8')
+            else:
+                handler = logging.handlers.WatchedFileHandler(path.join(directory, name), encoding='utf-8')
+            handler.setLevel(level)
+            handler.setFormatter(formatter)
+            handlers.append(handler)
+
+        self.handler = RequestQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(SamplingFilter(sample_rate))
+        self.listener = RequestQueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self.logger = logger
+        logger.addHandler(self.handler)
+        self.listener.start()
+
+    def stats(self):
+        return {'queued': self.handler.queue.qsize(), 'dropped': self.handler.dropped}
+
+    def stop(self):
+        # Writes out what is still queued
+        if self.handler in self.logger.handlers:
+            self.logger.removeHandler(self.handler)
+            self.listener.stop()
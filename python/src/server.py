@@ -1,13 +1,23 @@
-from flask import Flask, jsonify, request, send_from_directory, render_template, make_response
+from flask import Flask, jsonify, request, send_from_directory, send_file, render_template, make_response, abort
 from flask_cors import CORS
-from translatelatex import translate
-from docs_exporter_blueprint import docs_exporter_bp
+from werkzeug.datastructures import EnvironHeaders
+from werkzeug.http import parse_etags, HTTP_STATUS_CODES
+from werkzeug.wsgi import get_content_length, get_input_stream
+from translatelatex import translate, PATTERNS, ENGINES, STAGE_STATS, STAGE_TIMINGS, TranslationTimeout, OutputTooLong
+from translation_cache import TranslationCache, SETTING_DEFAULTS
+from translation_pool import TranslationPool
+from request_log import RequestLog
+from admission import AdmissionControl, Rejected
+from static_assets import StaticAssets, IMMUTABLE
+from docs_exporter_blueprint import docs_exporter_bp, progress_store, export_loop, page_cache
+import hashlib
+import json
 import logging
-from time import time
-from os import path, makedirs
+from time import time, monotonic
+from os import path
 import os
 import atexit
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -15,12 +25,72 @@ load_dotenv(dotenv_path=path.join(path.dirname(path.dirname(path.dirname(__file_
 
 TRANSLATION_TIMEOUT = int(os.environ.get('TRANSLATION_TIMEOUT', '30'))
 TRANSLATION_WORKERS = int(os.environ.get('TRANSLATION_WORKERS', '4'))
+# "tree" translates with the tree backend where it supports the expression and
+# with the regex pipeline otherwise, see compare_engines.py for its coverage
+TRANSLATION_ENGINE = os.environ.get('TRANSLATION_ENGINE', 'regex')
+if TRANSLATION_ENGINE not in ENGINES:
+    raise RuntimeError(f"TRANSLATION_ENGINE must be one of {', '.join(ENGINES)}, not {TRANSLATION_ENGINE!r}")
+# Per-stage timings for every translation, otherwise only for requests with "timings": true
+TRANSLATION_PROFILING = bool(int(os.environ.get('TRANSLATION_PROFILING', '0')))
+# "process" translates in pre-started worker processes, on all cores, and kills a
+# worker whose translation times out. "thread" translates in this process, where a
+# timed-out translation keeps running to the end.
+TRANSLATION_EXECUTOR = os.environ.get('TRANSLATION_EXECUTOR', 'thread')
+if TRANSLATION_EXECUTOR not in ('thread', 'process'):
+    raise RuntimeError(f"TRANSLATION_EXECUTOR must be thread or process, not {TRANSLATION_EXECUTOR!r}")
 executor = ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS)
 atexit.register(executor.shutdown, wait=False)
+# In process mode the executor threads only wait for the worker processes. Started
+# with `python server.py`, every worker runs this module again as __mp_main__.
+translation_pool = None
+if TRANSLATION_EXECUTOR == 'process' and __name__ != '__mp_main__':
+    translation_pool = TranslationPool(TRANSLATION_WORKERS)
+    atexit.register(translation_pool.shutdown)
+
+# Result cache in front of the executor, 0 disables either bound
+TRANSLATION_CACHE_ENTRIES = int(os.environ.get('TRANSLATION_CACHE_ENTRIES', '4096'))
+TRANSLATION_CACHE_BYTES = int(os.environ.get('TRANSLATION_CACHE_BYTES', str(32 * 1024 * 1024)))
+translation_cache = TranslationCache(TRANSLATION_CACHE_ENTRIES, TRANSLATION_CACHE_BYTES)
+
+# Most expressions accepted by one /translate/batch request
+TRANSLATION_BATCH_LIMIT = int(os.environ.get('TRANSLATION_BATCH_LIMIT', '1000'))
+
+# Requests over these limits are rejected before they are translated, and with
+# TRANSLATION_MAX_BACKLOG translations queued or running new ones get a 503.
+# 0 disables a limit.
+admission = AdmissionControl(
+    max_body_bytes=int(os.environ.get('TRANSLATION_MAX_BODY_BYTES', str(1024 * 1024))),
+    max_length=int(os.environ.get('TRANSLATION_MAX_LENGTH', '20000')),
+    max_depth=int(os.environ.get('TRANSLATION_MAX_DEPTH', '100')),
+    max_backlog=int(os.environ.get('TRANSLATION_MAX_BACKLOG', str(8 * TRANSLATION_WORKERS))),
+    retry_after=int(os.environ.get('TRANSLATION_RETRY_AFTER', '1')),
+)
+# Most translations of one batch queued or running at once, the rest are
+# submitted as these finish, so a batch takes this much of the backlog
+TRANSLATION_BATCH_IN_FLIGHT = int(os.environ.get('TRANSLATION_BATCH_IN_FLIGHT', str(TRANSLATION_WORKERS)))
+
+# Content-hashed, gzip/brotli precompressed copies of static/, built at startup
+# into STATIC_BUILD_DIR together with an nginx.conf that serves them directly
+STATIC_BUILD_DIR = os.environ.get('STATIC_BUILD_DIR', path.join(path.dirname(path.abspath(__file__)), 'build', 'static'))
+static_assets = StaticAssets(path.join(path.dirname(path.abspath(__file__)), 'static'), STATIC_BUILD_DIR)
+matrix_index = None
+if __name__ != '__mp_main__':
+    static_assets.build()
+    # The matrix pages load everything relative to the page, the base points that at the fingerprinted copies
+    with open(path.join(static_assets.root, 'matrix', 'index.html'), encoding='utf-8') as f:
+        matrix_index = f.read().replace('<head>', f'<head>\n\t\t<base href="{static_assets.url("matrix/")}">', 1)
 
 app = Flask(__name__)
 CORS(app)
 
+@app.context_processor
+def asset_urls():
+    return {'asset_url': static_assets.url}
+
+def matrix_page():
+    # Revalidated on every load, it is what names the current asset versions
+    return matrix_index, 200, {'Content-Type': 'text/html; charset=utf-8', 'Cache-Control': 'no-cache'}
+
 # Configure secret key for session management (required for flash messages in docs-exporter)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY')
 if not app.secret_key:
@@ -29,26 +99,28 @@ if not app.secret_key:
 # Register docs-exporter blueprint
 app.register_blueprint(docs_exporter_bp)
 
-# Ensure the logs directory exists
-if not path.exists('logs'):
-    makedirs('logs')
-
-# Configure logging for general logs
-log_handler = logging.FileHandler('logs/app.log')  # Save logs in the logs folder
-log_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
-log_handler.setFormatter(formatter)
-
-# Configure logging for error logs
-error_log_handler = logging.FileHandler('logs/error.log')  # Separate file for error logs
-error_log_handler.setLevel(logging.ERROR)
-error_log_handler.setFormatter(formatter)
+# Request log, written to logs/app.log and logs/error.log by a background thread.
+# LOG_FORMAT=json writes JSON lines, expressions and results are cut to
+# LOG_EXPRESSION_CHARS (0 keeps them whole), LOG_SAMPLE_RATE is the share of
+# successful translations logged. Every worker appends to the same files, so
+# they are rotated by logrotate; LOG_MAX_BYTES rotates them in the process
+# instead, only for a single worker (LOG_BACKUPS old files).
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+if LOG_FORMAT not in ('text', 'json'):
+    raise RuntimeError(f"LOG_FORMAT must be text or json, not {LOG_FORMAT!r}")
+LOG_EXPRESSION_CHARS = int(os.environ.get('LOG_EXPRESSION_CHARS', '1000'))
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1'))
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', '0'))
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', '5'))
 
 # Set up logger
 app_logger = logging.getLogger('app_logger')
-app_logger.addHandler(log_handler)  # Add general log handler
-app_logger.addHandler(error_log_handler)  # Add error log handler
 app_logger.setLevel(logging.INFO)  # Log at INFO level and above
+request_log = None
+if __name__ != '__mp_main__':
+    request_log = RequestLog(app_logger, 'logs', json_lines=LOG_FORMAT == 'json', max_chars=LOG_EXPRESSION_CHARS,
+                             sample_rate=LOG_SAMPLE_RATE, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS)
+    atexit.register(request_log.stop)
 
 abbreviations = {
 'TI_on': 'TI',
@@ -61,17 +133,300 @@ abbreviations = {
 'units_on': 'UN'
 }
 
+class ActiveSettings:
+    # The abbreviations of the settings that are on, joined only when a log line is written
+    __slots__ = ('settings',)
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def __str__(self):
+        return " ".join([abbr for setting, abbr in abbreviations.items() if self.settings.get(setting, False)])
+
+def engine_version():
+    # Fingerprint of the translation code and backend, so that the ETags of
+    # GET /translate change, and caches miss, when a deploy changes a result
+    digest = hashlib.sha256(TRANSLATION_ENGINE.encode())
+    for module in ('translatelatex.py', 'translatetree.py'):
+        with open(path.join(path.dirname(path.abspath(__file__)), module), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+ENGINE_VERSION = engine_version()
+# How long browsers and nginx may keep a GET /translate response
+TRANSLATION_GET_MAX_AGE = int(os.environ.get('TRANSLATION_GET_MAX_AGE', '86400'))
+
 # Simple timeout handler
 class TimeoutError(Exception):
     pass
 
-def run_translation_with_timeout(expression, timeout, **settings):
-    future = executor.submit(translate, expression, **settings)
+def translation_job(expression, deadline, **kwargs):
+    # Runs on an executor thread. deadline is a monotonic() time: the stages stop
+    # at it themselves, and the worker pool kills a worker that does not.
+    if translation_pool is None:
+        return translate(expression, deadline=deadline, **kwargs)
+    return translation_pool.translate(expression, deadline - monotonic(), deadline=deadline, **kwargs)
+
+def submit_translation(expression, deadline, timings=None, shed=True, **settings):
+    # Repeated formulas are answered from the cache without touching the executor.
+    # Returns the cached result or the executor's future. With shed, a full backlog raises Rejected.
+    result = translation_cache.get(expression, settings)
+    if result is not None:
+        return result
+    if shed:
+        admission.check_backlog()
+    future = executor.submit(translation_job, expression, deadline,
+                             engine=TRANSLATION_ENGINE, timings=timings, **settings)
+    admission.track(future)
+    return future
+
+def run_translation_with_timeout(expression, timeout, timings=None, **settings):
+    future = submit_translation(expression, monotonic() + timeout, timings, **settings)
+    if isinstance(future, str):
+        return future
     try:
-        return future.result(timeout=timeout)
-    except FuturesTimeoutError:
+        result = future.result(timeout=timeout)
+    except (FuturesTimeoutError, TranslationTimeout):
         future.cancel()
         raise TimeoutError("Translation timeout")
+    translation_cache.put(expression, settings, result)
+    return result
+
+def admit_batch(items):
+    # Splits (expression, settings) pairs into {cache key: result} of the cached ones and an
+    # iterator over the (key, (expression, settings)) still to translate, identical pairs once.
+    # A batch is shed as a whole when its share of the backlog is not free.
+    outcomes = {}
+    waiting = {}
+    for expression, settings in items:
+        key = translation_cache.make_key(expression, settings)
+        if key in outcomes or key in waiting:
+            continue
+        result = translation_cache.get(expression, settings)
+        if result is not None:
+            outcomes[key] = result
+        else:
+            waiting[key] = (expression, settings)
+    admission.check_backlog(min(len(waiting), TRANSLATION_BATCH_IN_FLIGHT))
+    return outcomes, iter(waiting.items())
+
+def submit_batch(waiting, deadline, running, outcomes):
+    # Submits pairs from waiting until TRANSLATION_BATCH_IN_FLIGHT are running,
+    # {future: (key, expression, settings)}, and none once the deadline has passed.
+    while len(running) < TRANSLATION_BATCH_IN_FLIGHT and monotonic() < deadline:
+        entry = next(waiting, None)
+        if entry is None:
+            return
+        key, (expression, settings) = entry
+        future = submit_translation(expression, deadline, shed=False, **settings)
+        if isinstance(future, str):
+            outcomes[key] = future
+        else:
+            running[future] = (key, expression, settings)
+
+def finish_batch_item(future, entry, outcomes):
+    key, expression, settings = entry
+    try:
+        outcomes[key] = future.result()
+    except (FuturesTimeoutError, TranslationTimeout):
+        outcomes[key] = TimeoutError("Translation timeout")
+    except Exception as e:
+        outcomes[key] = e
+    else:
+        translation_cache.put(expression, settings, outcomes[key])
+
+def batch_outcomes(items, waiting, running, outcomes):
+    # The outcome of every item in order, the ones not done by the deadline time out
+    for future, (key, _, _) in running.items():
+        future.cancel()
+        outcomes[key] = TimeoutError("Translation timeout")
+    for key, _ in waiting:
+        outcomes[key] = TimeoutError("Translation timeout")
+    return [outcomes[translation_cache.make_key(expression, settings)] for expression, settings in items]
+
+def run_batch_with_timeout(items, timeout):
+    # Translates (expression, settings) pairs on the executor, TRANSLATION_BATCH_IN_FLIGHT at a time.
+    # Returns a result or the exception per item, in order. The timeout covers the whole batch.
+    deadline = monotonic() + timeout
+    outcomes, waiting = admit_batch(items)
+    running = {}
+    submit_batch(waiting, deadline, running, outcomes)
+    while running:
+        done, _ = wait(running, timeout=max(0, deadline - monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            finish_batch_item(future, running.pop(future), outcomes)
+        submit_batch(waiting, deadline, running, outcomes)
+    return batch_outcomes(items, waiting, running, outcomes)
+
+def read_settings(data, defaults):
+    return {setting: data.get(setting, default) for setting, default in defaults.items()}
+
+def server_timing(timings, total_ms):
+    # Server-Timing header value, durations in milliseconds. No stages means a cache hit.
+    if not timings:
+        return f'cache;desc="hit", total;dur={total_ms:.3f}'
+    stages = ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in timings.items())
+    return f"{stages}, total;dur={total_ms:.3f}"
+
+def cors_headers(headers):
+    # What flask_cors adds to the Flask app's responses
+    origin = headers.get('Origin')
+    if origin:
+        return {'Access-Control-Allow-Origin': origin, 'Vary': 'Origin'}
+    return {'Access-Control-Allow-Origin': '*'}
+
+def json_body(body):
+    # Serialized like jsonify: compact, sorted keys and a trailing newline
+    return (json.dumps(body, separators=(',', ':'), sort_keys=True) + '\n').encode()
+
+def client_ip(headers):
+    forwarded_for = headers.get('X-Forwarded-For')
+    if forwarded_for:
+        return forwarded_for.split(',')[0]
+    return headers.get('X-Real-IP')
+
+def request_json():
+    # The JSON body of a Flask request, None when it is not JSON. A body over the
+    # size limit is rejected from its Content-Length, or once that much was read.
+    admission.check_body(request.content_length)
+    if admission.max_body_bytes:
+        body = request.stream.read(admission.max_body_bytes + 1)
+    else:
+        body = request.get_data()
+    admission.check_body(len(body))
+    try:
+        return json.loads(body)
+    except (ValueError, RecursionError):
+        # RecursionError: nested deeper than the parser's stack, still under the size limit
+        return None
+
+def translation_get_request(args):
+    # (expression, settings, etag) of GET /translate?expr=...&settings=TI,UN, where
+    # settings lists the abbreviations of the flags that are on
+    expression = args['expr']
+    admission.check_expression(expression)
+    if 'settings' in args:
+        active = {abbr for abbr in args['settings'].split(',') if abbr}
+        unknown = active - set(abbreviations.values())
+        if unknown:
+            raise Rejected(f"Unknown settings {', '.join(sorted(unknown))}, expected some of {','.join(abbreviations.values())}.")
+        settings = {setting: abbr in active for setting, abbr in abbreviations.items()}
+    else:
+        settings = dict(SETTING_DEFAULTS)
+    key = repr((ENGINE_VERSION, translation_cache.make_key(expression, settings)))
+    return expression, settings, '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+def cacheable_headers(etag):
+    # Also sets the CORS header, a Vary: Origin would split the cache by site
+    return {'ETag': etag, 'Cache-Control': f'public, max-age={TRANSLATION_GET_MAX_AGE}',
+            'Access-Control-Allow-Origin': '*'}
+
+def not_modified(if_none_match, etag):
+    # Weak comparison (RFC 7232 3.2), a proxy compressing the response marks its ETag W/
+    return parse_etags(if_none_match).contains_weak(etag.strip('"'))
+
+# The /translate and /translate/batch request handling below is shared with
+# asgi.py, which awaits the same executor instead of blocking a thread on it.
+
+def translation_request(data):
+    # (expression, settings, timings_requested, timings) of a /translate body.
+    # timings is the dict the stages are timed into, None when not profiling.
+    if not isinstance(data, dict) or not isinstance(data.get('expression', ''), str):
+        raise Rejected('Invalid JSON data.')
+
+    expression = data.get('expression', '')
+
+    # Block overly long and deeply nested expressions
+    admission.check_expression(expression)
+
+    settings = read_settings(data, dict(SETTING_DEFAULTS))
+
+    # Per-stage profiling, "timings": true also returns them in the response body
+    timings_requested = bool(data.get('timings', False))
+    timings = {} if TRANSLATION_PROFILING or timings_requested else None
+    return expression, settings, timings_requested, timings
+
+def translation_response(real_ip, expression, settings, outcome, timings, timings_requested, start_time):
+    # (body, status, headers) of a /translate request, outcome is the result or the exception
+    time_taken = (time() - start_time) * 1000
+    fields = {'ip': real_ip, 'expression': expression, 'settings': ActiveSettings(settings), 'latency_ms': time_taken}
+    if isinstance(outcome, TimeoutError):
+        app_logger.error("%(ip)s | %(expression)s | TIMEOUT | %(latency_ms).2f ms", dict(fields, outcome='timeout'))
+        return {'error': 'Translation timeout. Please try a simpler expression.'}, 408, {}
+    if isinstance(outcome, OutputTooLong):
+        app_logger.error("%(ip)s | %(expression)s | Error: %(error)s | %(latency_ms).2f ms",
+                         dict(fields, outcome='too_long', error=str(outcome)))
+        return {'error': f'The expression grew too long in {outcome.stage}. Please try a simpler expression.'}, 400, {}
+    if isinstance(outcome, Exception):
+        # Log the error in both app.log and error.log
+        app_logger.error("%(ip)s | %(expression)s | Error: %(error)s | %(latency_ms).2f ms",
+                         dict(fields, outcome='error', error=str(outcome)))
+        return {'error': 'An error occurred during translation.'}, 500, {}
+
+    # Log the successful translation along with the active settings
+    app_logger.info("%(ip)s | %(expression)s | %(result)s | %(latency_ms).2f ms | Active Settings: %(settings)s",
+                    dict(fields, outcome='ok', result=outcome))
+    if timings is None:
+        return {'result': outcome}, 200, {}
+
+    body = {'result': outcome}
+    if timings_requested:
+        body['timings'] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+    # Timing-Allow-Origin lets the extension's devtools read the header cross-origin
+    return body, 200, {'Server-Timing': server_timing(timings, time_taken), 'Timing-Allow-Origin': '*'}
+
+def batch_request(data):
+    # (items, results) of a /translate/batch body. items are (index, expression, settings),
+    # results has the errors of malformed items and None for the rest.
+    if not isinstance(data, dict) or not isinstance(data.get('expressions'), list):
+        raise Rejected('Expected a JSON object with an "expressions" list.')
+    if len(data['expressions']) > TRANSLATION_BATCH_LIMIT:
+        raise Rejected(f'At most {TRANSLATION_BATCH_LIMIT} expressions per batch.')
+
+    shared = read_settings(data, dict(SETTING_DEFAULTS))
+    items = []
+    results = [None] * len(data['expressions'])
+    for index, item in enumerate(data['expressions']):
+        if isinstance(item, str):
+            expression, settings = item, shared
+        elif isinstance(item, dict) and isinstance(item.get('expression'), str):
+            expression, settings = item['expression'], read_settings(item, shared)
+        else:
+            results[index] = {'error': 'Expected a string or an object with an "expression" string.'}
+            continue
+        try:
+            admission.check_expression(expression)
+        except Rejected as e:
+            results[index] = {'error': str(e)}
+            continue
+        items.append((index, expression, settings))
+    return items, results
+
+def batch_response(real_ip, items, results, outcomes, start_time):
+    # Fills results with the outcome of every item and logs the batch
+    failed = 0
+    for (index, expression, _), outcome in zip(items, outcomes):
+        if isinstance(outcome, TimeoutError):
+            results[index] = {'error': 'Translation timeout. Please try a simpler expression.'}
+        elif isinstance(outcome, OutputTooLong):
+            results[index] = {'error': f'The expression grew too long in {outcome.stage}. Please try a simpler expression.'}
+        elif isinstance(outcome, Exception):
+            results[index] = {'error': 'An error occurred during translation.'}
+        else:
+            results[index] = {'result': outcome}
+            continue
+        failed += 1
+        app_logger.error("%(ip)s | %(expression)s | BATCH | Error: %(error)s",
+                         {'ip': real_ip, 'expression': expression, 'outcome': 'batch_error', 'error': str(outcome)})
+
+    time_taken = (time() - start_time) * 1000
+    unique = len({translation_cache.make_key(expression, settings) for _, expression, settings in items})
+    app_logger.info("%(ip)s | BATCH | %(expressions)d expressions, %(unique)d unique, %(failed)d failed | %(latency_ms).2f ms",
+                    {'ip': real_ip, 'outcome': 'batch', 'expressions': len(results), 'unique': unique,
+                     'failed': failed, 'latency_ms': time_taken})
+    return {'results': results}
 
 # Serve all files in the 'templates' directory
 @app.route('/')
@@ -88,7 +443,7 @@ def datrix():
     # Default to 2D mode if no parameters specified
     if not request.args:
         return redirect('/datrix?font=greek')
-    return send_from_directory('static/matrix', 'index.html')
+    return matrix_page()
 
 @app.route('/datrix3d')
 def datrix3d():
@@ -96,7 +451,7 @@ def datrix3d():
     # 3D mode with volumetric rendering
     if not request.args:
         return redirect('/datrix3d?font=greek&volumetric=true&version=3d')
-    return send_from_directory('static/matrix', 'index.html')
+    return matrix_page()
 
 @app.route('/megacity')
 def megacity():
@@ -104,7 +459,7 @@ def megacity():
     # Megacity 2D mode
     if not request.args:
         return redirect('/megacity?font=greek&version=megacity')
-    return send_from_directory('static/matrix', 'index.html')
+    return matrix_page()
 
 @app.route('/megacity3d')
 def megacity3d():
@@ -112,7 +467,7 @@ def megacity3d():
     # Megacity 3D mode with volumetric rendering
     if not request.args:
         return redirect('/megacity3d?font=greek&version=megacity&volumetric=true')
-    return send_from_directory('static/matrix', 'index.html')
+    return matrix_page()
 
 @app.route('/datrix/<path:filename>')
 def serve_matrix_files(filename):
@@ -135,64 +490,75 @@ def serve_matrix_assets_root(filename):
 def serve_matrix_shaders_root(filename):
     return send_from_directory('static/matrix/shaders', filename)
 
+# Fingerprinted static files, cached for good when the version in the URL is current
+@app.route('/static/v/<version>/<path:filename>')
+def serve_fingerprinted(version, filename):
+    selected = static_assets.select(filename, request.headers.get('Accept-Encoding', ''))
+    if selected is None:
+        abort(404)
+    asset, file_path, encoding = selected
+    response = send_file(file_path, mimetype=asset.mimetype, etag=f"{asset.digest}-{encoding or 'identity'}",
+                         conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE if static_assets.is_current(filename, version) else 'no-cache'
+    return response
+
 # General static file serving
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory('static', filename)
 
+@app.route('/metrics')
+def metrics():
+    return jsonify({
+        'translation_cache': translation_cache.stats(),
+        'regex_patterns': PATTERNS.stats(),
+        'pipeline_stages': STAGE_STATS.stats(),
+        'stage_timings': STAGE_TIMINGS.stats(),
+        'request_log': request_log.stats() if request_log else {},
+        'admission': admission.stats(),
+        'translation_workers': dict(translation_pool.stats() if translation_pool else {'workers': TRANSLATION_WORKERS},
+                                    mode=TRANSLATION_EXECUTOR),
+        'docs_exporter': dict(progress_store.stats(), export_loop=export_loop.stats(),
+                              page_cache=page_cache.stats() if page_cache else None),
+    })
+
 @app.route('/translate', methods=['POST', 'GET', 'OPTIONS'])
 @app.route('/translate/', methods=['POST', 'GET', 'OPTIONS'])
 def translate_expression():
     if request.method == 'POST':
         # Handle POST requests (e.g., translating an expression)
         start_time = time()
+        real_ip = client_ip(request.headers)
         try:
-            real_ip = request.headers.get('X-Real-IP')
-            forwarded_for = request.headers.get('X-Forwarded-For')
-            if forwarded_for:
-                real_ip = forwarded_for.split(',')[0]
-
-            data = request.json
-            if data is None:
-                return jsonify({'error': 'Invalid JSON data.'}), 400
-                
-            expression = data.get('expression', '')
-            
-            # Block overly long requests
-            if len(expression) > 10000000000:
-                return jsonify({'error': 'Expression too long. Please use shorter expressions.'}), 400
-            
-            settings = {
-                'TI_on': data.get('TI_on', True),
-                'SC_on': data.get('SC_on', False),
-                'constants_on': data.get('constants_on', False),
-                'coulomb_on': data.get('coulomb_on', False),
-                'e_on': data.get('e_on', False),
-                'i_on': data.get('i_on', False),
-                'g_on': data.get('g_on', False),
-                'units_on': data.get('units_on', True)  # Default to True for backward compatibility
-            }
-
-            # Create a string of active settings using the first letter of each setting name
-            active_settings = " ".join([abbr for setting, abbr in abbreviations.items() if settings.get(setting, False)])
-
-            result = run_translation_with_timeout(expression, TRANSLATION_TIMEOUT, **settings)
-            
-            time_taken = (time() - start_time) * 1000
-
-            # Log the successful translation along with the active settings
-            app_logger.info(f"{real_ip} | {expression} | {result} | {time_taken:.2f} ms | Active Settings: {active_settings}")
-            return jsonify({'result': result})
-
-        except TimeoutError:
-            time_taken = (time() - start_time) * 1000
-            app_logger.error(f"{real_ip} | {expression} | TIMEOUT | {time_taken:.2f} ms")
-            return jsonify({'error': 'Translation timeout. Please try a simpler expression.'}), 408
+            expression, settings, timings_requested, timings = translation_request(request_json())
+            outcome = run_translation_with_timeout(expression, TRANSLATION_TIMEOUT, timings=timings, **settings)
+        except Rejected as e:
+            return jsonify({'error': str(e)}), e.status, e.headers
         except Exception as e:
-            time_taken = (time() - start_time) * 1000
-            # Log the error in both app.log and error.log
-            app_logger.error(f"{real_ip} | {expression} | Error: {str(e)} | {time_taken:.2f} ms")
-            return jsonify({'error': 'An error occurred during translation.'}), 500
+            outcome = e
+        body, status, headers = translation_response(real_ip, expression, settings, outcome,
+                                                     timings, timings_requested, start_time)
+        return jsonify(body), status, headers
+
+    elif request.method == 'GET' and 'expr' in request.args:
+        # Cacheable lookups: GET /translate?expr=...&settings=TI,UN answers like POST
+        start_time = time()
+        real_ip = client_ip(request.headers)
+        try:
+            expression, settings, etag = translation_get_request(request.args)
+            if not_modified(request.headers.get('If-None-Match'), etag):
+                return '', 304, cacheable_headers(etag)
+            outcome = run_translation_with_timeout(expression, TRANSLATION_TIMEOUT, **settings)
+        except Rejected as e:
+            return jsonify({'error': str(e)}), e.status, dict(e.headers, **{'Cache-Control': 'no-store'})
+        except Exception as e:
+            outcome = e
+        body, status, headers = translation_response(real_ip, expression, settings, outcome, None, False, start_time)
+        headers.update(cacheable_headers(etag) if status == 200 else {'Cache-Control': 'no-store'})
+        return jsonify(body), status, headers
 
     elif request.method == 'GET':
         # Serve an HTML page
@@ -208,5 +574,77 @@ def translate_expression():
 
     return jsonify({"error": "Method not allowed."}), 405  # For unsupported methods
 
+@app.route('/translate/batch', methods=['POST'])
+def translate_batch():
+    # Translates a list of expressions in one request. Items are strings or objects
+    # with an "expression" and any settings that override the shared ones.
+    start_time = time()
+    real_ip = client_ip(request.headers)
+    try:
+        items, results = batch_request(request_json())
+        outcomes = run_batch_with_timeout([(expression, settings) for _, expression, settings in items],
+                                          TRANSLATION_TIMEOUT)
+    except Rejected as e:
+        return jsonify({'error': str(e)}), e.status, e.headers
+    return jsonify(batch_response(real_ip, items, results, outcomes, start_time))
+
+class TranslateFastPath:
+    """
+    WSGI middleware answering POST /translate without going through Flask.
+
+    The body is read and parsed once and the response is serialized straight
+    to bytes, skipping the request context, routing, the Response object and
+    the CORS hooks. Status, headers and body are the same as the
+    translate_expression view's, every other request goes to the Flask app.
+    """
+
+    PATHS = ('/translate', '/translate/')
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST' or environ.get('PATH_INFO') not in self.PATHS:
+            return self.wsgi_app(environ, start_response)
+
+        start_time = time()
+        headers = EnvironHeaders(environ)
+        real_ip = client_ip(headers)
+        try:
+            expression, settings, timings_requested, timings = translation_request(self.read_json(environ))
+            outcome = run_translation_with_timeout(expression, TRANSLATION_TIMEOUT, timings=timings, **settings)
+        except Rejected as e:
+            return self.respond(start_response, headers, {'error': str(e)}, e.status, e.headers)
+        except Exception as e:
+            outcome = e
+        body, status, response_headers = translation_response(real_ip, expression, settings, outcome,
+                                                              timings, timings_requested, start_time)
+        return self.respond(start_response, headers, body, status, response_headers)
+
+    @staticmethod
+    def read_json(environ):
+        # request_json for a WSGI environ
+        admission.check_body(get_content_length(environ))
+        stream = get_input_stream(environ)
+        body = stream.read(admission.max_body_bytes + 1) if admission.max_body_bytes else stream.read()
+        admission.check_body(len(body))
+        try:
+            return json.loads(body)
+        except (ValueError, RecursionError):
+            return None
+
+    @staticmethod
+    def respond(start_response, request_headers, body, status, headers):
+        content = json_body(body)
+        response_headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(content)))]
+        response_headers.extend(headers.items())
+        response_headers.extend(cors_headers(request_headers).items())
+        start_response(f"{status} {HTTP_STATUS_CODES[status].upper()}", response_headers)
+        return [content]
+
+# On by default, TRANSLATION_FAST_PATH=0 serves POST /translate from the view again
+if bool(int(os.environ.get('TRANSLATION_FAST_PATH', '1'))):
+    app.wsgi_app = TranslateFastPath(app.wsgi_app)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5002)
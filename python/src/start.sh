@@ -104,20 +104,38 @@ else
     exit 1
 fi
 
-# Start server with gunicorn
+# Start server with gunicorn, or with uvicorn when SERVER_MODE=asgi
 MAIN_PY_PATH="./server.py"
 PORT=5002
-WORKERS=4
+# One worker per core, the export progress is shared through progress_store.py
+WORKERS="${WORKERS:-$(nproc 2>/dev/null || echo 4)}"
 GUNICORN_PATH="$VENV_PATH/bin/gunicorn"
+UVICORN_PATH="$VENV_PATH/bin/uvicorn"
+SERVER_MODE="${SERVER_MODE:-wsgi}"
+
+if [[ "$SERVER_MODE" == "asgi" ]]; then
+    if [[ ! -x "$UVICORN_PATH" ]]; then
+        echo "Uvicorn not installed. Please check your requirements.txt."
+        exit 1
+    fi
+
+    echo "Starting ASGI server on port $PORT..."
+    # /translate and the SSE progress streams wait without holding a thread, see asgi.py.
+    if ! "$UVICORN_PATH" --workers $WORKERS --host 0.0.0.0 --port $PORT asgi:app; then
+        echo "Failed to start the server."
+        exit 1
+    fi
+    exit 0
+fi
 
 if [[ ! -x "$GUNICORN_PATH" ]]; then
     echo "Gunicorn not installed. Please check your requirements.txt."
     exit 1
 fi
 
-echo "Starting server on port $PORT with threading support for SSE..."
-# Use single worker with threads for SSE support (multiple workers don't share memory)
-if ! "$GUNICORN_PATH" --limit-request-line 16384 -w 1 --threads 8 --timeout 120 -b 0.0.0.0:$PORT "$(basename "$MAIN_PY_PATH" .py):app"; then
+echo "Starting server on port $PORT with $WORKERS workers and threading support for SSE..."
+# Threads per worker for the SSE streams, the workers share the export progress (PROGRESS_STORE)
+if ! "$GUNICORN_PATH" --limit-request-line 16384 -w $WORKERS --threads 8 --timeout 120 -b 0.0.0.0:$PORT "$(basename "$MAIN_PY_PATH" .py):app"; then
     echo "Failed to start the server."
     exit 1
 fi
@@ -0,0 +1,188 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from os import path
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Already compressed, another pass only costs CPU
+INCOMPRESSIBLE = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.woff', '.woff2', '.gz', '.br', '.zip', '.mp4'}
+MIN_COMPRESS_SIZE = 1024
+mimetypes.add_type('text/javascript', '.js')
+mimetypes.add_type('text/plain', '.glsl')
+mimetypes.add_type('text/plain', '.wgsl')
+
+# Served under /static/v/<version>/, where the version is the hash of a file or of the whole tree
+URL_PREFIX = '/static/v/'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+NGINX_TEMPLATE = """# Generated by static_assets.py when the server starts, do not edit.
+# Include it in the server block so static files never reach Python:
+#     include {build_dir}/nginx.conf;
+
+# Fingerprinted URLs of the current build, cached for good: each file under its
+# own hash, and every file under the hash of the whole tree
+{current}
+# Any other version, from a page built before the file changed, gets the
+# current file revalidated, as from StaticAssets.is_current()
+location ~ ^{prefix}[0-9a-f]+/(.+)$ {{
+    alias {build_dir}/files/$1;
+    gzip_static on;
+    # brotli_static on;  # with the ngx_brotli module
+    add_header Cache-Control "no-cache";
+    add_header Vary Accept-Encoding;
+    add_header Access-Control-Allow-Origin *;
+}}
+
+# Root-level paths of the matrix pages, from before they were fingerprinted
+location ~ ^/(js|lib|assets|shaders)/(.+)$ {{
+    alias {build_dir}/files/matrix/$1/$2;
+    gzip_static on;
+    # brotli_static on;
+    add_header Cache-Control "no-cache";
+}}
+"""
+
+NGINX_CURRENT = """location {match} {url} {{
+    alias {file};
+    gzip_static on;
+    # brotli_static on;
+    add_header Cache-Control "{immutable}";
+    add_header Vary Accept-Encoding;
+    add_header Access-Control-Allow-Origin *;
+}}
+"""
+
+
+def nginx_string(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def write_file(target, data):
+    # Every worker process builds at startup, so each writes its own temporary file
+    temporary = f"{target}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, target)
+
+
+class Asset:
+    __slots__ = ('name', 'digest', 'mimetype', 'variants')
+
+    def __init__(self, name, digest, mimetype, variants):
+        self.name = name
+        self.digest = digest
+        self.mimetype = mimetype
+        # Content-Encoding -> file, None is the uncompressed copy
+        self.variants = variants
+
+
+class StaticAssets:
+    """
+    Content-hashed and precompressed copies of a static directory.
+
+    build() copies every file under root to build_dir/files with .gz and, if the
+    brotli package is installed, .br variants next to it, skipping files whose
+    hash is unchanged since the last build. It also writes build_dir/nginx.conf,
+    which serves the copies without the server. url() gives the fingerprinted
+    URL of a file or directory, select() the variant for an Accept-Encoding.
+    """
+
+    def __init__(self, root, build_dir):
+        self.root = root
+        self.build_dir = build_dir
+        self.assets = {}
+        self.version = None
+
+    def build(self):
+        os.makedirs(self.build_dir, exist_ok=True)
+        manifest_path = path.join(self.build_dir, 'manifest.json')
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            previous = {}
+
+        tree = hashlib.sha256()
+        for directory, subdirectories, files in os.walk(self.root):
+            subdirectories.sort()
+            for filename in sorted(files):
+                source = path.join(directory, filename)
+                name = path.relpath(source, self.root).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    content = f.read()
+                digest = hashlib.sha256(content).hexdigest()[:16]
+                tree.update(f"{name}\0{digest}\0".encode())
+                built = previous.get(name, {})
+                variants = built.get('variants') if built.get('digest') == digest else None
+                if variants is None or not all(path.exists(self._file(name, encoding)) for encoding in variants):
+                    variants = self._write(name, content)
+                self.assets[name] = Asset(name, digest, mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                                          {encoding or None: self._file(name, encoding) for encoding in variants})
+        self.version = tree.hexdigest()[:16]
+
+        write_file(manifest_path, json.dumps({name: {'digest': asset.digest,
+                                                     'variants': [encoding or '' for encoding in asset.variants]}
+                                              for name, asset in self.assets.items()}).encode())
+        write_file(path.join(self.build_dir, 'nginx.conf'), self._nginx_config().encode())
+        return self
+
+    def _nginx_config(self):
+        # Exact locations take precedence over the ^~ prefix, which takes precedence over the regex ones
+        build_dir = path.abspath(self.build_dir)
+        current = [NGINX_CURRENT.format(match='^~', url=nginx_string(f"{URL_PREFIX}{self.version}/"),
+                                        file=nginx_string(f"{build_dir}/files/"), immutable=IMMUTABLE)]
+        for name, asset in sorted(self.assets.items()):
+            current.append(NGINX_CURRENT.format(match='=', url=nginx_string(self.url(name)),
+                                                file=nginx_string(path.abspath(self._file(name, ''))),
+                                                immutable=IMMUTABLE))
+        return NGINX_TEMPLATE.format(build_dir=build_dir, prefix=URL_PREFIX, current='\n'.join(current))
+
+    def _file(self, name, encoding):
+        suffix = {'gzip': '.gz', 'br': '.br'}.get(encoding, '')
+        return path.join(self.build_dir, 'files', *name.split('/')) + suffix
+
+    def _write(self, name, content):
+        # Writes the copy and its compressed variants, returns their encodings ('' is the copy)
+        variants = {'': content}
+        if len(content) >= MIN_COMPRESS_SIZE and path.splitext(name)[1].lower() not in INCOMPRESSIBLE:
+            variants['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                variants['br'] = brotli.compress(content, quality=11)
+        for encoding, data in list(variants.items()):
+            # only kept when it saves a tenth
+            if encoding and len(data) > 0.9 * len(content):
+                del variants[encoding]
+                continue
+            target = self._file(name, encoding)
+            os.makedirs(path.dirname(target), exist_ok=True)
+            write_file(target, data)
+        return list(variants)
+
+    def url(self, name):
+        """Fingerprinted URL of a file, or of a directory (ending in /) by the version of the whole tree."""
+        if name.endswith('/'):
+            return f"{URL_PREFIX}{self.version}/{name}"
+        return f"{URL_PREFIX}{self.assets[name].digest}/{name}"
+
+    def is_current(self, name, version):
+        """Whether a fingerprinted URL's version is the file's current one, so it may be cached for good."""
+        return version in (self.version, self.assets[name].digest)
+
+    def select(self, name, accept_encoding):
+        """(asset, file, Content-Encoding) of the best variant the client accepts, None for an unknown file."""
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        accepted = parse_accept_header(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in asset.variants and accepted.quality(encoding) > 0:
+                return asset, asset.variants[encoding], encoding
+        return asset, asset.variants[None], None
@@ -1,478 +1,1194 @@
+import copy
 import re
 import regex
+import threading
 import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+from time import monotonic, perf_counter
+from types import MappingProxyType
+
+try:
+    from .translatetree import TreeTranslator, Unsupported
+except ImportError:
+    # loaded as a top-level module, like server.py does
+    from translatetree import TreeTranslator, Unsupported
+
+# Translation tables. They are built once at import and shared read-only by
+# every LatexToCalcEngine, dict order matters for the replacement passes.
+
+SYMBOLS = MappingProxyType({
+    #
+    "astem": "°",
+    "\\degree": "°",
+    "\\deg": "°",
+    "\\kertom": "·",
+    "dfrac": "frac",
+    "end": "enj",
+
+    # junk
+    "\\ ": "",
+    "\n": "",
+    "\t": "",
+    " ": "",
+    "‰": "\\left(1/1000\\right)",
+    "‱": "\\left(1/1000000\\right)",
+    "{,}": ",",
+    "$$": "",
+    "\\circ": "∘",
+    "...": "",
+    "\\ldots": "",
+    "\\dots": "",
+
+    # operators, abs, infinity
+    "\\pm": "±",
+    "\\mp": "∓",
+    "\\times": "*ΦcrossΦ",
+    "\\div": "/",
+    "\\cdot": "*",
+    "\\left|": "abs(",
+    "\\right|": ")",
+    "\\infty": "∞",
+
+    # geometry
+    "\\sphericalangle": "∢",
+    "\\angle": "∠",
+    "\\parallel": "∥",
+    "\\nparallel": "∦",
+    "\\mid": "∣",
+    "\\sim": "~",
+    "\\propto": "∝",
+
+    # ≠, ≡, ≢ , ≈
+    "\\neq": "≠",
+    "\\equiv": "≡",
+    "\\not\\equiv": "≢",
+    "\\approx": "≈",
+    "&=": "=",
+
+    # vectors & average value | \bar{\text{i}}+\bar{\text{j}}+\bar{\text{k}} | 𝕚 𝕛 ӄ
+    "\\bar{i}": "𝕚",
+    "\\bar{\\text{i}}": "𝕚",
+    "\\bar{j}": "𝕛",
+    "\\bar{\\text{j}}": "𝕛",
+    "\\bar{k}": "ӄ",
+    "\\bar{\\text{k}}": "ӄ",
+
+#   "\\bar": "",
+#  "\\overline": "",
+
+    # negation ¬
+    "\\neg": "¬",
+
+    # subset ⊂⊆
+    "\\subset": "⊂",
+    "\\subseteq": "⊆",
+
+    # set
+    "\\mathbb{N}": "ℕ",
+    "\\mathbb{Z}": "ℤ",
+    "\\mathbb{Q}": "ℚ",
+    "\\mathbb{R}": "ℝ",
+    "\\mathbb{C}": "ℂ",
+    "\\mathbb{P}": "ℙ",
+    "\\varnothing": "∅",
+
+    # ∈
+    "\\notin": "∉",
+    "\\setminus": "\\",
+    "\\backslash": "\\",
+
+    # ∀ ∃
+    "\\forall": "∀",
+    "\\exists": "∃",
+
+    # logic
+    "\\and": "∧",
+    "\\or": "∨",
+
+    # ∩∪
+    "\\cap": "∩",
+    "\\cup": "∪",
+})
+
+GREEK_LETTERS = MappingProxyType({
+    '\\Alpha': 'Α',
+    '\\Beta': 'Β',
+    '\\Gamma': 'Γ',
+    '\\Delta': '∆', #using increment U+2206 instead of Greek Delta U+0394, because TI-nspire turns into small delta when pasting
+    '\\Epsilon': 'Ε',
+    '\\Zeta': 'Ζ',
+    '\\Eta': 'Η',
+    '\\Theta': 'Θ',
+    '\\Iota': 'Ι',
+    '\\Kappa': 'Κ',
+    '\\Lambda': 'Λ',
+    '\\Mu': 'Μ',
+    '\\Nu': 'Ν',
+    '\\Xi': 'Ξ',
+    '\\Omicron': 'Ο',
+    '\\Pi': 'Π',
+    '\\Rho': 'Ρ',
+    '\\Sigma': 'Σ',
+    '\\Tau': 'Τ',
+    '\\Upsilon': 'Υ',
+    '\\Phi': 'Φ',
+    '\\Chi': 'Χ',
+    '\\Psi': 'Ψ',
+    '\\Omega': 'Ω',
+    '\\alpha': 'α',
+    '\\beta': 'β',
+    '\\gamma': 'γ',
+    '\\delta': 'δ',
+    '\\epsilon': 'ε',
+    '\\varepsilon': 'ε',
+    '\\O': 'Otso Veisterä',
+    '\\upsilon': 'υ',
+    '\\zeta': 'ζ',
+    '\\eta': 'η',
+    '\\theta': 'θ',
+    '\\iota': 'ι',
+    '\\kappa': 'κ',
+    '\\lambda': 'λ',
+    '\\mu': 'μ',
+    '\\nu': 'ν',
+    '\\xi': 'ξ',
+    '\\omicron': 'ο',
+    '\\pi': 'π',
+    '\\rho': 'ρ',
+    '\\sigma': 'σ',
+    '\\tau': 'τ',
+    '\\phi': 'φ',
+    '\\varphi': 'φ',
+    '\\chi': 'χ',
+    '\\psi': 'ψ',
+    '\\omega': 'ω',
+
+    # extra
+    '\\partial': '∂',
+    '\\nabla': '∇'
+})
+
+CONSTANTS = MappingProxyType({
+    # Gravitational constant
+    '6.67430*10^{−11}\\text{Nm}^2/\\text{kg}^2': '(_Gc)',
+    'γ': '(_Gc)',
+
+    # Speed of light
+    'c_0': '(_c)',
+    # 'c': '(_c)',  handled later because of fracs ect.
+    # Rydberg constant
+    'R_{∞}': '(_Rdb)',
+    '{R}_{∞}': '(_Rdb)',
+    '{{R}_{∞}}': '(_Rdb)',
+    'R_{\\text{H}}': '(1.0967758*10^7*(1/_m))',
+    'R_H': '(1.0967758*10^7*(1/_m))',
+
+    # Gravity at Earth
+    #'g': '(_g)', don't know if its gravity or grams
+    'g_n': '(_g)',
+    'g_{\\text{n}}': '(_g)',
+
+    # Standard temperature and pressure
+    'T_n': '(293.15_°K)',
+    'p_0': '(101325_Pa)',
+
+    # Avogadro
+    'N_a': '(_Na)',
+    'N_A': '(_Na)',
+    'N_{\\text{A}}': '(_Na)',
+
+    # Molar volume
+    'V_m': '(_Vm)',
+    'V_{\\text{m}}': '(_Vm)',
+
+
+
+    # Electron mass
+    'm_e': '(_Me)',
+    'm_{\\text{e}}': '(_Me)',
+
+    # Proton mass
+    'm_p': '(_Mp)',
+    'm_{\\text{p}}': '(_Mp)',
+
+    # Neutron mass
+    'm_n': '(_Mn)',
+    'm_{\\text{n}}': '(_Mn)',
+
+    # Special nuclei
+    'm_{\\text{d}}': '(3.3435838*10^{−24}*_g)',
+    'm_{α}': '(6.644657*10^{−24}*_g)',
+
+    # Vacuum permittivity
+    'ε_0': '(_ε0)',
+    '\\varepsilon_0': '(_ε0)',
+
+    # Stefan–Boltzmann constant
+    'σ': '(_σ)',
+
+    # Faraday
+    #'F': '(_Fc)', breaks F=ma
+
+    # Planck
+    #'h': '(_h)',
+    '\\hbar': '(%`´%)/(2*π)', # h handled later because of planck constant vs hr
+
+    # Boltzmann
+    'k_B': '(_k)',
+    'k_{\\text{B}}': '(_k)',
+    # 'k': '(_k)',  handled later because of kilo
+
+    # Permeability of vacuum
+    'µ_0': '(_µ0)',
+    '\\mu_0': '(_µ0)',
+
+    # Coulomb constant
+    'k_e': '(_Cc)',
+
+    # Bohr magneton
+    'µ_B': '(_mb)',
+    '\\mu_B': '(_mb)',
+
+    # Muon mass
+    'm_µ': '(_Mm)',
+    'm_{\\mu}': '(_Mm)',
+
+    # Elementary charge
+    #'q': '(_q)', do later
+    #'Q': '(_q)'
+    'q_e': '(_q)',
+    'Q_e': '(_q)',
+
+    # Bohr radius
+    'a_0': '(_Rb)',
+
+    # Molar gas constant
+    'R': '(_Rc)',
+    'R_c': '(_Rc)',
+
+    # Classical electron radius
+    'r_e': '(_Re)',
+
+    # Atomic mass unit
+    'u': '(_u)',
+
+    # Magnetic flux quantum
+    'φ_0': '(_φ0)',
+    '\\phi_0': '(_φ0)',
+})
+
+# prefixes (4)
+SC_PREFIXES = MappingProxyType({
+    'y': 'yocto',
+    'z': 'zepto',
+    'a': 'atto',
+    'f': 'femto',
+    'p': 'pico',
+    'n': 'nano',
+    'µ': 'micro',
+    'm': 'milli',
+    'c': 'centi',
+    'd': 'deci',
+    'da': 'deca',
+    'h': 'hecto',
+    'k': 'kilo',
+    'M': 'mega',
+    'G': 'giga',
+    'T': 'tera',
+    'P': 'peta',
+    'E': 'exa',
+    'Z': 'zetta',
+    'Y': 'yotta'
+})
+
+# units (5)
+SC_UNITS = MappingProxyType({
+    'h': 'hour',
+    'g': 'gram',
+    'm': 'meter',
+    's': 'second',
+    'A': 'ampere',
+    'K': 'kelvin',
+    'mol': 'mole',
+    'cd': 'candela',
+    'rad': 'radian',
+    'sr': 'steradian',
+    'Hz': 'hertz',
+    'N': 'newton',
+    'Pa': 'pascal',
+    'J': 'joule',
+    'W': 'watt',
+    'C': 'coulomb',
+    'V': 'volt',
+    'F': 'farad',
+    'Ω': 'ohm',
+    'S': 'siemens',
+    'Wb': 'weber',
+    'T': 'tesla',
+    'H': 'henry',
+    'lm': 'lumen',
+    'lx': 'lux',
+    'Bq': 'becquerel',
+    'Gy': 'gray',
+    'Sv': 'sievert'
+})
+
+PREFIXES = MappingProxyType({
+    'y': '10^{-24}',
+    'z': '10^{-21}',
+    'a': '10^{-18}',
+    'f': '10^{-15}',
+    'p': '10^{-12}',
+    'n': '10^{-9}',
+    'µ': '10^{-6}',
+    'm': '10^{-3}',
+    'c': '10^{-2}',
+    'd': '10^{-1}',
+    'da': '10^1',
+    'h': '10^2',
+    'k': '10^3',
+    'M': '10^6',
+    'G': '10^9',
+    'T': '10^{12}',
+    'P': '10^{15}',
+    'E': '10^{18}',
+    'Z': '10^{21}',
+    'Y': '10^{24}' 
+})
+UNITS = MappingProxyType({
+    'h': '´´´´r', # hr
+    'g': '````m', # gm
+    'l': 'l',
+    'm': 'm',
+    's': 's',
+    'A': 'A',
+    'mol': 'mol',
+    'cd': 'cd',
+    # 'rad': '@r',
+    'sr': 'sr',
+    'Hz': 'Hz',
+    'N': 'N',
+    'Pa': 'Pa',
+    'J': 'J',
+    'W': 'W',
+    'C': 'coul',
+    'V': 'V',
+    'F': 'F',
+    'Ω': 'Ω',
+    'S': 'S',
+    'Wb': 'Wb',
+    'T': 'T',
+    'H': 'henry',
+    'lm': 'lm',
+    'lx': 'lx',
+    'Bq': 'BQ',
+    'Gy': 'Gy',
+    'Sv': 'Sv'
+})
+
+# fixlist (6)
+FIXLIST = (
+    ",",
+    ".",
+    ";",
+    ":",
+    "∑",
+    "∏",
+    "∫",
+    "sqrt",
+    "root",
+    "left",
+    "right",
+    "frac",
+    "ln",
+    "lg",
+    "lb",
+    "log",
+    "int",
+    "lim",
+    "system",
+    "abs",
+    "sinh",
+    "cosh",
+    "tanh",
+    "csch",
+    "sech",
+    "coth",
+    "arcsinh",
+    "arccosh",
+    "arctanh",
+    "arccsch",
+    "arcsech",
+    "arccoth",
+    "sin",
+    "cos",
+    "tan",
+    "csc",
+    "sec",
+    "cot",
+    "arcsin",
+    "arccos",
+    "arctan",
+    "arccsc",
+    "arcsec",
+    "arccot",
+    "exp",
+    "floor",
+    "ceil",
+    "sign",
+    "round",
+    "int",
+    "arc",
+    "nPr",
+    "nCr",
+    "dotP",
+    "crossP"
+)
+
+COMMON_FUNCTIONS = (
+    "sin",
+    "cos",
+    "tan",
+    "csc",
+    "sec",
+    "cot",
+    "arcsin",
+    "arccos",
+    "arctan",
+    "arccsc",
+    "arcsec",
+    "arccot",
+    "exp",
+    "ln",
+    "floor",
+    "ceil",
+    "sign",
+    "round",
+    "int"
+)
+
+ARROWS = MappingProxyType({
+    "\\leftarrow": "←",
+    "\\rightarrow": "→",
+    "\\leftrightarrow": "↔",
+    "\\Leftarrow": "⇐",
+    "\\Rightarrow": "⇒",
+    "\\Leftrightarrow": "⇔",
+})
+
+# Single-pass replacement of the translation tables
+
+def _overlaps(a, b):
+    """True if an occurrence of a and an occurrence of b can share characters."""
+    if a in b or b in a:
+        return True
+    return any(a.endswith(b[:n]) or b.endswith(a[:n]) for n in range(1, min(len(a), len(b))))
+
+def _createsKey(value, key):
+    """True if writing value into the text can produce a new occurrence of key."""
+    if value == "":
+        # deleting text joins its neighbours, any key of two or more characters can appear
+        return len(key) > 1
+    return _overlaps(key, value)
+
+def _triePattern(keys):
+    # Share common prefixes so the regex tries "\\" once instead of once per key
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in node.items()]
+        if len(branches) <= 1:
+            return "".join(branches)
+        return "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+class MultiReplacer:
+    """
+    Applies a replacement table exactly like calling str.replace() for every
+    key in dict order, but merges runs of entries into one regex scan.
+
+    An entry joins the current run only if its key cannot overlap any key of
+    the run and no earlier replacement in the run can create it, so applying
+    the run in one pass gives the same text as the sequential loop. Only LaTeX
+    commands (keys starting with a backslash) are merged: the scan stops at
+    every candidate first character, which is cheap for "\\" but slower than
+    str.replace() for keys starting with letters or spaces. Runs shorter than
+    min_run keys are also cheaper as plain str.replace() calls.
+    """
 
-class LatexToCalcEngine:
+    def __init__(self, table, min_run=8):
+        self.min_run = min_run
+        self.steps = []
+        run = []
+        for key, value in table.items():
+            mergeable = key.startswith("\\")
+            if run and not (mergeable and self._fits(run, key)):
+                self._addRun(run)
+                run = []
+            if mergeable:
+                run.append((key, value))
+            else:
+                self.steps.append((None, key, value))
+        if run:
+            self._addRun(run)
+
+    @staticmethod
+    def _fits(run, key):
+        return all(not _overlaps(key, other) and not _createsKey(value, key) for other, value in run)
+
+    def _addRun(self, run):
+        if len(run) < self.min_run:
+            for key, value in run:
+                self.steps.append((None, key, value))
+            return
+        lookup = dict(run)
+        # One capturing group: split() returns the text between matches with the matched keys at odd indexes
+        pattern = re.compile("(" + _triePattern(lookup) + ")")
+        self.steps.append((pattern, None, lookup.__getitem__))
+
+    def replace(self, expression):
+        for pattern, key, value in self.steps:
+            if pattern is None:
+                expression = expression.replace(key, value)
+                continue
+            parts = pattern.split(expression)
+            if len(parts) > 1:
+                # value is the lookup of the run, mapping the matched keys in C avoids a Python callback per match
+                parts[1::2] = map(value, parts[1::2])
+                expression = "".join(parts)
+        return expression
+
+# Only the Greek letters gain from merged scans (benchmarks/bench_replacer.py),
+# the other tables measured the same or slower than the str.replace() loop
+GREEK_LETTERS_REPLACER = MultiReplacer(GREEK_LETTERS)
+
+# Post-processing tables and patterns used by LatexToCalcEngine.translate()
+
+G_FIXES = MappingProxyType({
+    '\\_': '\\',
+    '__gm': '_gm',
+    'lo_g': 'log',
+    'be_gin': 'begin',
+    'i_ght': 'ight'
+    })
+
+E_FIXES = MappingProxyType({
+    'e': '@e',
+    'syst@em': 'system',
+    'c@eil': 'ceil',
+    'arcs@ec': 'arcsec'
+})
+
+I_FIXES = MappingProxyType({
+    'i': '@i',
+    's@in': 'sin',
+    'l@im': 'lim',
+    'ce@il': 'ceil',
+    '@int': 'int'
+})
+
+BUILT_IN_UNITS = MappingProxyType({
+    "10^3*_gm": "_kg",
+    "10^(-6)*_gm": "_mg",
+})
+
+FIX_ASTERISK = MappingProxyType({
+    "lcm*": "lcm",
+    "gcd*": "gcd",
+    "pym*": "pym",
+    "*,": ",",
+    "*.": ".",
+    "*;": ";",
+    "*:": ":",
+    "__": "_",
+    ",*": ",",
+    ".*": ".",
+    "*@r": "@r",
+    "(*": "(",
+    "*)": ")",
+    "*°": "°",
+    "a*bs": "abs",
+    "abs*": "abs",
+    "abs*(": "abs(",
+})
+
+GREEK_SUBSCRIPTS = MappingProxyType({
+    "α": "", "β": "", "γ": "", "δ": "", "ε": "", "ζ": "ζ",
+    "η": "η", "θ": "θ", "ι": "ι", "κ": "κ", "λ": "λ", "μ": "μ",
+    "ν": "ν", "ξ": "ξ", "ο": "ο", "π": "π", "ρ": "ρ", "σ": "σ",
+    "τ": "τ", "υ": "υ", "φ": "φ", "χ": "χ", "ψ": "ψ", "ω": "ω" })
+
+ADD_ASTERISK = MappingProxyType({
+    ")_": ")*_",
+    "ma": "m*a",
+    "mv": "m*v",
+ #   "at": "a*t",
+  #  "vt": "v*t",
+    "mgh": "m*g*h",
+  #  "mg": "m*g",
+    "ρgh": "ρ*g*h",
+    "mc": "m*c",  # E=mc^2
+    "cmΔT": "c*m*ΔT",
+    "CΔT": "C*ΔT",
+    "αl₀ΔT": "α*l₀*ΔT",
+    "βl₀ΔT": "β*l₀*ΔT",
+    "γl₀ΔT": "γ*l₀*ΔT",
+    "vB": "v*B"  # Magnetic force formula
+})
+
+# Any term ending with subscript followed by a term starting with letter/number
+subscript_chars = "₀₁₂₃₄₅₆₇₈₉"
+subscript_pattern = re.compile(r'([a-zA-Z0-9]+[' + subscript_chars + r'])([a-zA-Z0-9]+)')
+
+#regex rule to add asteriks between underscore and letter on the left side of it, e.g. m_g*h -> m*_g*h
+letter_underscore_pattern = re.compile(r'([a-zA-Z])(_[a-zA-Z])')
+
+# Define characters to permutate
+characters = ['x', 'y', 'z', 'a', 'b', 'c', 'k']
+
+# Create regex pattern for permutations of characters
+pattern_xyzabc = re.compile(fr'({"|".join(characters)})+')
+
+# Subscript digits and letters used by translateSubscripts()
+SUBSCRIPT_DIGITS = "₀₁₂₃₄₅₆₇₈₉"
+SUBSCRIPT_LETTERS = MappingProxyType({
+    # az    
+    "a": "", "b": "", "c": "", "d": "", "e": "", "f": "",
+    "g": "", "h": "", "i": "", "j": "", "k": "", "l": "",
+    "m": "", "n": "", "o": "", "p": "", "q": "", "r": "",
+    "s": "", "t": "", "u": "", "v": "", "w": "", "x": "",
+    "y": "", "z": "",
+
+    # AZ
+    "A": "", "B": "", "C": "", "D": "", "E": "", "F": "",
+    "G": "", "H": "", "I": "", "J": "", "K": "", "L": "",
+    "M": "", "N": "", "O": "", "P": "", "Q": "", "R": "",
+    "S": "", "T": "", "U": "", "V": "", "W": "", "X": "",
+    "Y": "", "Z": "",
+
+})
+
+#Remove empty strings before joining with '*'
+def _multiplyVariables(match):
+    return '*'.join(filter(None, match.group(0)))
+
+def _replaceMultiplier(match):
+    return match.group(1) + "*("
+
+def _replaceMultiplicand(match):
+    return ")*" + match.group(1)
+
+## Add multiplication sign between non-number and number characters
+def _addMultiplicationSign(match):
+    return match.group(1) + "*" + match.group(2)
+
+# Precompiled patterns
+
+class PatternRegistry:
     """
-    Contains:
-    - dictionaries of LaTeX expressions and their translation
-    - functions used to translate LaTeX expressions
+    Compiles the patterns that are built from a function name or a fixlist
+    entry once, at import.
+
+    There are more of them than re's internal cache holds, so building them
+    with string concatenation on every call recompiled them over and over.
+    The stages' own patterns come through RegistryMatching and are compiled
+    the first time they are used. runtime_compiles counts compiles after
+    import, so it levels off after the first few translations; one that
+    keeps growing means a request path builds patterns from its input.
     """
-    
-    def __init__(self, TI_on=True, SC_on=False, units_on=True):
-        self.TI_on = TI_on
-        self.SC_on = SC_on
-        self.units_on = units_on
 
-        self.symbols = {
-            #
-            "astem": "°",
-            "\\degree": "°",
-            "\\deg": "°",
-            "\\kertom": "·",
-            "dfrac": "frac",
-            "end": "enj",
-
-            # junk
-            "\\ ": "",
-            "\n": "",
-            "\t": "",
-            " ": "",
-            "‰": "\\left(1/1000\\right)",
-            "‱": "\\left(1/1000000\\right)",
-            "{,}": ",",
-            "$$": "",
-            "\\circ": "∘",
-            "...": "",
-            "\\ldots": "",
-            "\\dots": "",
-
-            # operators, abs, infinity
-            "\\pm": "±",
-            "\\mp": "∓",
-            "\\times": "*ΦcrossΦ",
-            "\\div": "/",
-            "\\cdot": "*",
-            "\\left|": "abs(",
-            "\\right|": ")",
-            "\\infty": "∞",
-
-            # geometry
-            "\\sphericalangle": "∢",
-            "\\angle": "∠",
-            "\\parallel": "∥",
-            "\\nparallel": "∦",
-            "\\mid": "∣",
-            "\\sim": "~",
-            "\\propto": "∝",
-
-            # ≠, ≡, ≢ , ≈
-            "\\neq": "≠",
-            "\\equiv": "≡",
-            "\\not\\equiv": "≢",
-            "\\approx": "≈",
-            "&=": "=",
-
-            # vectors & average value | \bar{\text{i}}+\bar{\text{j}}+\bar{\text{k}} | 𝕚 𝕛 ӄ
-            "\\bar{i}": "𝕚",
-            "\\bar{\\text{i}}": "𝕚",
-            "\\bar{j}": "𝕛",
-            "\\bar{\\text{j}}": "𝕛",
-            "\\bar{k}": "ӄ",
-            "\\bar{\\text{k}}": "ӄ",
-
-        #   "\\bar": "",
-        #  "\\overline": "",
-
-            # negation ¬
-            "\\neg": "¬",
-
-            # subset ⊂⊆
-            "\\subset": "⊂",
-            "\\subseteq": "⊆",
-
-            # set
-            "\\mathbb{N}": "ℕ",
-            "\\mathbb{Z}": "ℤ",
-            "\\mathbb{Q}": "ℚ",
-            "\\mathbb{R}": "ℝ",
-            "\\mathbb{C}": "ℂ",
-            "\\mathbb{P}": "ℙ",
-            "\\varnothing": "∅",
-
-            # ∈
-            "\\notin": "∉",
-            "\\setminus": "\\",
-            "\\backslash": "\\",
-
-            # ∀ ∃
-            "\\forall": "∀",
-            "\\exists": "∃",
-
-            # logic
-            "\\and": "∧",
-            "\\or": "∨",
-
-            # ∩∪
-            "\\cap": "∩",
-            "\\cup": "∪",
+    def __init__(self):
+        self._patterns = {}
+        self.compiles = 0
+        self.runtime_compiles = 0
+        self.loaded = False
+
+    def compile(self, pattern, flags=0):
+        compiled = self._patterns.get((pattern, flags))
+        if compiled is None:
+            compiled = self._patterns[(pattern, flags)] = re.compile(pattern, flags)
+            self.compiles += 1
+            if self.loaded:
+                self.runtime_compiles += 1
+        return compiled
+
+    def stats(self):
+        return {
+            'patterns': len(self._patterns),
+            'compiles': self.compiles,
+            'runtime_compiles': self.runtime_compiles,
         }
 
-        self.greek_letters = {            
-            '\\Alpha': 'Α',
-            '\\Beta': 'Β',
-            '\\Gamma': 'Γ',
-            '\\Delta': '∆', #using increment U+2206 instead of Greek Delta U+0394, because TI-nspire turns into small delta when pasting
-            '\\Epsilon': 'Ε',
-            '\\Zeta': 'Ζ',
-            '\\Eta': 'Η',
-            '\\Theta': 'Θ',
-            '\\Iota': 'Ι',
-            '\\Kappa': 'Κ',
-            '\\Lambda': 'Λ',
-            '\\Mu': 'Μ',
-            '\\Nu': 'Ν',
-            '\\Xi': 'Ξ',
-            '\\Omicron': 'Ο',
-            '\\Pi': 'Π',
-            '\\Rho': 'Ρ',
-            '\\Sigma': 'Σ',
-            '\\Tau': 'Τ',
-            '\\Upsilon': 'Υ',
-            '\\Phi': 'Φ',
-            '\\Chi': 'Χ',
-            '\\Psi': 'Ψ',
-            '\\Omega': 'Ω',
-            '\\alpha': 'α',
-            '\\beta': 'β',
-            '\\gamma': 'γ',
-            '\\delta': 'δ',
-            '\\epsilon': 'ε',
-            '\\varepsilon': 'ε',
-            '\\O': 'Otso Veisterä',
-            '\\upsilon': 'υ',
-            '\\zeta': 'ζ',
-            '\\eta': 'η',
-            '\\theta': 'θ',
-            '\\iota': 'ι',
-            '\\kappa': 'κ',
-            '\\lambda': 'λ',
-            '\\mu': 'μ',
-            '\\nu': 'ν',
-            '\\xi': 'ξ',
-            '\\omicron': 'ο',
-            '\\pi': 'π',
-            '\\rho': 'ρ',
-            '\\sigma': 'σ',
-            '\\tau': 'τ',
-            '\\phi': 'φ',
-            '\\varphi': 'φ',
-            '\\chi': 'χ',
-            '\\psi': 'ψ',
-            '\\omega': 'ω',
-
-            # extra
-            '\\partial': '∂',
-            '\\nabla': '∇'
-            }
-
-        self.constantsDict = {
-            # Gravitational constant
-            '6.67430*10^{−11}\\text{Nm}^2/\\text{kg}^2': '(_Gc)',
-            'γ': '(_Gc)',
-
-            # Speed of light
-            'c_0': '(_c)',
-            # 'c': '(_c)',  handled later because of fracs ect.
-            # Rydberg constant
-            'R_{∞}': '(_Rdb)',
-            '{R}_{∞}': '(_Rdb)',
-            '{{R}_{∞}}': '(_Rdb)',
-            'R_{\\text{H}}': '(1.0967758*10^7*(1/_m))',
-            'R_H': '(1.0967758*10^7*(1/_m))',
-
-            # Gravity at Earth
-            #'g': '(_g)', don't know if its gravity or grams
-            'g_n': '(_g)',
-            'g_{\\text{n}}': '(_g)',
-
-            # Standard temperature and pressure
-            'T_n': '(293.15_°K)',
-            'p_0': '(101325_Pa)',
-
-            # Avogadro
-            'N_a': '(_Na)',
-            'N_A': '(_Na)',
-            'N_{\\text{A}}': '(_Na)',
-
-            # Molar volume
-            'V_m': '(_Vm)',
-            'V_{\\text{m}}': '(_Vm)',
-            
+PATTERNS = PatternRegistry()
+
+class RegistryMatching:
+    """Stands in for the re module in the stages, their patterns are kept compiled in PATTERNS."""
+
+    @staticmethod
+    def search(pattern, string, flags=0):
+        return PATTERNS.compile(pattern, flags).search(string)
+
+    @staticmethod
+    def sub(pattern, repl, string, count=0, flags=0):
+        return PATTERNS.compile(pattern, flags).sub(repl, string, count)
+
+    @staticmethod
+    def findall(pattern, string, flags=0):
+        return PATTERNS.compile(pattern, flags).findall(string)
+
+    @staticmethod
+    def finditer(pattern, string, flags=0):
+        return PATTERNS.compile(pattern, flags).finditer(string)
+
+def _commonFunctionPatterns(func):
+    """Patterns and replacement templates translateCommonFunctions() applies to one function, in order."""
+    compile = PATTERNS.compile
+    return {
+        # \func^{n}\frac{a}{b} and \func^n\frac{a}{b}
+        "fraction_subs": (
+            (compile(r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\frac\£([0-9]+)\£\{(.+)\}\£\3\£\£([0-9]+)\£\{(.+)\}\£\5\£'),
+             r'\\' + func + r'^£\1£{\2}£\1£\\left$0\3$(((\4)/(\6))\\right)$0\3$'),
+            (compile(r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\frac\£([0-9]+)\£\{(.+)\}\£\2\£\£([0-9]+)\£\{(.+)\}\£\4\£'),
+             r'\\' + func + r'^\1\\left$0\2$(((\3)/(\5))\\right)$0\2$'),
+        ),
+        # \func\frac{a}{b}, only tried when the expression contains it
+        "bare_fraction_sub": (compile(r'\\' + func + r'\\frac\£([0-9]+)\£\{(.+)\}\£\1\£\£([0-9]+)\£\{(.+)\}\£\3\£'),
+                              r'\\' + func + r'\\left$0\1$(((\2)/(\4))\\right)$0\1$'),
+        "power_subs": (
+            # \sin ^{2n}\left(x\right)
+            (compile(r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$\^\£([0-9]+)\£\{(.+)\}\£\5\£'),
+             r'\(' + func + r'\(\4\^\(\6\)\)\)\^\(\2\)'),
+            (compile(r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$\^([α-ωΑ-Ωa-zA-Z0-9])'),
+             r'\(' + func + r'\(\4\^\(\5\)\)\)\^\(\2\)'),
+            # \sin ^2\left(x\right)
+            (compile(r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$\^\£([0-9]+)\£\{(.+)\}\£\4\£'),
+             r'\(' + func + r'\(\3\^\(\5\)\)\)\^\(\1\)'),
+            (compile(r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$\^([α-ωΑ-Ωa-zA-Z0-9])'),
+             r'\(' + func + r'\(\3\^\(\4\)\)\)\^\(\1\)'),
+            ##############################################
+            (compile(r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$'),
+             r'\(' + func + r'\(\4\)\)\^\(\2\)'),
+            # \sin ^2\left(x\right)
+            (compile(r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$'),
+             r'\(' + func + r'\(\3\)\)\^\(\1\)'),
+            # \sin ^{2n}x^{2k}
+            (compile(r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\4\£'),
+             r'\(' + func + r'\(\3\^\(\5\)\)\)\^\(\2\)'),
+            # \sin ^{2n}x^2
+            (compile(r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9])'),
+             r'\(' + func + r'\(\3\^\(\4\)\)\)\^\(\2\)'),
+            # \sin ^2x^{2k}
+            (compile(r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\3\£'),
+             r'\(' + func + r'\(\2\^\(\4\)\)\)\^\(\1\)'),
+            # \sin ^{2n}x
+            (compile(r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)'),
+             r'\(' + func + r'\(\3\)\)\^\(\2\)'),
+            # \sin ^2x
+            (compile(r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)'),
+             r'\(' + func + r'\(\2\)\)\^\(\1\)'),
+        ),
+        # \func\left(x\right)
+        "left": compile(r'\\' + func + r'\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$'),
+        # \func x^{n}
+        "argument_power_tag": compile(r'\\' + func + r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£'),
+        # \func x^n
+        "argument_power": compile(r'\\' + func + r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])'),
+        # \func x
+        "argument": compile(r'\\' + func + r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)'),
+    }
 
+COMMON_FUNCTION_PATTERNS = MappingProxyType({func: _commonFunctionPatterns(func) for func in COMMON_FUNCTIONS})
 
-            # Electron mass
-            'm_e': '(_Me)',
-            'm_{\\text{e}}': '(_Me)',
+COMMAND_NAME_PATTERN = PATTERNS.compile(r'\\([a-zA-Z]+)')
+_LONGEST_FUNCTION = max(map(len, COMMON_FUNCTIONS))
 
-            # Proton mass
-            'm_p': '(_Mp)',
-            'm_{\\text{p}}': '(_Mp)',
+def _presentFunctions(expression):
+    """
+    Common functions that occur as \\func in the expression, found with one scan.
+    A function counts when a command name starts with it, so "\\sinh" also
+    reports "sin" just like expression.count("\\sin") does.
+    """
+    present = set()
+    for name in set(COMMAND_NAME_PATTERN.findall(expression)):
+        for end in range(1, min(len(name), _LONGEST_FUNCTION) + 1):
+            if name[:end] in COMMON_FUNCTION_PATTERNS:
+                present.add(name[:end])
+    return present
+
+# Adds "*" before a fixlist entry that follows a variable or number, used by translate()
+FIX_PATTERNS = tuple((fix, PATTERNS.compile(r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°₀₁₂₃₄₅₆₇₈₉]+)' + fix)) for fix in FIXLIST)
+
+# Anything compiled from here on is counted as a runtime compile
+PATTERNS.loaded = True
+
+# Content features
+
+# Constructs a pipeline stage reacts to, each found by any of its substrings.
+# scanFeatures() records them in a bitmap with one scan up front, and
+# translate() skips every stage whose construct is absent.
+FEATURES = MappingProxyType({
+    "units": ("\\mathrm", "\\text", "』"),
+    "sum": ("\\sum",),
+    "prod": ("\\prod",),
+    "integral": ("\\int_",),
+    "function": COMMON_FUNCTIONS,  # floor, ceil, ... are matched without a backslash
+    "limit": ("\\lim",),
+    "binom": ("\\binom",),
+    "underscore": ("_",),
+    "derivative": ("D", "{d"),
+    "frac": ("\\frac",),
+    "log": ("\\log",),
+    "lg": ("\\lg",),
+    "sqrt": ("\\sqrt",),
+    "begin": ("\\begin",),
+    "arrow": ("arrow",),
+})
+FEATURE_BITS = MappingProxyType({name: 1 << index for index, name in enumerate(FEATURES)})
+# Set in every bitmap, for stages that do their own, cheaper check
+ALWAYS = 1 << len(FEATURES)
+
+# The regex stages of translate() in order, with the construct each one needs.
+# translateVectors() and translateMatrices() also react to text the earlier
+# stages create, e.g. "ab\arcsin" turns into "abarcsin", so they always run.
+PIPELINE = tuple((stage, FEATURE_BITS[feature] if feature else ALWAYS) for stage, feature in (
+    ("translateUnits1", "units"),
+    ("translateSum", "sum"),
+    ("translateProd", "prod"),
+    ("translateIntegrals", "integral"),
+    ("translateCommonFunctions", "function"),
+    ("translateLimits", "limit"),
+    ("translateCombinations", "binom"),
+    ("translatePermutations", "underscore"),
+    ("translateDerivatives", "derivative"),
+    ("translateFractions", "frac"),
+    # ("translateLn", "function"),
+    ("translateLog", "log"),
+    ("translateSubscripts", "underscore"),
+    ("translateLg", "lg"),
+    ("translateSqrt", "sqrt"),
+    ("translateSystem", "begin"),
+    ("translateArrows", "arrow"),
+    ("translateVectors", None),
+    ("translateMatrices", None),
+))
+
+def scanFeatures(expression):
+    """Bitmap of the FEATURES that occur in the expression."""
+    features = ALWAYS
+    for name, substrings in FEATURES.items():
+        for substring in substrings:
+            if substring in expression:
+                features |= FEATURE_BITS[name]
+                break
+    return features
+
+class StageCounters:
+    """
+    Counts the translations that went through the regex stages and how often
+    each stage was skipped, for /metrics.
+    """
 
-            # Neutron mass
-            'm_n': '(_Mn)',
-            'm_{\\text{n}}': '(_Mn)',
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.translations = 0
+        self.skipped = dict.fromkeys((stage for stage, _ in PIPELINE), 0)
 
-            # Special nuclei
-            'm_{\\text{d}}': '(3.3435838*10^{−24}*_g)',
-            'm_{α}': '(6.644657*10^{−24}*_g)',
+    def record(self, skipped):
+        with self._lock:
+            self.translations += 1
+            for stage in skipped:
+                self.skipped[stage] += 1
 
-            # Vacuum permittivity
-            'ε_0': '(_ε0)',
-            '\\varepsilon_0': '(_ε0)',
+    def stats(self):
+        with self._lock:
+            return {'translations': self.translations, 'skipped': dict(self.skipped)}
 
-            # Stefan–Boltzmann constant
-            'σ': '(_σ)',
+STAGE_STATS = StageCounters()
 
-            # Faraday
-            #'F': '(_Fc)', breaks F=ma
+class StageTimings:
+    """
+    Duration histograms per stage of the profiled translations, for /metrics.
+    Bucket "1" counts durations above the previous bound up to 1 ms, "inf" the rest.
+    """
 
-            # Planck
-            #'h': '(_h)',
-            '\\hbar': '(%`´%)/(2*π)', # h handled later because of planck constant vs hr
-            
-            # Boltzmann
-            'k_B': '(_k)',
-            'k_{\\text{B}}': '(_k)',
-            # 'k': '(_k)',  handled later because of kilo
+    BOUNDS_MS = (0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000)
 
-            # Permeability of vacuum
-            'µ_0': '(_µ0)',
-            '\\mu_0': '(_µ0)',
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
 
-            # Coulomb constant
-            'k_e': '(_Cc)',
+    def record(self, timings):
+        with self._lock:
+            for stage, seconds in timings.items():
+                histogram = self._stages.get(stage)
+                if histogram is None:
+                    histogram = self._stages[stage] = {'count': 0, 'total_ms': 0.0, 'buckets': [0] * (len(self.BOUNDS_MS) + 1)}
+                ms = seconds * 1000
+                histogram['count'] += 1
+                histogram['total_ms'] += ms
+                histogram['buckets'][bisect_left(self.BOUNDS_MS, ms)] += 1
 
-            # Bohr magneton
-            'µ_B': '(_mb)',
-            '\\mu_B': '(_mb)',
+    def stats(self):
+        labels = [str(bound) for bound in self.BOUNDS_MS] + ['inf']
+        with self._lock:
+            return {stage: {'count': histogram['count'],
+                            'total_ms': round(histogram['total_ms'], 3),
+                            'buckets_ms': dict(zip(labels, histogram['buckets']))}
+                    for stage, histogram in self._stages.items()}
 
-            # Muon mass
-            'm_µ': '(_Mm)',
-            'm_{\\mu}': '(_Mm)',
+STAGE_TIMINGS = StageTimings()
 
-            # Elementary charge
-            #'q': '(_q)', do later
-            #'Q': '(_q)'
-            'q_e': '(_q)',
-            'Q_e': '(_q)',
+# Cooperative limits
 
-            # Bohr radius
-            'a_0': '(_Rb)',
+class TranslationAborted(Exception):
+    """A translation stopped by its deadline or by the output growth cap, see checkLimits()."""
 
-            # Molar gas constant
-            'R': '(_Rc)',
-            'R_c': '(_Rc)',
+    def __init__(self, reason, stage):
+        # both in args, so the exception survives pickling out of a worker process
+        super().__init__(reason, stage)
+        self.reason = reason
+        self.stage = stage
 
-            # Classical electron radius
-            'r_e': '(_Re)',
+    def __str__(self):
+        return f"{self.reason} in {self.stage}"
 
-            # Atomic mass unit
-            'u': '(_u)',
+class TranslationTimeout(TranslationAborted):
+    """The deadline passed to translate() passed."""
 
-            # Magnetic flux quantum
-            'φ_0': '(_φ0)',
-            '\\phi_0': '(_φ0)',
-        }
+class OutputTooLong(TranslationAborted):
+    """The expression outgrew MAX_OUTPUT_GROWTH times the input length."""
 
-        # prefixes (4)
-        self.SC_prefixes = {
-            'y': 'yocto',
-            'z': 'zepto',
-            'a': 'atto',
-            'f': 'femto',
-            'p': 'pico',
-            'n': 'nano',
-            'µ': 'micro',
-            'm': 'milli',
-            'c': 'centi',
-            'd': 'deci',
-            'da': 'deca',
-            'h': 'hecto',
-            'k': 'kilo',
-            'M': 'mega',
-            'G': 'giga',
-            'T': 'tera',
-            'P': 'peta',
-            'E': 'exa',
-            'Z': 'zetta',
-            'Y': 'yotta'
-            }
-
-        # units (5)
-        self.SC_units = {
-            'h': 'hour',
-            'g': 'gram',
-            'm': 'meter',
-            's': 'second',
-            'A': 'ampere',
-            'K': 'kelvin',
-            'mol': 'mole',
-            'cd': 'candela',
-            'rad': 'radian',
-            'sr': 'steradian',
-            'Hz': 'hertz',
-            'N': 'newton',
-            'Pa': 'pascal',
-            'J': 'joule',
-            'W': 'watt',
-            'C': 'coulomb',
-            'V': 'volt',
-            'F': 'farad',
-            'Ω': 'ohm',
-            'S': 'siemens',
-            'Wb': 'weber',
-            'T': 'tesla',
-            'H': 'henry',
-            'lm': 'lumen',
-            'lx': 'lux',
-            'Bq': 'becquerel',
-            'Gy': 'gray',
-            'Sv': 'sievert'
-            }
-
-        self.prefixes = {
-            'y': '10^{-24}',
-            'z': '10^{-21}',
-            'a': '10^{-18}',
-            'f': '10^{-15}',
-            'p': '10^{-12}',
-            'n': '10^{-9}',
-            'µ': '10^{-6}',
-            'm': '10^{-3}',
-            'c': '10^{-2}',
-            'd': '10^{-1}',
-            'da': '10^1',
-            'h': '10^2',
-            'k': '10^3',
-            'M': '10^6',
-            'G': '10^9',
-            'T': '10^{12}',
-            'P': '10^{15}',
-            'E': '10^{18}',
-            'Z': '10^{21}',
-            'Y': '10^{24}' 
-                }
-        self.units = {
-            'h': '´´´´r', # hr
-            'g': '````m', # gm
-            'l': 'l',
-            'm': 'm',
-            's': 's',
-            'A': 'A',
-            'mol': 'mol',
-            'cd': 'cd',
-            # 'rad': '@r',
-            'sr': 'sr',
-            'Hz': 'Hz',
-            'N': 'N',
-            'Pa': 'Pa',
-            'J': 'J',
-            'W': 'W',
-            'C': 'coul',
-            'V': 'V',
-            'F': 'F',
-            'Ω': 'Ω',
-            'S': 'S',
-            'Wb': 'Wb',
-            'T': 'T',
-            'H': 'henry',
-            'lm': 'lm',
-            'lx': 'lx',
-            'Bq': 'BQ',
-            'Gy': 'Gy',
-            'Sv': 'Sv'
-            }
-
-        # fixlist (6)
-        self.fixlist = [
-            ",",
-            ".",
-            ";",
-            ":",
-            "∑",
-            "∏",
-            "∫",
-            "sqrt",
-            "root",
-            "left",
-            "right",
-            "frac",
-            "ln",
-            "lg",
-            "lb",
-            "log",
-            "int",
-            "lim",
-            "system",
-            "abs",
-            "sinh",
-            "cosh",
-            "tanh",
-            "csch",
-            "sech",
-            "coth",
-            "arcsinh",
-            "arccosh",
-            "arctanh",
-            "arccsch",
-            "arcsech",
-            "arccoth",
-            "sin",
-            "cos",
-            "tan",
-            "csc",
-            "sec",
-            "cot",
-            "arcsin",
-            "arccos",
-            "arctan",
-            "arccsc",
-            "arcsec",
-            "arccot",
-            "exp",
-            "floor",
-            "ceil",
-            "sign",
-            "round",
-            "int",
-            "arc",
-            "nPr",
-            "nCr",
-            "dotP",
-            "crossP"
-        ]
-
-        self.common_functions = [
-            "sin",
-            "cos",
-            "tan",
-            "csc",
-            "sec",
-            "cot",
-            "arcsin",
-            "arccos",
-            "arctan",
-            "arccsc",
-            "arcsec",
-            "arccot",
-            "exp",
-            "ln",
-            "floor",
-            "ceil",
-            "sign",
-            "round",
-            "int"
-        ]
-
-        self.arrows = {
-            "\\leftarrow": "←",
-            "\\rightarrow": "→",
-            "\\leftrightarrow": "↔",
-            "\\Leftarrow": "⇐",
-            "\\Rightarrow": "⇒",
-            "\\Leftrightarrow": "⇔",
-        }
+# Intermediate expressions may get this many times longer than the input, and
+# at least MIN_OUTPUT_LIMIT characters long. The tags stay far below that.
+MAX_OUTPUT_GROWTH = 20
+MIN_OUTPUT_LIMIT = 1000
+
+class CallLimits:
+    """Deadline, length cap and current stage of the translation running on one thread."""
+
+    __slots__ = ('deadline', 'max_length', 'stage')
+
+    def __init__(self, deadline, max_length):
+        self.deadline = deadline
+        self.max_length = max_length
+        self.stage = None
+
+    def check(self, expression):
+        if len(expression) > self.max_length:
+            raise OutputTooLong(f"output grew past {self.max_length} characters", self.stage)
+        if self.deadline is not None and monotonic() > self.deadline:
+            raise TranslationTimeout("deadline passed", self.stage)
+
+class _ThreadLimits(threading.local):
+    current = None
+
+_CALL_LIMITS = _ThreadLimits()
+
+def checkLimits(expression):
+    """
+    Raises TranslationTimeout once the deadline of the running translation has
+    passed, and OutputTooLong once the expression outgrew its cap. runStage()
+    checks after every stage and the looping stages call this between
+    iterations. Outside translate() it does nothing.
+    """
+    limits = _CALL_LIMITS.current
+    if limits is not None:
+        limits.check(expression)
+
+def remainingTime():
+    """Seconds left until the deadline of the running translation, None without one."""
+    limits = _CALL_LIMITS.current
+    if limits is None or limits.deadline is None:
+        return None
+    return max(0.0, limits.deadline - monotonic())
+
+# A single re call cannot be interrupted, and the greedy (.+) patterns of the
+# stages backtrack for seconds on expressions of a few thousand characters.
+# Longer expressions with a deadline are therefore matched with the regex
+# module, which gives the same results and stops a match at the deadline.
+# Shorter ones keep the faster stdlib re.
+GUARDED_LENGTH = 2000
+
+def _guarded(call, materialize=False):
+    def guardedCall(*args, **kwargs):
+        try:
+            result = call(*args, timeout=remainingTime(), **kwargs)
+            # finditer() only matches while it is iterated
+            return iter(list(result)) if materialize else result
+        except TimeoutError:
+            raise TranslationTimeout("deadline passed", _CALL_LIMITS.current.stage)
+    return guardedCall
+
+class GuardedPattern:
+    """regex-module twin of a compiled re pattern, its calls stop at the deadline."""
+
+    def __init__(self, pattern):
+        compiled = regex.compile(pattern.pattern, pattern.flags)
+        self.pattern = pattern.pattern
+        self.search = _guarded(compiled.search)
+        self.sub = _guarded(compiled.sub)
+        self.findall = _guarded(compiled.findall)
+
+class GuardedMatching:
+    """Stands in for the re module in the stages of LatexToCalcEngine.guardedTwin()."""
+
+    search = staticmethod(_guarded(regex.search))
+    sub = staticmethod(_guarded(regex.sub))
+    findall = staticmethod(_guarded(regex.findall))
+    finditer = staticmethod(_guarded(regex.finditer, materialize=True))
+
+@lru_cache(maxsize=None)
+def _guardedPatterns():
+    """GuardedPattern twins of COMMON_FUNCTION_PATTERNS and FIX_PATTERNS, built on first use."""
+    def twin(value):
+        if isinstance(value, re.Pattern):
+            return GuardedPattern(value)
+        if isinstance(value, tuple):
+            return tuple(twin(item) for item in value)
+        if isinstance(value, (dict, MappingProxyType)):
+            return {key: twin(item) for key, item in value.items()}
+        return value
+    return MappingProxyType(twin(COMMON_FUNCTION_PATTERNS)), twin(FIX_PATTERNS)
+
+# Bracket group tagging shared by applyTags(), translateIntegrals() and translateMatrices()
+
+@lru_cache(maxsize=None)
+def _bracketPatterns(opening, closing):
+    brackets = re.compile("[" + re.escape(opening + closing) + "]")
+    o, c = regex.escape(opening), regex.escape(closing)
+    groups = regex.compile(r'(?<rec>' + o + r'(?:[^' + o + c + r']++|(?&rec))*' + c + ')')
+    return brackets, groups
+
+def _tagGroupsByText(expression, opening, closing, tagChar):
+    """Original implementation, used when the "###" placeholder could clash with the input."""
+    _, groups = _bracketPatterns(opening, closing)
+    try:
+        # the recursive pattern is the one regex-module call, it stops at the deadline itself
+        result = groups.search(opening + expression + closing, timeout=remainingTime())
+    except TimeoutError:
+        raise TranslationTimeout("deadline passed", _CALL_LIMITS.current.stage)
+    if result:
+        matches = result.captures('rec')
+        matches.sort(key=len, reverse=True)
+        copy_list = []
+        for index, match in enumerate(matches):
+            copy_list.append(match)
+            tag = tagChar + str(index) + tagChar
+            amount = copy_list.count(match)
+            expression = expression.replace(match, "###", amount-1)
+            expression = expression.replace(match, tag + match + tag, 1)
+            expression = expression.replace("###", match, amount-1)
+    return expression
+
+def tagGroups(expression, opening, closing, tagChar):
+    """
+    Wraps bracket groups in numbered tags, e.g. "(a)(b)" -> "$1$(a)$1$$2$(b)$2$".
+
+    Tags are numbered from the longest group down, groups of equal length from
+    left to right. The expression is scanned as opening + expression + closing,
+    so tag 0 goes to that wrapper when the brackets are balanced. With
+    unbalanced brackets only the leftmost complete group and the groups inside
+    it are tagged.
+
+    This is a stack-based scan over the bracket characters with the same output
+    as the original capture/str.replace() loop, which was quadratic in the
+    number of groups.
+    """
+    if "#" in expression:
+        return _tagGroupsByText(expression, opening, closing, tagChar)
+
+    brackets, _ = _bracketPatterns(opening, closing)
+    end = len(expression)
+    stack = [-1]  # the wrapping opening bracket
+    pairs = []    # (start, stop) in closing order, -1 and end are the wrapper
+    for match in brackets.finditer(expression):
+        position = match.start()
+        if match.group() == opening:
+            stack.append(position)
+        elif stack:
+            pairs.append((stack.pop(), position))
+    if stack:
+        pairs.append((stack.pop(), end))
+    if not pairs:
+        return expression
+
+    # Only the leftmost complete group and the groups inside it are tagged
+    first, last = min(pairs)
+    tagged = sorted((pair for pair in pairs if pair[0] >= first and pair[1] <= last),
+                    key=lambda pair: pair[0] - pair[1])
+
+    inserts = []
+    for index, (start, stop) in enumerate(tagged):
+        if stop == end:
+            # Ends with the wrapping closing bracket, this text cannot occur in the expression
+            continue
+        if start == -1:
+            # Starts with the wrapping opening bracket and ends at a stray closing
+            # bracket, a later group of the expression can still have this text
+            text = opening + expression[:stop + 1]
+            same = [pair for pair in pairs if pair[0] >= 0 and pair[1] < end
+                    and pair[1] - pair[0] + 1 == len(text) and expression[pair[0]:pair[1] + 1] == text]
+            if not same:
+                continue
+            start, stop = min(same)
+        tag = tagChar + str(index) + tagChar
+        inserts.append((start, 1, tag))
+        inserts.append((stop + 1, 0, tag))
+
+    # A closing tag comes before an opening tag at the same position
+    inserts.sort()
+    parts = []
+    previous = 0
+    for position, _, tag in inserts:
+        parts.append(expression[previous:position])
+        parts.append(tag)
+        previous = position
+    parts.append(expression[previous:])
+    return "".join(parts)
+
+class LatexToCalcEngine:
+    """
+    Contains:
+    - references to the shared translation tables
+    - functions used to translate LaTeX expressions
+
+    An engine keeps no per-call state, so one instance per settings profile
+    can be shared between threads, see get_engine().
+    """
+    
+    def __init__(self, TI_on=True, SC_on=False, units_on=True, constants_on=False, coulomb_on=False, e_on=False, i_on=False, g_on=False):
+        self.TI_on = TI_on
+        self.SC_on = SC_on
+        self.units_on = units_on
+        self.constants_on = constants_on
+        self.coulomb_on = coulomb_on
+        self.e_on = e_on
+        self.i_on = i_on
+        self.g_on = g_on
+
+        self.symbols = SYMBOLS
+        self.greek_letters = GREEK_LETTERS
+        self.constantsDict = CONSTANTS
+        self.SC_prefixes = SC_PREFIXES
+        self.SC_units = SC_UNITS
+        self.prefixes = PREFIXES
+        self.units = UNITS
+        self.fixlist = FIXLIST
+        self.common_functions = COMMON_FUNCTIONS
+        self.arrows = ARROWS
+        self.greek_letters_replacer = GREEK_LETTERS_REPLACER
+        self.common_function_patterns = COMMON_FUNCTION_PATTERNS
+        self.fix_patterns = FIX_PATTERNS
+        self.tree = TreeTranslator(self)
+        # what the stages match with, GuardedMatching in guardedTwin()
+        self.re = RegistryMatching
+        self._guardedTwin = None
 
     ###################################################################
 
@@ -485,7 +1201,7 @@ class LatexToCalcEngine:
 
     def translateGreekLetters(self, expression: str, dictionary=None):
         if dictionary is None:
-            dictionary = self.greek_letters
+            return self.greek_letters_replacer.replace(expression)
         for key, value in dictionary.items():
             expression = expression.replace(key, value)
         return expression
@@ -501,54 +1217,11 @@ class LatexToCalcEngine:
 
     def applyTags(self, expression):
         # 1. ()
-        old_expression = expression
-        expression = "("+ expression + ")"
-        result = regex.search(r'(?<rec>\((?:[^()]++|(?&rec))*\))', expression, flags=regex.VERBOSE)
-        expression = old_expression
-        if result:
-            matches = result.captures('rec')
-            matches.sort(key=len, reverse=True)
-            copy_list = []
-            for index, match in enumerate(matches):
-                copy_list.append(match)
-                tag = "$" + str(index) + "$"
-                amount = copy_list.count(match)
-                expression = expression.replace(match, "###", amount-1)
-                expression = expression.replace(match, tag + match + tag, 1)
-                expression = expression.replace("###", match, amount-1)
-
+        expression = tagGroups(expression, "(", ")", "$")
         # 2. {}
-        old_expression = expression
-        expression = "{"+ expression + "}"
-        result = regex.search(r'(?<rec>\{(?:[^{}]++|(?&rec))*\})', expression, flags=regex.VERBOSE)
-        expression = old_expression
-        if result:
-            matches = result.captures('rec')
-            matches.sort(key=len, reverse=True)    #{x}{x}{x}{x+1}{x}{x+1}
-            copy_list = []
-            for index, match in enumerate(matches):
-                copy_list.append(match)
-                tag = "£" + str(index) + "£"
-                amount = copy_list.count(match)
-                expression = expression.replace(match, "###", amount-1)
-                expression = expression.replace(match, tag + match + tag, 1)
-                expression = expression.replace("###", match, amount-1)
+        expression = tagGroups(expression, "{", "}", "£")
         # 3. []
-        old_expression = expression
-        expression = "["+ expression + "]"
-        result = regex.search(r'(?<rec>\[(?:[^\[\]]++|(?&rec))*\])', expression, flags=regex.VERBOSE)
-        expression = old_expression
-        if result:
-            matches = result.captures('rec')
-            matches.sort(key=len, reverse=True)
-            copy_list = []
-            for index, match in enumerate(matches):
-                copy_list.append(match)
-                tag = "`" + str(index) + "`"
-                amount = copy_list.count(match)
-                expression = expression.replace(match, "###", amount-1)
-                expression = expression.replace(match, tag + match + tag, 1)
-                expression = expression.replace("###", match, amount-1)
+        expression = tagGroups(expression, "[", "]", "`")
         return expression
   
     def translateConstants(self, expression: str, dictionary: dict=None):
@@ -564,17 +1237,17 @@ class LatexToCalcEngine:
     def translateUnits1(self, expression):
         # Skip unit processing if units_on is False AND there are no unit markers in the expression
         if not self.units_on and not ("\\mathrm" in expression or "\\text" in expression):
-            print("no text here", expression)
             return expression
         for i in range(expression.count("\\mathrm")):
-            match = re.search(r'\\mathrm\£(\d+)\£\{(.+)\}\£\1\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\mathrm\£(\d+)\£\{(.+)\}\£\1\£', expression)
             if match:
                 tag = "£" + match.group(1) + "£" # \mathrm{\sin \left(3\ \frac{\text{kJ}}{\text{kg}\cdot \text{K}}\right)}-\mathrm{\text{kJ}}
                 text_containing_units = match.group(2)
                 if self.TI_on:
                     old_text_containing_units = text_containing_units
-                    text_containing_units = re.sub(r'\\text\£(\d+)\£\{(.+)\}\£\1\£', r'\2', text_containing_units)
-                    text_containing_units = re.sub(r'([\Ω°a-zA-Z]+)', r'⁃\1』', text_containing_units)
+                    text_containing_units = self.re.sub(r'\\text\£(\d+)\£\{(.+)\}\£\1\£', r'\2', text_containing_units)
+                    text_containing_units = self.re.sub(r'([\Ω°a-zA-Z]+)', r'⁃\1』', text_containing_units)
                     text_containing_units = text_containing_units.replace("\\⁃", "\\")
                     expression = expression.replace("\\mathrm" + tag + "{" + old_text_containing_units + "}" + tag, text_containing_units, 1)
                     expression = expression.replace("⁃K", "⁃°K")
@@ -584,8 +1257,8 @@ class LatexToCalcEngine:
                 elif self.SC_on:
                     # laitetaan mathrm sisällä oleviin yksikköihin text{} ja kääntö jatkuu seuraavassa osiossa
                     old_text_containing_units = text_containing_units
-                    text_containing_units = re.sub(r'\\text\£(\d+)\£\{(.+)\}\£\1\£', r'\2', text_containing_units) # \mathrm{\text{}}
-                    text_containing_units = re.sub(r'([\Ω°a-zA-Z]+)', r'\\text{\1}', text_containing_units)
+                    text_containing_units = self.re.sub(r'\\text\£(\d+)\£\{(.+)\}\£\1\£', r'\2', text_containing_units) # \mathrm{\text{}}
+                    text_containing_units = self.re.sub(r'([\Ω°a-zA-Z]+)', r'\\text{\1}', text_containing_units)
                     expression = expression.replace("\\mathrm" + tag + "{" + old_text_containing_units + "}" + tag, text_containing_units, 1)
                     
                 else:
@@ -594,7 +1267,8 @@ class LatexToCalcEngine:
    
 
         for i in range(expression.count("\\text")):
-            match = re.search(r'\\text\£(\d+)\£\{(.+)\}\£\1\£', expression)    
+            checkLimits(expression)
+            match = self.re.search(r'\\text\£(\d+)\£\{(.+)\}\£\1\£', expression)    
             if match:
                 tag = "£" + match.group(1) + "£"
                 unit = match.group(2)
@@ -609,8 +1283,6 @@ class LatexToCalcEngine:
 
                 elif self.SC_on:
                     # units with prefixes (prefixes (4))
-                    global prefixes, units
-
                     hit = False
                     for prefix, full_prefix in self.SC_prefixes.items():
                         for unitIter, full_unit in self.SC_units.items():
@@ -632,7 +1304,7 @@ class LatexToCalcEngine:
                     expression = expression.replace("\\text" + tag + "{" + unit + "}" + tag, unit)
             
             if self.SC_on:
-                match = re.search(r'\\text\{(.+)\}', expression)  
+                match = self.re.search(r'\\text\{(.+)\}', expression)  
                 if match:
                     for prefix, full_prefix in self.SC_prefixes.items():
                         for unit, full_unit in self.SC_units.items():
@@ -654,7 +1326,7 @@ class LatexToCalcEngine:
         if "⁃" not in expression:
             return expression
         if self.TI_on:
-            long_units = re.findall(r'⁃([°a-zA-Z\ΩÅ]+)', expression)
+            long_units = self.re.findall(r'⁃([°a-zA-Z\ΩÅ]+)', expression)
             for long_unit in long_units:
                 if len(long_unit) > 1:
                     for unit, full_unit in self.units.items():
@@ -700,126 +1372,46 @@ class LatexToCalcEngine:
         for func in common_funcs:
             expression = expression.replace(func, f"\\{func}")
 
+        present = _presentFunctions(expression)
         for func in self.common_functions:
+            if func not in present:
+                continue
+            patterns = self.common_function_patterns[func]
             for i in range(expression.count(f'\\{func}')):     
+                checkLimits(expression)
 
-                expression = re.sub(
-                        r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\frac\£([0-9]+)\£\{(.+)\}\£\3\£\£([0-9]+)\£\{(.+)\}\£\5\£',
-                        r'\\' + func + r'^£\1£{\2}£\1£\\left$0\3$(((\4)/(\6))\\right)$0\3$',
-                        expression
-                    )
-                
-                expression = re.sub(
-                        r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\frac\£([0-9]+)\£\{(.+)\}\£\2\£\£([0-9]+)\£\{(.+)\}\£\4\£',
-                        r'\\' + func + r'^\1\\left$0\2$(((\3)/(\5))\\right)$0\2$',
-                        expression
-                    )
+                for pattern, template in patterns["fraction_subs"]:
+                    expression = pattern.sub(template, expression)
 
                 if f'\\{func}\\frac' in expression:
-                    expression = re.sub(
-                        r'\\' + func + r'\\frac\£([0-9]+)\£\{(.+)\}\£\1\£\£([0-9]+)\£\{(.+)\}\£\3\£',
-                        r'\\' + func + r'\\left$0\1$(((\2)/(\4))\\right)$0\1$',
-                        expression
-                    )
-                
-                ##############################################
-
-                # \sin ^{2n}\left(x\right)
-                expression = re.sub(
-                    r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$\^\£([0-9]+)\£\{(.+)\}\£\5\£',
-                    r'\(' + func + r'\(\4\^\(\6\)\)\)\^\(\2\)',
-                    expression
-                    )
-
-                expression = re.sub(
-                    r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$\^([α-ωΑ-Ωa-zA-Z0-9])',
-                    r'\(' + func + r'\(\4\^\(\5\)\)\)\^\(\2\)',
-                    expression
-                    )
-
-                # \sin ^2\left(x\right)
-                expression = re.sub(
-                    r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$\^\£([0-9]+)\£\{(.+)\}\£\4\£',
-                    r'\(' + func + r'\(\3\^\(\5\)\)\)\^\(\1\)',
-                    expression
-                    )
+                    pattern, template = patterns["bare_fraction_sub"]
+                    expression = pattern.sub(template, expression)
                 
-                expression = re.sub(
-                    r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$\^([α-ωΑ-Ωa-zA-Z0-9])',
-                    r'\(' + func + r'\(\3\^\(\4\)\)\)\^\(\1\)',
-                    expression
-                    )
-
                 ##############################################
 
-                expression = re.sub(
-                    r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$',
-                    r'\(' + func + r'\(\4\)\)\^\(\2\)',
-                    expression
-                    )
-
-                # \sin ^2\left(x\right)
-                expression = re.sub(
-                    r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$',
-                    r'\(' + func + r'\(\3\)\)\^\(\1\)',
-                    expression
-                    )
-
-                # \sin ^{2n}x^{2k}
-                expression = re.sub(
-                    r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\4\£',
-                    r'\(' + func + r'\(\3\^\(\5\)\)\)\^\(\2\)',
-                    expression
-                    )
-                
-                # \sin ^{2n}x^2
-                expression = re.sub(
-                    r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9])',
-                    r'\(' + func + r'\(\3\^\(\4\)\)\)\^\(\2\)',
-                    expression
-                    )
-
-                # \sin ^2x^{2k}
-                expression = re.sub(
-                    r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\3\£',
-                    r'\(' + func + r'\(\2\^\(\4\)\)\)\^\(\1\)',
-                    expression
-                    ) # korjaa
-                
-                # \sin ^{2n}x
-                expression = re.sub(
-                    r'\\' + func + r'\^\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)',
-                    r'\(' + func + r'\(\3\)\)\^\(\2\)',
-                    expression
-                    )
-                
-                # \sin ^2x
-                expression = re.sub(
-                    r'\\' + func + r'\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)',
-                    r'\(' + func + r'\(\2\)\)\^\(\1\)',
-                    expression
-                    )
+                for pattern, template in patterns["power_subs"]:
+                    expression = pattern.sub(template, expression)
 
-                match = re.search(r'\\' + func + r'\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', expression)
+                match = patterns["left"].search(expression)
                 if match:
                     tag = "$" + match.group(1) + "$"
                     arg = match.group(2)
                     expression = expression.replace("\\" + func + "\\left" + tag + "(" + arg + "\\right)" + tag, func + "(" + arg + ")")
                 
-                match = re.search(r'\\' + func + r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', expression)
+                match = patterns["argument_power_tag"].search(expression)
                 if match:
                     arg = match.group(1)
                     tag = "£" + match.group(2) + "£"
                     exp = match.group(3)
                     expression = expression.replace("\\" + func + arg + "^" + tag + "{" + exp + "}" + tag, func + "(" + arg + "^(" + exp + "))")
 
-                match = re.search(r'\\' + func + r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', expression)
+                match = patterns["argument_power"].search(expression)
                 if match:
                     arg = match.group(1)
                     exp = match.group(2)
                     expression = expression.replace("\\" + func + arg + "^" + exp, func + "(" + arg + "^" + exp + ")")
 
-                match = re.search(r'\\' + func + r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+                match = patterns["argument"].search(expression)
                 if match:
                     arg = match.group(1)
                     expression = expression.replace("\\" + func + arg, func + "(" + arg + ")")
@@ -828,7 +1420,8 @@ class LatexToCalcEngine:
 
     def translateSum(self, expression):
         for i in range(expression.count("\\sum")):
-            match = re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£\\left\$(\d+)\$\((.+)\\right\)\$\6\$', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£\\left\$(\d+)\$\((.+)\\right\)\$\6\$', expression)
             if match:
                 tag1 = match.group(1)
                 lower = match.group(2)
@@ -842,7 +1435,7 @@ class LatexToCalcEngine:
                 tag_3 = "$" + tag3 + "$"
                 expression = expression.replace("\\sum_" + tag_1 + "{" + lower + "=" + lower2 + "}" + tag_1 + "^" + tag_2 + "{" + upper + "}" + tag_2 + "\\left" + tag_3 + "(" + to_be_summed + "\\right)" + tag_3, "∑(" + to_be_summed + "," + lower + "," + lower2 + "," + upper + ")")
 
-            match = re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$(\d+)\$\((.+)\\right\)\$\5\$', expression)
+            match = self.re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$(\d+)\$\((.+)\\right\)\$\5\$', expression)
             if match:
                 tag1 = match.group(1)
                 lower = match.group(2)
@@ -854,7 +1447,7 @@ class LatexToCalcEngine:
                 tag_3 = "$" + tag3 + "$"
                 expression = expression.replace("\\sum_" + tag_1 + "{" + lower + "=" + lower2 + "}" + tag_1 + "^" + upper + "\\left" + tag_3 + "(" + to_be_summed + "\\right)" + tag_3, "∑(" + to_be_summed + "," + lower + "," + lower2 + "," + upper + ")")
 
-            match = re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+            match = self.re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
             if match:
                 tag1 = match.group(1)
                 lower = match.group(2)
@@ -866,7 +1459,7 @@ class LatexToCalcEngine:
                 tag_2 = "£" + tag2 + "£" # \sum _{3=x}^w\left(d+1\right)
                 expression = expression.replace("\\sum_" + tag_1 + "{" + lower + "=" + lower2 + "}" + tag_1 + "^" + tag_2 + "{" + upper + "}" + tag_2 + to_be_summed, "∑(" + to_be_summed + "," + lower + "," + lower2 + "," + upper + ")")
 
-            match = re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+            match = self.re.search(r'\\sum_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
             if match:
                     tag1 = match.group(1)
                     lower = match.group(2)
@@ -879,7 +1472,8 @@ class LatexToCalcEngine:
 
     def translateProd(self, expression):
         for i in range(expression.count("\\prod")):
-            match = re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£\\left\$(\d+)\$\((.+)\\right\)\$\6\$', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£\\left\$(\d+)\$\((.+)\\right\)\$\6\$', expression)
             if match:
                 tag_1 = "£" + match.group(1) + "£"
                 lower = match.group(2)
@@ -893,7 +1487,7 @@ class LatexToCalcEngine:
                                                 "∏(" + to_be_summed + "," + lower + "," + lower2 + "," + upper + ")"
                                                 )
                 
-            match = re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$(\d+)\$\((.+)\\right\)\$\5\$', expression)
+            match = self.re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])\\left\$(\d+)\$\((.+)\\right\)\$\5\$', expression)
             if match:
                 tag_1 = "£" + match.group(1) + "£"
                 lower = match.group(2)
@@ -903,7 +1497,7 @@ class LatexToCalcEngine:
                 to_be_summed = match.group(6)
                 expression = expression.replace("\\prod_" + tag_1 + "{" + lower + "=" + lower2 + "}" + tag_1 + "^" + upper + "\\left" + tag_3 + "(" + to_be_summed + "\\right)" + tag_3, "∏(" + to_be_summed + "," + lower + "," + lower2 + "," + upper + ")")
 
-            match = re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+            match = self.re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^\£(\d+)\£\{(.+)\}\£\4\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
             if match:
                 tag_1 = "£" + match.group(1) + "£"
                 lower = match.group(2)
@@ -913,7 +1507,7 @@ class LatexToCalcEngine:
                 to_be_summed = match.group(6)
                 expression = expression.replace("\\prod_" + tag_1 + "{" + lower + "=" + lower2 + "}" + tag_1 + "^" + tag_2 + "{" + upper + "}" + tag_2 + to_be_summed, "∏(" + to_be_summed + "," + lower + "," + lower2 + "," + upper + ")")
 
-            match = re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+            match = self.re.search(r'\\prod_\£(\d+)\£\{(.+)\=(.+)\}\£\1\£\^([α-ωΑ-Ωa-zA-Z0-9])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
             if match:
                 tag_1 = "£" + match.group(1) + "£"
                 lower = match.group(2)
@@ -926,7 +1520,8 @@ class LatexToCalcEngine:
     def translateCombinations(self, expression):
         sym = "," if self.TI_on else ";"
         for i in range(expression.count("\\binom")):
-            match = re.search(r'\\binom\£(\d+)\£\{(.+)\}\£\1\£\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\binom\£(\d+)\£\{(.+)\}\£\1\£\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag_1 = "£" + match.group(1) + "£"
                 upper = match.group(2)
@@ -940,7 +1535,8 @@ class LatexToCalcEngine:
     def translateLimits(self, expression):
         # \lim _{x\rightarrow \infty ^-}\left(x+1\right)
         for i in range(expression.count("\\lim")):
-            match = re.search(r'\\lim_\£(\d+)\£\{(.+?)\\rightarrow(.+)\^([\+\-])\}\£\1\£\\left\$(\d+)\$\((.+)\\right\)\$\5\$', expression) # ^+-
+            checkLimits(expression)
+            match = self.re.search(r'\\lim_\£(\d+)\£\{(.+?)\\rightarrow(.+)\^([\+\-])\}\£\1\£\\left\$(\d+)\$\((.+)\\right\)\$\5\$', expression) # ^+-
             if match:
                 tag_1 = "£" + match.group(1) + "£"
                 variable = match.group(2)
@@ -957,7 +1553,7 @@ class LatexToCalcEngine:
                 expression = expression.replace(string, replacement)
                 
             
-            match = re.search(r'\\lim_\£(\d+)\£\{(.+?)\\rightarrow(.+)\}\£\1\£\\left\$(\d+)\$\((.+)\\right\)\$\4\$', expression)
+            match = self.re.search(r'\\lim_\£(\d+)\£\{(.+?)\\rightarrow(.+)\}\£\1\£\\left\$(\d+)\$\((.+)\\right\)\$\4\$', expression)
             if match:
                 tag_1 = "£" + match.group(1) + "£"
                 variable = match.group(2)
@@ -974,7 +1570,8 @@ class LatexToCalcEngine:
         sym = "," if self.TI_on else ";"
 
         for i in range(expression.count("_")):
-            match = re.search(r'\\left\$(\d+)\$\((.+)\\right\)\$\1\$_\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\left\$(\d+)\$\((.+)\\right\)\$\1\$_\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = "$" + match.group(1) + "$"
                 n = match.group(2)
@@ -983,7 +1580,7 @@ class LatexToCalcEngine:
                 string = "\\left" + tag1 + "(" + n + "\\right)" + tag1 + "_" + tag2 + "{" + r + "}" + tag2
                 expression = expression.replace(string, "nPr(" + n + sym + r + ")")
 
-            match = re.search(r'\\left\$(\d+)\$\((.+)\\right\)\$\1\$_([α-ωΑ-Ωa-zA-Z0-9])', expression)
+            match = self.re.search(r'\\left\$(\d+)\$\((.+)\\right\)\$\1\$_([α-ωΑ-Ωa-zA-Z0-9])', expression)
             if match:
                 tag1 = "$" + match.group(1) + "$"
                 n = match.group(2)
@@ -994,7 +1591,8 @@ class LatexToCalcEngine:
 
     def translateFractions(self, expression):
         for i in range(expression.count("\\frac")):
-            match = re.search(r'\\frac\£(\d+)\£\{(.+)\}\£\1\£\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\frac\£(\d+)\£\{(.+)\}\£\1\£\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = "£" + match.group(1) + "£"
                 numerator = match.group(2)
@@ -1008,10 +1606,10 @@ class LatexToCalcEngine:
         if "\\ln" not in expression:
             return expression
         # test \begin{cases}\begin{matrix}\pi ^{\ln \Delta ^{\Omega }}&\ln \sigma ^{\frac{\tau }{2}}\\\ln x^2&\ln \left(i\right)^3\end{matrix}=\ln a\ln d-\ln b\ln c&\\\frac{\ln \left(\ln x^2\right)^3}{\ln y}=\ln \alpha ^{\ln \left(\beta -1\right)^{-u\ln w}}&\end{cases}
-        expression = re.sub(r'\\ln\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', r'ln(\2)', expression)
-        expression = re.sub(r'\\ln([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', r'ln(\1^(\3))', expression)
-        expression = re.sub(r'\\ln([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', r'ln(\1^\2)', expression)
-        expression = re.sub(r'\\ln([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', r'ln(\1)', expression)
+        expression = self.re.sub(r'\\ln\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', r'ln(\2)', expression)
+        expression = self.re.sub(r'\\ln([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', r'ln(\1^(\3))', expression)
+        expression = self.re.sub(r'\\ln([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', r'ln(\1^\2)', expression)
+        expression = self.re.sub(r'\\ln([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', r'ln(\1)', expression)
 
         return expression
 
@@ -1021,7 +1619,8 @@ class LatexToCalcEngine:
             return expression
         if self.TI_on:
             for i in range(expression.count("\\log_")):
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$', expression)
+                checkLimits(expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$', expression)
                 if match:
                     tagp = "£" + match.group(1) + "£"
                     base = match.group(2)
@@ -1029,14 +1628,14 @@ class LatexToCalcEngine:
                     arg = match.group(4)
                     expression = expression.replace("\\log_" + tagp + "{" + base + "}" + tagp + "\\left" + tagd + "(" + arg + "\\right)" + tagd, "log(" + arg + "," + base + ")")
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
                 if match:
                     base = match.group(1)
                     tag = "$" + match.group(2) + "$"
                     arg = match.group(3)
                     expression = expression.replace("\\log_" + base + "\\left" + tag + "(" + arg + "\\right)" + tag, "log(" + arg + "," + base + ")")
 
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\4\£', expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\4\£', expression)
                 if match:
                     tag_1 = "£" + match.group(1) + "£"
                     base = match.group(2)
@@ -1045,7 +1644,7 @@ class LatexToCalcEngine:
                     exp = match.group(5)
                     expression = expression.replace("\\log_" + tag_1 + "{" + base + "}" + tag_1 + arg + "^" + tag_2 + "{" + exp + "}" + tag_2, "log(" + arg + "^(" + exp + ")," + base + ")")
 
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
                 if match:
                     tag = "£" + match.group(1) + "£"
                     base = match.group(2)
@@ -1053,21 +1652,21 @@ class LatexToCalcEngine:
                     exp = match.group(4)
                     expression = expression.replace("\\log_" + tag + "{" + base + "}" + tag + arg + "^" + exp, "log(" + arg + "^" + exp + "," + base + ")")
 
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
                 if match:
                     tag = "£" + match.group(1) + "£"
                     base = match.group(2)
                     arg = match.group(3)
                     expression = expression.replace("\\log_" + tag + "{" + base + "}" + tag + arg, "log(" + arg + "," + base + ")")
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
                 if match:
                     base = match.group(1)
                     tag = "$" + match.group(2) + "$"
                     arg = match.group(3)
                     expression = expression.replace("\\log_" + base + "\\left" + tag + "("+ arg + "\\right)" + tag, "log(" + arg + "," + base + ")")
                         
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\3\£', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\3\£', expression)
                 if match:
                     base = match.group(1)
                     arg = match.group(2)
@@ -1076,14 +1675,14 @@ class LatexToCalcEngine:
                     expression = expression.replace("\\log_" + base + arg + "^" + tag + "{" + exp + "}" + tag, "log(" + arg + "^(" + exp + ")," + base + ")")
 
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
                 if match:
                     base = match.group(1)
                     arg = match.group(2)
                     exp = match.group(3)
                     expression = expression.replace("\\log_" + base + arg + "^" + exp, "log(" + arg + "^" + exp + "," + base + ")")
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
                 if match:
                     base = match.group(1)
                     arg = match.group(2)
@@ -1091,26 +1690,27 @@ class LatexToCalcEngine:
 
             # log without base
             for i in range(expression.count("\\log")):
-                match = re.search(r'\\log\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', expression)
+                checkLimits(expression)
+                match = self.re.search(r'\\log\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', expression)
                 if match:
                     tag = "$" + match.group(1) + "$"
                     arg = match.group(2)
                     expression = expression.replace("\\log\\left" + tag + "(" + arg + "\\right)" + tag, "log(" + arg + ",10)")
 
-                match = re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', expression)
+                match = self.re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', expression)
                 if match:
                     arg = match.group(1)
                     tag = "£" + match.group(2) + "£"
                     exp = match.group(3)
                     expression = expression.replace("\\log" + arg + "^" + tag + "{" + exp + "}" + tag, "log(" + arg + "^(" + exp + "),10)")
 
-                match = re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', expression)
+                match = self.re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', expression)
                 if match:
                     arg = match.group(1)
                     exp = match.group(2)
                     expression = expression.replace("\\log" + arg + "^" + exp, "log(" + arg + "^" + exp + ",10)")
 
-                match = re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+                match = self.re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
                 if match:
                     arg = match.group(1)
                     expression = expression.replace("\\log" + arg, "log(" + arg + ",10)")
@@ -1118,7 +1718,8 @@ class LatexToCalcEngine:
         else:
         # log with base
             for i in range(expression.count("\\log_")):
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$', expression)
+                checkLimits(expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£\\left\$([0-9]+)\$\((.+)\\right\)\$\3\$', expression)
                 if match:
                     tagp = "£" + match.group(1) + "£"
                     base = match.group(2)
@@ -1126,14 +1727,14 @@ class LatexToCalcEngine:
                     arg = match.group(4)
                     expression = expression.replace("\\log_" + tagp + "{" + base + "}" + tagp + "\\left" + tagd + "(" + arg + "\\right)" + tagd, "log(" + base + ";" + arg + ")")
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
                 if match:
                     base = match.group(1)
                     tag = "$" + match.group(2) + "$"
                     arg = match.group(3)
                     expression = expression.replace("\\log_" + base + "\\left" + tag + "(" + arg + "\\right)" + tag, "log(" + base + ";" + arg + ")")
 
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\4\£', expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\4\£', expression)
                 if match:
                     tag_1 = "£" + match.group(1) + "£"
                     base = match.group(2)
@@ -1142,7 +1743,7 @@ class LatexToCalcEngine:
                     exp = match.group(5)
                     expression = expression.replace("\\log_" + tag_1 + "{" + base + "}" + tag_1 + arg + "^" + tag_2 + "{" + exp + "}" + tag_2, "log(" + base + ";" +  arg + "^(" + exp + "))")
 
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
                 if match:
                     tag = "£" + match.group(1) + "£"
                     base = match.group(2)
@@ -1150,21 +1751,21 @@ class LatexToCalcEngine:
                     exp = match.group(4)
                     expression = expression.replace("\\log_" + tag + "{" + base + "}" + tag + arg + "^" + exp, "log(" + base + ";" + arg + "^" + exp + ")")
 
-                match = re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+                match = self.re.search(r'\\log_\£([0-9]+)\£\{(.+)\}\£\1\£([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
                 if match:
                     tag = "£" + match.group(1) + "£"
                     base = match.group(2)
                     arg = match.group(3)
                     expression = expression.replace("\\log_" + tag + "{" + base + "}" + tag + arg, "log(" + base + ";" + arg + ")")
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])\\left\$([0-9]+)\$\((.+)\\right\)\$\2\$', expression)
                 if match:
                     base = match.group(1)
                     tag = "$" + match.group(2) + "$"
                     arg = match.group(3)
                     expression = expression.replace("\\log_" + base + "\\left" + tag + "("+ arg + "\\right)" + tag, "log(" + base + ";" + arg + ")")
                         
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\3\£', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\3\£', expression)
                 if match: 
                     base = match.group(1)
                     arg = match.group(2)
@@ -1173,14 +1774,14 @@ class LatexToCalcEngine:
                     expression = expression.replace("\\log_" + base + arg + "^" + tag + "{" + exp + "}" + tag, "log(" + base + ";" + arg + "^(" + exp + "))")
 
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])', expression)
                 if match:
                     base = match.group(1)
                     arg = match.group(2)
                     exp = match.group(3)
                     expression = expression.replace("\\log_" + base + arg + "^" + exp, "log(" + base + ";" + arg + "^" + exp + ")")
 
-                match = re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+                match = self.re.search(r'\\log_([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°])([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
                 if match:
                     base = match.group(1)
                     arg = match.group(2)
@@ -1188,26 +1789,27 @@ class LatexToCalcEngine:
 
             # log without base
             for i in range(expression.count("\\log")):
-                match = re.search(r'\\log\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', expression)
+                checkLimits(expression)
+                match = self.re.search(r'\\log\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', expression)
                 if match:
                     tag = "$" + match.group(1) + "$"
                     arg = match.group(2)
                     expression = expression.replace("\\log\\left" + tag + "(" + arg + "\\right)" + tag, "log(10;" + arg + ")")
                 
-                match = re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', expression)
+                match = self.re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', expression)
                 if match:
                     arg = match.group(1)
                     tag = "£" + match.group(2) + "£"
                     exp = match.group(3)
                     expression = expression.replace("\\log" + arg + "^" + tag + "{" + exp + "}" + tag, "log(10;" + arg + "^(" + exp + "))")
 
-                match = re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', expression)
+                match = self.re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', expression)
                 if match:
                     arg = match.group(1)
                     exp = match.group(2)
                     expression = expression.replace("\\log" + arg + "^" + exp, "log(10;" + arg + "^" + exp + ")")
 
-                match = re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
+                match = self.re.search(r'\\log([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', expression)
                 if match:
                     arg = match.group(1)
                     expression = expression.replace("\\log" + arg, "log(10;" + arg + ")")
@@ -1219,22 +1821,23 @@ class LatexToCalcEngine:
             return expression
         
         replacementPattern = r'log(\2,10)' if self.TI_on else r'log(10;\2)'
-        expression = re.sub(r'\\lg\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', replacementPattern, expression)
+        expression = self.re.sub(r'\\lg\\left\$([0-9]+)\$\((.+)\\right\)\$\1\$', replacementPattern, expression)
 
         replacementPattern = r'log(\1^(\3),10)' if self.TI_on else r'log(10;\1^(\3))'
-        expression = re.sub(r'\\lg([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', replacementPattern, expression)
+        expression = self.re.sub(r'\\lg([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^\£([0-9]+)\£\{(.+)\}\£\2\£', replacementPattern, expression)
 
         replacementPattern = r'log(\1^\2,10)' if self.TI_on else r'log(10;\1^\2)'
-        expression = re.sub(r'\\lg([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', replacementPattern, expression)
+        expression = self.re.sub(r'\\lg([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)\^([α-ωΑ-Ωa-zA-Z0-9°])', replacementPattern, expression)
                             
         replacementPattern = r'log(\1,10)' if self.TI_on else r'log(10;\1)'
-        expression = re.sub(r'\\lg([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', replacementPattern, expression)
+        expression = self.re.sub(r'\\lg([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°]+)', replacementPattern, expression)
       
         return expression
 
     def translateSqrt(self, expression):
         for i in range(expression.count("\\sqrt")):
-            match = re.search(r'\\sqrt\`([0-9]+)\`\[(.+)\]\`\1\`\£([0-9]+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\sqrt\`([0-9]+)\`\[(.+)\]\`\1\`\£([0-9]+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tagq = "`" + match.group(1) + "`"
                 n = match.group(2)
@@ -1245,7 +1848,7 @@ class LatexToCalcEngine:
 
                 expression = expression.replace(string, replacement)
         
-            match = re.search(r'\\sqrt\£([0-9]+)\£\{(.+)\}\£\1\£', expression)
+            match = self.re.search(r'\\sqrt\£([0-9]+)\£\{(.+)\}\£\1\£', expression)
             if match:
                 tag = "£" + match.group(1) + "£"    
                 x = match.group(2)
@@ -1259,20 +1862,20 @@ class LatexToCalcEngine:
             expression = expression.replace("end", "enj")
             
             # Replace \\begin£<number>£{cases}£<number>£ with system(
-            expression = re.sub(r'\\begin£([0-9]+)£\{cases\}£\1£', r'system(', expression)
+            expression = self.re.sub(r'\\begin£([0-9]+)£\{cases\}£\1£', r'system(', expression)
 
             # Replace &<content>\\enj£<number>£{cases}£<number>£ with <content>)
-            expression = re.sub(r'&([^\\]*)\\enj£([0-9]+)£\{cases\}£\2£', r' \1)', expression)
+            expression = self.re.sub(r'&([^\\]*)\\enj£([0-9]+)£\{cases\}£\2£', r' \1)', expression)
 
             # Handle cases without &
-            expression = re.sub(r'\\enj£([0-9]+)£\{cases\}£\1£', r')', expression)
+            expression = self.re.sub(r'\\enj£([0-9]+)£\{cases\}£\1£', r')', expression)
 
             # Replace &<content>\\ with <content>, 
-            expression = re.sub(r'&([^\\]*)\\\\', r' \1,', expression)
+            expression = self.re.sub(r'&([^\\]*)\\\\', r' \1,', expression)
             
             # Replace <content>\\ with <content>, for cases without &
             if '&' not in expression:
-                expression = re.sub(r'([^&\\]+)\\\\', r'\1,', expression)
+                expression = self.re.sub(r'([^&\\]+)\\\\', r'\1,', expression)
 
 
 
@@ -1284,26 +1887,11 @@ class LatexToCalcEngine:
         if "\\int_" in expression:
             expression = expression.replace("\\int_", "¤") 
             
-            old_expression = expression
-            expression = "¤" + expression + "d"
-            result = regex.search(r'(?<rec>¤(?:[^¤d]++|(?&rec))*d)', expression, flags=regex.VERBOSE)
-            expression = old_expression
-            if result:
-                matches = result.captures('rec')        
-                matches.sort(key=len, reverse=True)    
-                                                      
-                copy_list = []
-                for index, match in enumerate(matches):
-                    copy_list.append(match)
-                    tag = "§" + str(index) + "§"
-                    amount = copy_list.count(match)
-                    expression = expression.replace(match, "###", amount-1)
-                    expression = expression.replace(match, tag + match + tag, 1)
-                    expression = expression.replace("###", match, amount-1)
-            print(expression)
+            expression = tagGroups(expression, "¤", "d", "§")
             for i in range(expression.count("¤")):
+                checkLimits(expression)
                 # \int _{12}^{34}xdx
-                match = re.search(r'\§(\d+)\§¤\£(\d+)\£\{(.+)\}\£\2\£\^\£(\d+)\£\{(.+)\}\£\4\£(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
+                match = self.re.search(r'\§(\d+)\§¤\£(\d+)\£\{(.+)\}\£\2\£\^\£(\d+)\£\{(.+)\}\£\4\£(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
                 
                 if match:
                     tagInt = "§" + match.group(1) + "§"
@@ -1319,7 +1907,7 @@ class LatexToCalcEngine:
                         )
                     
                 # \int _{12}^3xdx
-                match = re.search(r'\§(\d+)\§¤\£(\d+)\£\{(.+)\}\£\2\£\^([a-ce-zA-Z0-9α-ωΑ-Ω])(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
+                match = self.re.search(r'\§(\d+)\§¤\£(\d+)\£\{(.+)\}\£\2\£\^([a-ce-zA-Z0-9α-ωΑ-Ω])(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
                 if match:
                     tagInt = "§" + match.group(1) + "§"
                     tag1 = "£" + match.group(2) + "£"
@@ -1332,7 +1920,7 @@ class LatexToCalcEngine:
                         "∫((" + integrand + "),(" + variable + "),(" + lower + "),(" + upper + "))"
                         )
                 # \int _1^{23}xdx
-                match = re.search(r'\§(\d+)\§¤([^d])\^\£(\d+)\£\{(.+)\}\£\3\£(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
+                match = self.re.search(r'\§(\d+)\§¤([^d])\^\£(\d+)\£\{(.+)\}\£\3\£(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
                 if match:
                     tagInt = "§" + match.group(1) + "§"
                     lower = match.group(2)
@@ -1345,7 +1933,7 @@ class LatexToCalcEngine:
                         "∫((" + integrand + "),(" + variable + "),(" + lower + "),(" + upper + "))"
                         )
                 # \int _1^2xdx
-                match = re.search(r'\§(\d+)\§¤([a-ce-zA-Z0-9α-ωΑ-Ω])\^([a-ce-zA-Z0-9α-ωΑ-Ω])(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
+                match = self.re.search(r'\§(\d+)\§¤([a-ce-zA-Z0-9α-ωΑ-Ω])\^([a-ce-zA-Z0-9α-ωΑ-Ω])(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
                 if match:
                     tagInt = "§" + match.group(1) + "§"
                     lower = match.group(2)
@@ -1359,7 +1947,7 @@ class LatexToCalcEngine:
                     
                 # \int _{ }^{ }x\ dx
                 
-                match = re.search(r'\§(\d+)\§¤\£(\d+)\£{}\£\2\£\^\£(\d+)\£{}\£\3\£(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
+                match = self.re.search(r'\§(\d+)\§¤\£(\d+)\£{}\£\2\£\^\£(\d+)\£{}\£\3\£(.+)d\§\1\§([a-ce-zA-Z0-9α-ωΑ-Ω])', expression)
                 if match:
                     tagInt = "§" + match.group(1) + "§"
                     tag1 = match.group(2)
@@ -1378,17 +1966,17 @@ class LatexToCalcEngine:
     def translateDerivatives(self, expression):
         derivative = False
         
-        if re.search(r"\{d\S\}", expression):
+        if self.re.search(r"\{d\S\}", expression):
             derivative = True
             
-        if re.search(r"D", expression):
+        if self.re.search(r"D", expression):
             expression = expression.replace("D", r"{{d}/{dx}}")
             derivative = True
             
         if derivative:
             # Match pattern for {d followed by any non-space character
             pattern = r"\{d\S\}"
-            matches = list(re.finditer(pattern, expression))
+            matches = list(self.re.finditer(pattern, expression))
 
             for match in matches:
                 left_count = 0
@@ -1397,7 +1985,7 @@ class LatexToCalcEngine:
                 final_right_pos = -1
 
                 # Find matching bracket
-                for match2 in re.finditer(r"\\left|\\right", expression[start_position:]):
+                for match2 in self.re.finditer(r"\\left|\\right", expression[start_position:]):
                     if match2.group() == r"\left":
                         left_count += 1
                     elif match2.group() == r"\right":
@@ -1427,8 +2015,9 @@ class LatexToCalcEngine:
 
         vector = False
         for i in range(expression.count("matrix") // 2):
+            checkLimits(expression)
 
-            match = re.search(r'\\left\`(\d+)\`\[\\begin\£(\d+)\£\{matrix\}\£\2\£(.+)\\\\(.+)\\enj\£(\d+)\£\{matrix\}\£\5\£\\right\]\`\1\`', expression)
+            match = self.re.search(r'\\left\`(\d+)\`\[\\begin\£(\d+)\£\{matrix\}\£\2\£(.+)\\\\(.+)\\enj\£(\d+)\£\{matrix\}\£\5\£\\right\]\`\1\`', expression)
 
             if match:
                 tag1 = '`' + match.group(1) + '`'
@@ -1452,7 +2041,8 @@ class LatexToCalcEngine:
         # dot product
         if vector:
             for i in range(expression.count('`') // 2):
-                match = re.search(r'\`(\d+)\`\[(.+)\]\`\1\`\*\`(\d+)\`\[(.+)\]\`\3\`', expression)
+                checkLimits(expression)
+                match = self.re.search(r'\`(\d+)\`\[(.+)\]\`\1\`\*\`(\d+)\`\[(.+)\]\`\3\`', expression)
                 if match:
                     tag1 = '`' + match.group(1) + '`'
                     vectorA = match.group(2)
@@ -1462,7 +2052,8 @@ class LatexToCalcEngine:
 
         # \bar£1£{u}£1£*\bar£2£{v}£2£
         for i in range(expression.count('\\bar') // 2):
-            match = re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1471,7 +2062,8 @@ class LatexToCalcEngine:
                 expression = expression.replace(f'\\bar{tag1}{vectorA}{tag1}*\\bar{tag2}{vectorB}{tag2}', f'dotP({vectorA},{vectorB})')
 
         for i in range(expression.count('\\overline') // 2):
-            match = re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1480,7 +2072,8 @@ class LatexToCalcEngine:
                 expression = expression.replace(f'\\overline{tag1}{vectorA}{tag1}*\\overline{tag2}{vectorB}{tag2}', f'dotP({vectorA},{vectorB})')
         
         for i in range(expression.count('\\bar')):
-            match = re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1489,7 +2082,8 @@ class LatexToCalcEngine:
                 expression = expression.replace(f'\\bar{tag1}{vectorA}{tag1}*\\overline{tag2}{vectorB}{tag2}', f'dotP({vectorA},{vectorB})')
 
         for i in range(expression.count('\\overline')):
-            match = re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1500,7 +2094,8 @@ class LatexToCalcEngine:
         # cross product        
         if vector:
             for i in range(expression.count('`') // 2):
-                match = re.search(r'\`(\d+)\`\[(.+)\]\`\1\`\*ΦcrossΦ\`(\d+)\`\[(.+)\]\`\3\`', expression)
+                checkLimits(expression)
+                match = self.re.search(r'\`(\d+)\`\[(.+)\]\`\1\`\*ΦcrossΦ\`(\d+)\`\[(.+)\]\`\3\`', expression)
                 if match:
                     tag1 = '`' + match.group(1) + '`'
                     vectorA = match.group(2)
@@ -1510,7 +2105,8 @@ class LatexToCalcEngine:
 
         # \bar£1£{u}£1£*ΦcrossΦ\bar£2£{v}£2£
         for i in range(expression.count('\\bar') // 2):
-            match = re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1519,7 +2115,8 @@ class LatexToCalcEngine:
                 expression = expression.replace(f'\\bar{tag1}{vectorA}{tag1}*ΦcrossΦ\\bar{tag2}{vectorB}{tag2}', f'crossP({vectorA},{vectorB})')
 
         for i in range(expression.count('\\overline') // 2):
-            match = re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1528,7 +2125,8 @@ class LatexToCalcEngine:
                 expression = expression.replace(f'\\overline{tag1}{vectorA}{tag1}*ΦcrossΦ\\overline{tag2}{vectorB}{tag2}', f'crossP({vectorA},{vectorB})')
         
         for i in range(expression.count('\\bar')):
-            match = re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\bar\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\overline\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1537,7 +2135,8 @@ class LatexToCalcEngine:
                 expression = expression.replace(f'\\bar{tag1}{vectorA}{tag1}*ΦcrossΦ\\overline{tag2}{vectorB}{tag2}', f'crossP({vectorA},{vectorB})')
 
         for i in range(expression.count('\\overline')):
-            match = re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\\overline\£(\d+)\£\{(.+)\}\£\1\£\*ΦcrossΦ\\bar\£(\d+)\£\{(.+)\}\£\3\£', expression)
             if match:
                 tag1 = '£' + match.group(1) + '£'
                 vectorA = '{' + match.group(2) + '}'
@@ -1551,6 +2150,7 @@ class LatexToCalcEngine:
         # identifier 𝔦, 𝔧, 𝔨
         
         for i in range(expression.count('𝕚') + expression.count('𝕛') + expression.count('ӄ')):
+            checkLimits(expression)
             if kVector:
                 expression = expression.replace('𝕚', f'[1,0,0]', 1).replace('𝕛', f'[0,1,0]', 1).replace('ӄ', f'[0,0,1]', 1)
             else:
@@ -1565,29 +2165,14 @@ class LatexToCalcEngine:
             return expression
         expression = expression.replace("end", "enj")
         # tags | 「 」, Ɛ
-        expression = re.sub(r'\\begin\£(\d+)\£\{matrix}\£\1\£', r'「', expression)
-        expression = re.sub(r'\\enj\£(\d+)\£\{matrix\}\£\1\£', r'」', expression)
-
-        old_expression = expression
-        expression = "「" + expression + "」"
-
-        result = regex.search(r'(?<rec>\「(?:[^「」]++|(?&rec))*\」)', expression, flags=regex.VERBOSE)
-        expression = old_expression
-        if result:
-            matches = result.captures('rec')
-            matches.sort(key=len, reverse=True)
-            copy_list = []
-            for index, match in enumerate(matches):
-                copy_list.append(match)
-                tag = "Ɛ" + str(index) + "Ɛ"
-                amount = copy_list.count(match)
-                expression = expression.replace(match, "###", amount-1)
-                expression = expression.replace(match, tag + match + tag, 1)
-                expression = expression.replace("###", match, amount-1)
+        expression = self.re.sub(r'\\begin\£(\d+)\£\{matrix}\£\1\£', r'「', expression)
+        expression = self.re.sub(r'\\enj\£(\d+)\£\{matrix\}\£\1\£', r'」', expression)
+
+        expression = tagGroups(expression, "「", "」", "Ɛ")
 
-        
         for i in range(expression.count("「")):
-            match = re.search(r'\Ɛ(\d+)\Ɛ\「(.+)\」\Ɛ\1\Ɛ', expression)
+            checkLimits(expression)
+            match = self.re.search(r'\Ɛ(\d+)\Ɛ\「(.+)\」\Ɛ\1\Ɛ', expression)
             if match:
                 tag = f'Ɛ{match.group(1)}Ɛ'
                 matrixContents = match.group(2)
@@ -1610,56 +2195,38 @@ class LatexToCalcEngine:
         unit_pattern = r'_⁃([A-Za-z])』'
         # Pattern for direct numeric subscripts (_3)
         digit_pattern = r'_(\d+)'
-        # Define the subscript digits and the letter mappings
-        subscript_digits = "₀₁₂₃₄₅₆₇₈₉" 
-        indexDict = {
-            # az    
-            "a": "", "b": "", "c": "", "d": "", "e": "", "f": "",
-            "g": "", "h": "", "i": "", "j": "", "k": "", "l": "",
-            "m": "", "n": "", "o": "", "p": "", "q": "", "r": "",
-            "s": "", "t": "", "u": "", "v": "", "w": "", "x": "",
-            "y": "", "z": "",
-
-            # AZ
-            "A": "", "B": "", "C": "", "D": "", "E": "", "F": "",
-            "G": "", "H": "", "I": "", "J": "", "K": "", "L": "",
-            "M": "", "N": "", "O": "", "P": "", "Q": "", "R": "",
-            "S": "", "T": "", "U": "", "V": "", "W": "", "X": "",
-            "Y": "", "Z": "",
-
-        }
         
         # Function to translate characters within the subscript (function for typechecking)
         def subscript_translator(content):
             def get_char_translation(char: str) -> str:
-                return indexDict.get(char, char)
+                return SUBSCRIPT_LETTERS.get(char, char)
 
             translated_chars = []
             for char in content:
                 try:
                     digit_value = unicodedata.digit(char)
-                    translated_chars.append(subscript_digits[digit_value])
+                    translated_chars.append(SUBSCRIPT_DIGITS[digit_value])
                     continue
                 except (TypeError, ValueError):
                     translated_chars.append(get_char_translation(char))
             return ''.join(translated_chars)
 
         # Handle direct numeric subscripts (_3)
-        digit_matches = list(re.finditer(digit_pattern, expression))
+        digit_matches = list(self.re.finditer(digit_pattern, expression))
         for digit_match in digit_matches:
             digits = digit_match.group(1)
             translated_digits = subscript_translator(digits)
             expression = expression.replace(f'_{digits}', translated_digits, 1)
 
         # Handle unit-formatted subscripts (_⁃a』)
-        unit_matches = list(re.finditer(unit_pattern, expression))
+        unit_matches = list(self.re.finditer(unit_pattern, expression))
         for unit_match in unit_matches:
             letter = unit_match.group(1)
             translated_letter = subscript_translator(letter)
             expression = expression.replace(f'_⁃{letter}』', translated_letter, 1)
 
         # First, handle the _\text{LETTER} pattern with tags
-        text_matches = list(re.finditer(text_pattern, expression))
+        text_matches = list(self.re.finditer(text_pattern, expression))
         for text_match in text_matches:
             tag = text_match.group(1)
             letter = text_match.group(2)
@@ -1667,7 +2234,7 @@ class LatexToCalcEngine:
             expression = expression.replace(f'_\\text£{tag}£{{{letter}}}£{tag}£', translated_letter, 1)
 
         # Find all matches for the regular pattern
-        matches = list(re.finditer(pattern, expression))
+        matches = list(self.re.finditer(pattern, expression))
         
         for match in matches:
             # Extract the content inside the curly braces
@@ -1691,254 +2258,268 @@ class LatexToCalcEngine:
         return expression
     
     def removeIdentifiers(self, expression):
-        patterns = [r'\£([0-9]+)\£', r'\$([0-9]+)\$', r'\`([0-9]+)\`', r'\§([0-9]+)\§']
-        for pattern in patterns:
-            expression = re.sub(pattern, r'', expression)
+        patterns = [("£", r'\£([0-9]+)\£'), ("$", r'\$([0-9]+)\$'), ("`", r'\`([0-9]+)\`'), ("§", r'\§([0-9]+)\§')]
+        for tagChar, pattern in patterns:
+            if tagChar in expression:
+                expression = self.re.sub(pattern, r'', expression)
         expression = expression.replace("¤", "int_").replace("』", "").replace("⁃", "_")
         return expression
 
+    def translateTree(self, expression):
+        """Structures via the tree backend, raises Unsupported if it cannot translate them."""
+        return self.tree.translate(expression)
 
+    def prepare(self, expression):
+        """Plain text replacements both backends start from."""
+        expression = self.re.sub(r'\\operatorname\{([a-z]+)\}', r'\\\1', expression)
+        expression = self.translateSymbols(expression)
+        if self.TI_on: expression = expression.replace("\\Omega", "Ω").replace(",", ".").replace("_D", "")
 
-def translate(expression, TI_on=True, SC_on=False, constants_on=False, coulomb_on=False, e_on=False, i_on=False, g_on=False, units_on=True):
-    engine = LatexToCalcEngine(TI_on, SC_on, units_on)
-    
-    expression = re.sub(r'\\operatorname\{([a-z]+)\}', r'\\\1', expression)
-    expression = engine.translateSymbols(expression)
-    if TI_on: expression = expression.replace("\\Omega", "Ω").replace(",", ".").replace("_D", "")
-
-    expression = engine.translateGreekLetters(expression)
-    if constants_on:
-        expression = engine.translateConstants(expression)
-    expression = engine.applyTags(expression)
-
-    expression = engine.translateUnits1(expression)
-    expression = engine.translateSum(expression)
-    expression = engine.translateProd(expression)
-    expression = engine.translateIntegrals(expression) 
-    expression = engine.translateCommonFunctions(expression)
-    expression = engine.translateLimits(expression)
-
-    expression = engine.translateCombinations(expression) 
-    expression = engine.translatePermutations(expression)
-    
-    expression = engine.translateDerivatives(expression)
-    expression = engine.translateFractions(expression)
-    # expression = engine.translateLn(expression)
-    
-    expression = engine.translateLog(expression)
-    expression = engine.translateSubscripts(expression)
-    expression = engine.translateLg(expression)
-    expression = engine.translateSqrt(expression)
-    expression = engine.translateSystem(expression)
-    expression = engine.translateArrows(expression)
-    expression = engine.translateVectors(expression)
-    expression = engine.translateMatrices(expression) 
-    # TI _unit viimeistely
-    expression = engine.translateUnits2(expression) # \mathrm{32\ \frac{kJ}{kg\cdot K}+kJ\cdot \text{kg}-\frac{\text{kJ}}{\text{kg}\cdot \text{K}}} 
-    expression = expression.replace("`´`´", "_g").replace("´´´´", "h").replace("````", "g")
-    
-    if g_on:
-        expression = expression.replace("g", "_g")
-        fixG = {
-            '\\_': '\\',
-            '__gm': '_gm',
-            'lo_g': 'log',
-            'be_gin': 'begin',
-            'i_ght': 'ight'
-            }
-        for old, new in fixG.items():
-            expression = expression.replace(old, new)
-
-    expression = expression.replace("left", "").replace("right", "")
-    
-    if constants_on: expression = expression.replace("h", "_h").replace("%`´%", "_h")
-    # väliaikanen korjaus
-    expression = expression.replace("__hr", "_hr")
-    if coulomb_on: expression = expression.replace("k", "_Cc")
-    elif constants_on: expression = expression.replace("k", "_k").replace("Ｇ", "_g")
-    
-
+        expression = self.translateGreekLetters(expression)
+        if self.constants_on:
+            expression = self.translateConstants(expression)
+        return expression
 
-    # remove identifiers
-    expression = engine.removeIdentifiers(expression)
-    # ≤ & ≥
-    expression = expression.replace("\\le", " <=").replace("\\ge", " >=").replace("\\int", "int").replace("\\in", "∈")
+    def translate(self, expression, engine="regex", timings=None, deadline=None):
+        """
+        Run the full translation pipeline on one LaTeX expression.
+        With engine="tree" the structures are translated by the tree backend
+        when it supports every construct in the expression, otherwise by the
+        regex stages below. finish() is shared, so the output is the same.
+
+        Pass a dict as timings to profile the call: it receives the seconds
+        spent in each stage that ran, and STAGE_TIMINGS aggregates them.
+
+        deadline is a time.monotonic() value. Past it the next checkLimits()
+        raises TranslationTimeout, and an expression growing past
+        MAX_OUTPUT_GROWTH times the input length raises OutputTooLong. Long
+        expressions with a deadline run on guardedTwin(), where a single
+        backtracking match cannot outlast the deadline either.
+        """
+        limits = CallLimits(deadline, max(MIN_OUTPUT_LIMIT, MAX_OUTPUT_GROWTH * len(expression)))
+        pipeline = self.guardedTwin() if deadline is not None and len(expression) > GUARDED_LENGTH else self
+        previous = _CALL_LIMITS.current
+        _CALL_LIMITS.current = limits
+        try:
+            return pipeline.runPipeline(expression, engine, timings)
+        finally:
+            _CALL_LIMITS.current = previous
+
+    def guardedTwin(self):
+        """This engine with its stages matching through GuardedMatching, see GUARDED_LENGTH."""
+        if self._guardedTwin is None:
+            twin = copy.copy(self)
+            twin.re = GuardedMatching
+            twin.common_function_patterns, twin.fix_patterns = _guardedPatterns()
+            twin._guardedTwin = twin
+            self._guardedTwin = twin
+        return self._guardedTwin
+
+    def runPipeline(self, expression, engine, timings):
+        expression = self.runStage("prepare", expression, timings)
+        if engine == "tree":
+            try:
+                expression = self.runStage("translateTree", expression, timings)
+            except Unsupported:
+                pass
+            else:
+                return self.recordTimings(self.finish(expression, timings), timings)
+        elif engine != "regex":
+            raise ValueError(f"Unknown translation engine: {engine}")
+
+        features = scanFeatures(expression)
+        expression = self.runStage("applyTags", expression, timings)
+        skipped = []
+        for stage, feature in PIPELINE:
+            if not features & feature:
+                skipped.append(stage)
+                continue
+            expression = self.runStage(stage, expression, timings)
+            if stage == "translateUnits1":
+                # \text{} and \mathrm{} are unwrapped, their contents can form new constructs
+                features = scanFeatures(expression)
+        STAGE_STATS.record(skipped)
+        return self.recordTimings(self.finish(expression, timings), timings)
+
+    def runStage(self, stage, expression, timings):
+        """Calls one stage method, timing it when the translation is profiled, then checks the limits."""
+        limits = _CALL_LIMITS.current
+        if limits is not None:
+            limits.stage = stage
+        if timings is None:
+            expression = getattr(self, stage)(expression)
+        else:
+            start = perf_counter()
+            expression = getattr(self, stage)(expression)
+            timings[stage] = timings.get(stage, 0.0) + perf_counter() - start
+        if limits is not None:
+            limits.check(expression)
+        return expression
 
-    # handle e & i button
-    if e_on:
-        e_dict = {
-            'e': '@e',
-            'syst@em': 'system',
-            'c@eil': 'ceil',
-            'arcs@ec': 'arcsec'
-        }
-        for key, value in e_dict.items():
-            expression = expression.replace(key, value)
+    @staticmethod
+    def recordTimings(expression, timings):
+        if timings is not None:
+            STAGE_TIMINGS.record(timings)
+        return expression
 
-    if i_on:
-        i_dict = {
-            'i': '@i',
-            's@in': 'sin',
-            'l@im': 'lim',
-            'ce@il': 'ceil',
-            '@int': 'int'
-        }
-        for key, value in i_dict.items():
-            expression = expression.replace(key, value)
-        if e_on:
-            expression = expression.replace("c@e@il", "ceil")
-    
-    expression = expression.replace("\\", "").replace("{", "(").replace("}", ")")
+    def finish(self, expression, timings=None):
+        """Unit expansion and clean-up after the structures have been translated."""
+        # TI _unit viimeistely
+        expression = self.runStage("translateUnits2", expression, timings) # \mathrm{32\ \frac{kJ}{kg\cdot K}+kJ\cdot \text{kg}-\frac{\text{kJ}}{\text{kg}\cdot \text{K}}} 
+        expression = self.runStage("cleanUp", expression, timings)
+        expression = self.runStage("insertMultiplication", expression, timings)
+        return self.runStage("applyFixes", expression, timings)
+
+    def cleanUp(self, expression):
+        """Drops the tags and LaTeX syntax and applies the setting flags' replacements."""
+        expression = expression.replace("`´`´", "_g").replace("´´´´", "h").replace("````", "g")
     
-    #unicode character U+F008 : <private-use> () used for derivative in Nspire
-    expression = re.sub(r"\(\(d\)\/\(d.\)\)", "", expression)  #
+        if self.g_on:
+            expression = expression.replace("g", "_g")
+            for old, new in G_FIXES.items():
+                expression = expression.replace(old, new)
 
+        expression = expression.replace("left", "").replace("right", "")
+    
+        if self.constants_on: expression = expression.replace("h", "_h").replace("%`´%", "_h")
+        # väliaikanen korjaus
+        expression = expression.replace("__hr", "_hr")
+        if self.coulomb_on: expression = expression.replace("k", "_Cc")
+        elif self.constants_on: expression = expression.replace("k", "_k").replace("Ｇ", "_g")
     
-    # Turn expressions like xy=kc into x*y=k*c
-    # Define characters to permutate
-    characters = ['x', 'y', 'z', 'a', 'b', 'c', 'k']
-
-    # Create regex pattern for permutations of characters
-    pattern_xyzabc = re.compile(fr'({"|".join(characters)})+')
 
-    #Remove empty strings before joining with '*'
-    def multiplyVariables(match):
-        return '*'.join(filter(None, match.group(0)))
 
-    # Apply the replacement function to the expression
-    expression = pattern_xyzabc.sub(multiplyVariables, expression)
+        # remove identifiers
+        expression = self.removeIdentifiers(expression)
+        # ≤ & ≥
+        expression = expression.replace("\\le", " <=").replace("\\ge", " >=").replace("\\int", "int").replace("\\in", "∈")
 
+        # handle e & i button
+        if self.e_on:
+            for key, value in E_FIXES.items():
+                expression = expression.replace(key, value)
 
+        if self.i_on:
+            for key, value in I_FIXES.items():
+                expression = expression.replace(key, value)
+            if self.e_on:
+                expression = expression.replace("c@e@il", "ceil")
+    
+        expression = expression.replace("\\", "").replace("{", "(").replace("}", ")")
+    
+        #unicode character U+F008 : <private-use> () used for derivative in Nspire
+        if "((d)/(d" in expression:
+            expression = self.re.sub(r"\(\(d\)\/\(d.\)\)", "", expression)  #
+        return expression
 
+    def insertMultiplication(self, expression):
+        """Adds the implicit multiplication signs."""
+        # Turn expressions like xy=kc into x*y=k*c
+        expression = pattern_xyzabc.sub(_multiplyVariables, expression)
 
-    def replaceMultiplier(match):
-        return match.group(1) + "*("
 
-    def replaceMultiplicand(match):
-        return ")*" + match.group(1)
-    
 
 
-    ## Add multiplication sign between non-number and number characters
-    def addMultiplicationSign(match):
-      return match.group(1) + "*" + match.group(2)
   
-    # non-number characters followed by a number 
-    expression = re.sub(r'([@\;\:\.\,α-ωΑ-Ωa-zA-Z°₀₁₂₃₄₅₆₇₈₉]+)([0-9]+)', addMultiplicationSign, expression)
-    # number followed by a sequence of non-number characters 
+        # non-number characters followed by a number 
+        expression = self.re.sub(r'([@\;\:\.\,α-ωΑ-Ωa-zA-Z°₀₁₂₃₄₅₆₇₈₉]+)([0-9]+)', _addMultiplicationSign, expression)
+        # number followed by a sequence of non-number characters 
     
     
-    expression = re.sub(r'([0-9]+)([@\;\:\.\,α-ωΑ-Ωa-zA-Z°₀₁₂₃₄₅₆₇₈₉]+)', addMultiplicationSign, expression)
-    # sulkujen kertominen
-    expression = re.sub(r'([\@\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°₀₁₂₃₄₅₆₇₈₉]+)\(', replaceMultiplier, expression)
-    expression = re.sub(r'\)([\@\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°₀₁₂₃₄₅₆₇₈₉]+)', replaceMultiplicand, expression)
-    # fixlist 
-    for fix in engine.fixlist:
-        expression = expression.replace(fix + "*", fix)
-
-        pattern = r'([\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°₀₁₂₃₄₅₆₇₈₉]+)' + fix
-        matches = re.findall(pattern, expression)
-        for match in matches:
-            expression = expression.replace(match + fix, match + "*" + fix)
+        expression = self.re.sub(r'([0-9]+)([@\;\:\.\,α-ωΑ-Ωa-zA-Z°₀₁₂₃₄₅₆₇₈₉]+)', _addMultiplicationSign, expression)
+        # sulkujen kertominen
+        expression = self.re.sub(r'([\@\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°₀₁₂₃₄₅₆₇₈₉]+)\(', _replaceMultiplier, expression)
+        expression = self.re.sub(r'\)([\@\;\:\.\,α-ωΑ-Ωa-zA-Z0-9°₀₁₂₃₄₅₆₇₈₉]+)', _replaceMultiplicand, expression)
+        # fixlist 
+        for fix, pattern in self.fix_patterns:
+            if fix not in expression:
+                continue
+            expression = expression.replace(fix + "*", fix)
+
+            matches = pattern.findall(expression)
+            for match in matches:
+                expression = expression.replace(match + fix, match + "*" + fix)
+        return expression
 
-    #Replace metric prefixes with built-in units
-    built_in_units = {
-        "10^3*_gm": "_kg",
-        "10^(-6)*_gm": "_mg",
-    }
-    for old, new in built_in_units.items():
-        expression = expression.replace(old, new)
+    def applyFixes(self, expression):
+        """Built-in units, asterisk fixes, subscripts and constants."""
+        #Replace metric prefixes with built-in units
+        for old, new in BUILT_IN_UNITS.items():
+            expression = expression.replace(old, new)
         
         
-    fixAsterisk = {
-    "lcm*": "lcm",
-    "gcd*": "gcd",
-    "pym*": "pym",
-    "*,": ",",
-    "*.": ".",
-    "*;": ";",
-    "*:": ":",
-    "__": "_",
-    ",*": ",",
-    ".*": ".",
-    "*@r": "@r",
-    "(*": "(",
-    "*)": ")",
-    "*°": "°",
-    "a*bs": "abs",
-    "abs*": "abs",
-    "abs*(": "abs(",
-    }
 
-    for old_str, new_str in fixAsterisk.items():
-        expression = expression.replace(old_str, new_str)
+        for old_str, new_str in FIX_ASTERISK.items():
+            expression = expression.replace(old_str, new_str)
 
-    if g_on:
-        for i in range(expression.count("_g")):
-            match = re.search(r'_g([a-ln-zA-Zα-ωΑ-Ω@])', expression)
-            if match:
-                char = match.group(1)
-                expression = expression.replace("_g"+char, "_g*" + char, 1)
-
-    if SC_on: expression = expression.replace("π", "(pi)")
-    greeksubscripts = {
-        "α": "", "β": "", "γ": "", "δ": "", "ε": "", "ζ": "ζ",
-        "η": "η", "θ": "θ", "ι": "ι", "κ": "κ", "λ": "λ", "μ": "μ",
-        "ν": "ν", "ξ": "ξ", "ο": "ο", "π": "π", "ρ": "ρ", "σ": "σ",
-        "τ": "τ", "υ": "υ", "φ": "φ", "χ": "χ", "ψ": "ψ", "ω": "ω" }
+        if self.g_on:
+            for i in range(expression.count("_g")):
+                checkLimits(expression)
+                match = self.re.search(r'_g([a-ln-zA-Zα-ωΑ-Ω@])', expression)
+                if match:
+                    char = match.group(1)
+                    expression = expression.replace("_g"+char, "_g*" + char, 1)
+
+        if self.SC_on: expression = expression.replace("π", "(pi)")
                            
 
-    for char in ['α', 'β', 'γ', 'δ', 'ε', 'ζ', 'η', 'θ', 'ι', 'κ', 'λ', 'μ', 'ν', 'ξ', 'ο', 'π', 'ρ', 'σ', 'τ', 'υ', 'φ', 'χ', 'ψ', 'ω']:
-        expression = expression.replace(f"_{char}", greeksubscripts[char])
+        for char, subscript in GREEK_SUBSCRIPTS.items():
+            expression = expression.replace(f"_{char}", subscript)
         
-    # Pattern to match: any term ending with subscript followed by a term starting with letter/number
-    subscript_chars = "₀₁₂₃₄₅₆₇₈₉"
-    subscript_pattern = r'([a-zA-Z0-9]+[' + subscript_chars + r'])([a-zA-Z0-9]+)'
-    expression = re.sub(subscript_pattern, r'\1*\2', expression)
-    # replace c with _c if constants on, only if no chain of letters before it which would have and underscore before them (e.g. mc -> m*_c, but not in _Rc)
-
-
-    # replace mol wiith _mol if units on
-    if units_on:
-        expression = expression.replace("mol", "_mol")
-    #regex rule to add asteriks between underscore and letter on the left side of it, e.g. m_g*h -> m*_g*h
-    letter_underscore_pattern = r'([a-zA-Z])(_[a-zA-Z])'
-    expression = re.sub(letter_underscore_pattern, r'\1*\2', expression)
+        # Pattern to match: any term ending with subscript followed by a term starting with letter/number
+        expression = subscript_pattern.sub(r'\1*\2', expression)
+        # replace c with _c if constants on, only if no chain of letters before it which would have and underscore before them (e.g. mc -> m*_c, but not in _Rc)
+
+
+        # replace mol wiith _mol if units on
+        if self.units_on:
+            expression = expression.replace("mol", "_mol")
+        if "_" in expression:
+            expression = letter_underscore_pattern.sub(r'\1*\2', expression)
     
     
-    addAsterisk = {
-        ")_": ")*_",
-        "ma": "m*a",
-        "mv": "m*v",
-     #   "at": "a*t",
-      #  "vt": "v*t",
-        "mgh": "m*g*h",
-      #  "mg": "m*g",
-        "ρgh": "ρ*g*h",
-        "mc": "m*c",  # E=mc^2
-        "cmΔT": "c*m*ΔT",
-        "CΔT": "C*ΔT",
-        "αl₀ΔT": "α*l₀*ΔT",
-        "βl₀ΔT": "β*l₀*ΔT",
-        "γl₀ΔT": "γ*l₀*ΔT",
-        "vB": "v*B"  # Magnetic force formula
-    }
-    for org, new in addAsterisk.items():
-        expression = expression.replace(org, new)
+        for org, new in ADD_ASTERISK.items():
+            expression = expression.replace(org, new)
         
-    # replace c with _c if constants on
-    # Must be done after addAsterisk to handle cases like mc -> m*c -> m*_c
-    # Don't replace if c is part of an existing constant identifier pattern:
-    # - _Xc (single letter + c, like _Rc)
-    # - _XXc (two letters + c, like _Ccc)
-    if constants_on:
-        # Use alternation with fixed-width lookbehinds
-        # This regex will NOT match c when preceded by:
-        # - underscore followed by single letter (like _Rc)
-        # - underscore followed by two letters (like _Ccc)
-        expression = re.sub(r'(?<!_[a-zA-Z])(?<!_[a-zA-Z][a-zA-Z])c', '_c', expression)
+        # replace c with _c if constants on
+        # Must be done after addAsterisk to handle cases like mc -> m*c -> m*_c
+        # Don't replace if c is part of an existing constant identifier pattern:
+        # - _Xc (single letter + c, like _Rc)
+        # - _XXc (two letters + c, like _Ccc)
+        if self.constants_on:
+            # Use alternation with fixed-width lookbehinds
+            # This regex will NOT match c when preceded by:
+            # - underscore followed by single letter (like _Rc)
+            # - underscore followed by two letters (like _Ccc)
+            expression = self.re.sub(r'(?<!_[a-zA-Z])(?<!_[a-zA-Z][a-zA-Z])c', '_c', expression)
     
-    return expression
+        return expression
+
+
+@lru_cache(maxsize=None)
+def _cachedEngine(TI_on, SC_on, units_on, constants_on, coulomb_on, e_on, i_on, g_on):
+    return LatexToCalcEngine(TI_on, SC_on, units_on, constants_on, coulomb_on, e_on, i_on, g_on)
+
+
+def get_engine(TI_on=True, SC_on=False, constants_on=False, coulomb_on=False, e_on=False, i_on=False, g_on=False, units_on=True):
+    """Return the shared, prebuilt engine for a settings profile."""
+    # the flags are only tested for truthiness, so at most 256 profiles exist
+    return _cachedEngine(bool(TI_on), bool(SC_on), bool(units_on), bool(constants_on),
+                         bool(coulomb_on), bool(e_on), bool(i_on), bool(g_on))
+
+
+# Translation backends, see LatexToCalcEngine.translate()
+ENGINES = ("regex", "tree")
+
+def translate(expression, TI_on=True, SC_on=False, constants_on=False, coulomb_on=False, e_on=False, i_on=False, g_on=False, units_on=True, engine="regex", timings=None, deadline=None):
+    """
+    Translate one LaTeX expression with the given settings.
+    engine="tree" tries the tree backend first and falls back to the regex
+    pipeline for anything it does not support yet. A timings dict receives
+    the seconds spent per stage, and past a time.monotonic() deadline the
+    translation raises TranslationTimeout, see LatexToCalcEngine.translate().
+    """
+    return get_engine(TI_on, SC_on, constants_on, coulomb_on, e_on, i_on, g_on, units_on).translate(expression, engine, timings, deadline)
 
 
 
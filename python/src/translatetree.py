@@ -0,0 +1,176 @@
+import re
+
+# Characters the regex pipeline uses as tags or placeholders. Input containing
+# them is left to that pipeline, since its stages react to them.
+RESERVED_CHARACTERS = frozenset("£$`§Ɛ「」¤』´#")
+
+# Substrings that switch on a regex stage the tree does not model yet:
+# subscripts and permutations, derivatives, the floor/ceil/sign/round/int
+# rewrite of translateCommonFunctions(), vectors and matrices
+FALLBACK_SUBSTRINGS = ("_", "D", "floor", "ceil", "sign", "round", "int",
+                       "matrix", "bar", "overline", "𝕚", "𝕛", "ӄ")
+DERIVATIVE_PATTERN = re.compile(r"\{d\S\}")
+
+# command name | any other escape | bracket | run of plain text
+TOKEN_PATTERN = re.compile(r'\\([a-zA-Z]+)|(\\.?)|([{}()\[\]])|([^\\{}()\[\]]+)', re.DOTALL)
+COMMAND, ESCAPE, BRACKET, TEXT = 1, 2, 3, 4
+
+
+class Unsupported(Exception):
+    """The expression uses a construct the tree backend cannot translate yet."""
+
+
+class TreeParser:
+    """
+    Parses one tokenized expression into nested lists of nodes.
+
+    Plain text is kept as str, everything else is a tuple:
+    ("group", opening, nodes, closing), ("left", nodes), ("frac", numerator, denominator),
+    ("sqrt", index or None, radicand) and ("function", name, argument).
+    """
+
+    def __init__(self, expression, functions):
+        self.tokens = [(match.lastindex, match.group(match.lastindex)) for match in TOKEN_PATTERN.finditer(expression)]
+        self.position = 0
+        self.functions = functions
+
+    def parse(self):
+        return self.parseSequence(None)
+
+    def next(self):
+        if self.position == len(self.tokens):
+            raise Unsupported("unexpected end")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, kind, value):
+        if self.next() != (kind, value):
+            raise Unsupported("expected " + value)
+
+    def parseSequence(self, closing):
+        """Nodes up to the closing token, None for the end of the expression."""
+        nodes = []
+        while self.position < len(self.tokens):
+            token = self.next()
+            kind, value = token
+            if token == closing:
+                if closing == (COMMAND, "right"):
+                    self.expect(BRACKET, ")")
+                return nodes
+            if kind == TEXT:
+                nodes.append(value)
+            elif kind == BRACKET:
+                if value == "{":
+                    nodes.append(("group", "{", self.parseSequence((BRACKET, "}")), "}"))
+                elif value == "(":
+                    nodes.append(("group", "(", self.parseSequence((BRACKET, ")")), ")"))
+                else:
+                    # [] only as a root index, closing brackets only when expected
+                    raise Unsupported(value)
+            elif kind == COMMAND:
+                nodes.append(self.parseCommand(value))
+            else:
+                raise Unsupported(value)
+        if closing is not None:
+            raise Unsupported("unclosed group")
+        return nodes
+
+    def parseArgument(self, opening, closing):
+        self.expect(BRACKET, opening)
+        nodes = self.parseSequence((BRACKET, closing))
+        if not nodes:
+            # the regex stages only match non-empty arguments
+            raise Unsupported("empty argument")
+        return nodes
+
+    def parseLeft(self):
+        self.expect(BRACKET, "(")
+        return self.parseSequence((COMMAND, "right"))
+
+    def parseCommand(self, name):
+        if name == "frac":
+            return ("frac", self.parseArgument("{", "}"), self.parseArgument("{", "}"))
+        if name == "sqrt":
+            index = None
+            if self.position < len(self.tokens) and self.tokens[self.position] == (BRACKET, "["):
+                index = self.parseArgument("[", "]")
+            return ("sqrt", index, self.parseArgument("{", "}"))
+        if name == "left":
+            return ("left", self.parseLeft())
+        if name in self.functions:
+            self.expect(COMMAND, "left")
+            argument = self.parseLeft()
+            if not argument:
+                raise Unsupported("empty argument")
+            return ("function", name, argument)
+        raise Unsupported("\\" + name)
+
+
+class TreeTranslator:
+    """
+    Tree backend for LatexToCalcEngine.
+
+    Tokenizes a prepared expression once, parses it into a tree of groups,
+    fractions, roots and function calls, and emits in one traversal the text
+    the regex stages of LatexToCalcEngine.translate() would hand to finish().
+
+    Only constructs whose output is known to match the regex pipeline are
+    parsed. Anything else raises Unsupported, so the caller can fall back to
+    the regex pipeline and the result never depends on the backend.
+    """
+
+    def __init__(self, engine):
+        self.TI_on = engine.TI_on
+        functions = set(engine.common_functions)
+        # \sinh would also be rewritten by the "sin" patterns, so only names
+        # that no other function is a prefix of are parsed
+        self.functions = frozenset(name for name in functions
+                                   if not any(name != other and name.startswith(other) for other in functions))
+
+    def translate(self, expression):
+        """Translate a prepared expression, or raise Unsupported."""
+        self.checkText(expression)
+        try:
+            result = self.emit(TreeParser(expression, self.functions).parse())
+        except RecursionError:
+            raise Unsupported("nesting too deep")
+        # Later regex stages see the text after the commands are gone, where
+        # e.g. "ab\arcsin" has become "abarcsin" and would start translateVectors()
+        self.checkText(result)
+        return result
+
+    @staticmethod
+    def checkText(expression):
+        if RESERVED_CHARACTERS.intersection(expression):
+            raise Unsupported("reserved character")
+        for substring in FALLBACK_SUBSTRINGS:
+            if substring in expression:
+                raise Unsupported(substring)
+        if DERIVATIVE_PATTERN.search(expression):
+            raise Unsupported("derivative")
+
+    def emit(self, nodes):
+        parts = []
+        for node in nodes:
+            if type(node) is str:
+                parts.append(node)
+                continue
+            kind = node[0]
+            if kind == "group":
+                parts.append(node[1] + self.emit(node[2]) + node[3])
+            elif kind == "left":
+                # finish() drops "left" and "right" just like after the regex stages
+                parts.append("\\left(" + self.emit(node[1]) + "\\right)")
+            elif kind == "frac":
+                parts.append("((" + self.emit(node[1]) + ")/(" + self.emit(node[2]) + "))")
+            elif kind == "sqrt":
+                x = self.emit(node[2])
+                if node[1] is None:
+                    parts.append("sqrt(" + x + ")")
+                else:
+                    n = self.emit(node[1])
+                    parts.append("root(" + x + "," + n + ")" if self.TI_on else "(" + x + ")^(1/(" + n + "))")
+            else:
+                parts.append(node[1] + "(" + self.emit(node[2]) + ")")
+        return "".join(parts)
@@ -0,0 +1,100 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# Setting flags accepted by translatelatex.translate() and their defaults.
+# The order is fixed so cache keys stay stable between processes.
+SETTING_DEFAULTS = (
+    ('TI_on', True),
+    ('SC_on', False),
+    ('constants_on', False),
+    ('coulomb_on', False),
+    ('e_on', False),
+    ('i_on', False),
+    ('g_on', False),
+    ('units_on', True),
+)
+
+
+class TranslationCache:
+    """
+    Process-wide LRU cache for translation results.
+
+    Entries are keyed on the expression plus the eight setting flags and are
+    bounded both by count and by the approximate memory of the cached strings.
+    A bound of 0 disables the cache.
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def make_key(expression, settings):
+        # translate() only tests the flags for truthiness, so normalise to bools
+        return (expression,) + tuple(bool(settings.get(name, default)) for name, default in SETTING_DEFAULTS)
+
+    @staticmethod
+    def _entry_size(key, result):
+        return sys.getsizeof(key[0]) + sys.getsizeof(result)
+
+    def get(self, expression, settings):
+        """Return the cached result, or None on a miss."""
+        if not self.enabled:
+            return None
+        key = self.make_key(expression, settings)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, expression, settings, result):
+        if not self.enabled:
+            return
+        key = self.make_key(expression, settings)
+        size = self._entry_size(key, result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
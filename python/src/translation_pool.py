@@ -0,0 +1,145 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from time import monotonic
+
+try:
+    from .translatelatex import translate, STAGE_TIMINGS
+except ImportError:
+    from translatelatex import translate, STAGE_TIMINGS
+
+# Workers fork from a single-threaded server process that has already imported
+# and compiled translatelatex, so a replacement worker is ready in milliseconds.
+# Forking the threaded web process itself could copy a held lock into the child.
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    START_METHOD = 'forkserver'
+else:
+    START_METHOD = 'spawn'
+
+# translate() stops at a deadline passed to it by itself, so a worker gets this
+# long past the timeout to report that before it is killed
+KILL_GRACE = 0.5
+
+
+def worker_main(connection):
+    """Worker process: translates (expression, kwargs) jobs until its pipe is closed."""
+    translate("x")
+    while True:
+        try:
+            expression, kwargs = connection.recv()
+        except EOFError:
+            return
+        timings = {} if kwargs.pop('timings') else None
+        try:
+            result = translate(expression, timings=timings, **kwargs)
+        except Exception as e:
+            outcome = (False, e, None)
+        else:
+            outcome = (True, result, timings)
+        try:
+            connection.send(outcome)
+        except Exception:
+            # the exception could not be pickled
+            connection.send((False, RuntimeError(f"{type(outcome[1]).__name__}: {outcome[1]}"), None))
+
+
+class TranslationPool:
+    """
+    Pre-started worker processes running translatelatex.translate().
+
+    Each worker handles one job at a time, so the pool translates on as many
+    cores as it has workers. A translation that outlives its timeout has its
+    worker killed and replaced; a thread executor can only give up waiting for it.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._context = multiprocessing.get_context(START_METHOD)
+        if START_METHOD == 'forkserver':
+            self._context.set_forkserver_preload([__name__])
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._closed = False
+        self.busy = 0
+        self.recycled = 0
+        for _ in range(workers):
+            self._idle.put(self._start())
+
+    def _start(self):
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(target=worker_main, args=(child_connection,),
+                                        name='translation-worker', daemon=True)
+        process.start()
+        child_connection.close()
+        with self._lock:
+            self._processes.add(process)
+        return process, connection
+
+    def _recycle(self, worker):
+        process, connection = worker
+        process.kill()
+        process.join()
+        connection.close()
+        with self._lock:
+            self._processes.discard(process)
+            self.recycled += 1
+            closed = self._closed
+        if not closed:
+            self._idle.put(self._start())
+
+    def translate(self, expression, timeout, timings=None, **kwargs):
+        """
+        Translate in a worker process, or raise concurrent.futures.TimeoutError
+        after timeout seconds, counting the wait for an idle worker, plus
+        KILL_GRACE when it is already translating. Takes
+        translatelatex.translate()'s keywords.
+        """
+        deadline = monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=max(0, timeout))
+        except queue.Empty:
+            raise FuturesTimeoutError("Translation timeout")
+        with self._lock:
+            self.busy += 1
+        try:
+            process, connection = worker
+            try:
+                connection.send((expression, dict(kwargs, timings=timings is not None)))
+                finished = connection.poll(max(0, deadline - monotonic()) + KILL_GRACE)
+                if finished:
+                    ok, value, job_timings = connection.recv()
+            except (EOFError, OSError) as e:
+                self._recycle(worker)
+                raise RuntimeError("translation worker exited") from e
+            if not finished:
+                self._recycle(worker)
+                raise FuturesTimeoutError("Translation timeout")
+            self._idle.put(worker)
+        finally:
+            with self._lock:
+                self.busy -= 1
+
+        if not ok:
+            raise value
+        if timings is not None:
+            timings.update(job_timings)
+            STAGE_TIMINGS.record(job_timings)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'busy': self.busy,
+                'idle': self._idle.qsize(),
+                'recycled': self.recycled,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            processes = list(self._processes)
+        for process in processes:
+            process.kill()
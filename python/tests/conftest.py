@@ -0,0 +1,84 @@
+"""
+Shared fixtures for the server tests
+====================================
+server.py imports DocsExporter from the docs-exporter/ folder, which is not
+part of this repository. When it is not checked out, a stand-in with the same
+interface is imported instead, so the server, ASGI and blueprint tests still
+run. It fetches the selected pages with its own aiohttp session, at most
+max_concurrent_requests at a time, as the real exporter does.
+"""
+
+import asyncio
+import os
+import sys
+import types
+from pathlib import Path
+
+import aiohttp
+import pytest
+
+SRC = Path(__file__).parent.parent / 'src'
+DOCS_EXPORTER = Path(__file__).parent.parent.parent / 'docs-exporter'
+
+
+class StandInDocsExporter:
+    def __init__(self, base_url, max_concurrent_requests=5, delay_between_requests=0.5):
+        self.base_url = base_url
+        self.max_concurrent_requests = max_concurrent_requests
+        self.delay_between_requests = delay_between_requests
+        self.progress_callback = None
+
+    def set_progress_callback(self, callback):
+        self.progress_callback = callback
+
+    def get_navigation_structure(self):
+        return [], None
+
+    async def export_selected_pages_async(self, urls, compress_links=False):
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        pages, errors = {}, []
+
+        async def fetch(session, url):
+            async with semaphore:
+                try:
+                    async with session.get(url) as response:
+                        response.raise_for_status()
+                        pages[url] = await response.text()
+                except aiohttp.ClientError as e:
+                    errors.append(f"{url}: {e}")
+            if self.progress_callback:
+                self.progress_callback(len(pages) + len(errors), len(urls), f"Fetched {url}")
+
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(fetch(session, url) for url in urls))
+        return '\n\n'.join(pages[url] for url in urls if url in pages), errors, []
+
+
+def import_docs_exporter():
+    if str(DOCS_EXPORTER) not in sys.path:
+        sys.path.insert(0, str(DOCS_EXPORTER))
+    try:
+        import app  # noqa: F401
+    except ImportError:
+        sys.modules['app'] = types.ModuleType('app')
+        sys.modules['app'].DocsExporter = StandInDocsExporter
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    if str(SRC) not in sys.path:
+        sys.path.insert(0, str(SRC))
+    import_docs_exporter()
+    os.environ.setdefault('FLASK_SECRET_KEY', 'test')
+    os.environ.setdefault('PROGRESS_DB', str(tmp_path_factory.mktemp('progress') / 'progress.sqlite3'))
+    os.environ.setdefault('PROGRESS_SPOOL_DIR', str(tmp_path_factory.mktemp('exports')))
+    os.environ.setdefault('STATIC_BUILD_DIR', str(tmp_path_factory.mktemp('static')))
+    os.environ.setdefault('PAGE_CACHE_DB', str(tmp_path_factory.mktemp('pages') / 'pages.sqlite3'))
+    # The request log goes to logs/ in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('server'))
+    try:
+        import server
+    finally:
+        os.chdir(cwd)
+    return server
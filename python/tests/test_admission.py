@@ -0,0 +1,86 @@
+"""
+Test suite for admission control
+================================
+This module tests admission.nesting_depth and the body, length, depth and
+backlog limits of admission.AdmissionControl with their counters.
+"""
+
+from concurrent.futures import Future
+
+import pytest
+
+from src.admission import AdmissionControl, Rejected, nesting_depth
+
+
+def test_nesting_depth():
+    """All three bracket kinds count, whatever else is in the expression"""
+    assert nesting_depth("x+1") == 0
+    assert nesting_depth(r"\frac{1}{2}") == 1
+    assert nesting_depth(r"\sqrt{\left(x_{[1]}\right)}") == 4
+    assert nesting_depth("{}" * 50 + "{" * 7 + "}" * 7) == 7
+
+
+def test_expression_limits():
+    """Long or deeply nested expressions are rejected with a 400 and counted"""
+    admission = AdmissionControl(max_length=100, max_depth=5)
+    admission.check_expression(r"\frac{1}{2}")
+    with pytest.raises(Rejected) as rejected:
+        admission.check_expression("x" * 101)
+    assert rejected.value.status == 400
+    with pytest.raises(Rejected):
+        admission.check_expression("{" * 6 + "}" * 6)
+    assert admission.stats()['rejected'] == {'body_too_large': 0, 'too_long': 1, 'too_deep': 1}
+
+
+def test_body_limit():
+    """A body over the limit is a 413, an unknown length passes"""
+    admission = AdmissionControl(max_body_bytes=10)
+    admission.check_body(None)
+    admission.check_body(10)
+    with pytest.raises(Rejected) as rejected:
+        admission.check_body(11)
+    assert rejected.value.status == 413
+
+
+def test_zero_disables_limits():
+    admission = AdmissionControl(max_body_bytes=0, max_length=0, max_depth=0, max_backlog=0)
+    admission.check_body(10 ** 9)
+    admission.check_expression("{" * 1000 + "}" * 1000)
+    admission.check_backlog()
+
+
+def test_backlog_sheds_until_futures_finish():
+    """With max_backlog futures pending new work gets a 503 and Retry-After"""
+    admission = AdmissionControl(max_backlog=2, retry_after=3)
+    futures = [Future(), Future()]
+    for future in futures:
+        admission.check_backlog()
+        admission.track(future)
+
+    with pytest.raises(Rejected) as shed:
+        admission.check_backlog()
+    assert shed.value.status == 503
+    assert shed.value.headers == {'Retry-After': '3'}
+
+    futures[0].set_result("x")
+    futures[1].cancel()
+    admission.check_backlog()
+    assert admission.stats()['backlog'] == 0
+
+
+def test_backlog_share_of_a_batch():
+    """A batch is shed unless its share of the backlog is free, a share over the limit counts as the limit"""
+    admission = AdmissionControl(max_backlog=4)
+    futures = [Future() for _ in range(3)]
+    for future in futures:
+        admission.track(future)
+    admission.check_backlog(1)
+    with pytest.raises(Rejected):
+        admission.check_backlog(2)
+    futures[0].set_result(None)
+    admission.check_backlog(2)
+    futures[1].set_result(None)
+    futures[2].set_result(None)
+    admission.check_backlog(100)
+    assert admission.stats()['shed'] == 1
+    assert admission.stats()['shed'] == 1
@@ -0,0 +1,99 @@
+"""
+Test suite for the ASGI entry point
+===================================
+This module tests asgi.app by calling it as uvicorn does, with a scope and
+receive and send callables: /translate, its cacheable GET and the batch
+endpoint are answered like the Flask app answers them, and every other
+route reaches the Flask app through a2wsgi.
+"""
+
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def asgi(server):
+    import asgi
+    return asgi
+
+
+def call(app, method, path, body=b'', headers=(), query=None):
+    """(status, headers, body) of the request, headers a dict with lowercase names"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': urlencode(query or {}).encode(),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in dict(headers, **{'Content-Length': str(len(body))}).items()],
+        'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 5002),
+    }
+    messages = []
+
+    async def run():
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            messages.append(message)
+
+        await app(scope, receive, send)
+
+    asyncio.run(run())
+    start = messages[0]
+    response_headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def post_json(app, path, data):
+    status, headers, body = call(app, 'POST', path, json.dumps(data).encode(),
+                                 {'Content-Type': 'application/json'})
+    return status, headers, json.loads(body)
+
+
+def test_translate(asgi, server):
+    status, headers, body = post_json(asgi.app, '/translate', {'expression': r"\frac{1}{2}+\sqrt{x}"})
+    flask = server.app.test_client().post('/translate', json={'expression': r"\frac{1}{2}+\sqrt{x}"})
+    assert status == 200 and body == flask.get_json()
+    assert headers['content-type'] == 'application/json'
+    assert headers['access-control-allow-origin'] == '*'
+
+
+def test_translate_errors(asgi):
+    status, _, body = post_json(asgi.app, '/translate', {'expression': 42})
+    assert status == 400 and body == {'error': 'Invalid JSON data.'}
+    status, _, _ = call(asgi.app, 'POST', '/translate', b'[' * 100000 + b']' * 100000,
+                        {'Content-Type': 'application/json'})
+    assert status == 400
+
+
+def test_cacheable_get(asgi):
+    query = {'expr': r"\frac{2}{304}"}
+    status, headers, body = call(asgi.app, 'GET', '/translate', query=query)
+    assert status == 200 and json.loads(body) == {'result': '((2)/(304))'}
+    etag = headers['etag']
+    status, headers, body = call(asgi.app, 'GET', '/translate', query=query, headers={'If-None-Match': f"W/{etag}"})
+    assert status == 304 and headers['etag'] == etag and body == b''
+
+
+def test_batch(asgi):
+    status, _, body = post_json(asgi.app, '/translate/batch', {'expressions': [r"\frac{3}{4}", r"\frac{3}{4}", 42]})
+    assert status == 200
+    assert body['results'][0] == body['results'][1] == {'result': '((3)/(4))'}
+    assert 'error' in body['results'][2]
+
+
+def test_other_routes_reach_flask(asgi):
+    status, headers, body = call(asgi.app, 'GET', '/metrics')
+    assert status == 200 and headers['content-type'] == 'application/json'
+    assert 'admission' in json.loads(body)
+    status, _, _ = call(asgi.app, 'GET', '/no-such-page')
+    assert status == 404
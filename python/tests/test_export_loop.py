@@ -0,0 +1,171 @@
+"""
+Test suite for the docs exporter's event loop
+=============================================
+This module tests export_loop.ExportLoop: jobs share one loop thread, at
+most max_jobs run at once and the others are told their place in line, the
+fetch budget is shared fairly between jobs, and the shared session keeps its
+connections to a local stand-in server open from one job to the next.
+"""
+
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.export_loop import ExportLoop
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_GET(self):
+        body = f"<h1>{self.path}</h1>".encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pages():
+    PageHandler.connections = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def export_loop():
+    export_loop = ExportLoop(max_jobs=2, limit_per_host=2)
+    yield export_loop
+    export_loop.stop()
+
+
+def test_jobs_share_one_thread(export_loop):
+    """Every job runs on the loop thread, no more than max_jobs at a time"""
+    threads = set()
+    running = []
+
+    async def job(number):
+        threads.add(threading.get_ident())
+        running.append(export_loop.running)
+        await asyncio.sleep(0.02)
+        return number
+
+    futures = [export_loop.submit(job(number)) for number in range(6)]
+    assert [future.result(5) for future in futures] == list(range(6))
+    assert len(threads) == 1 and threading.get_ident() not in threads
+    assert max(running) == 2
+    assert export_loop.stats() == {'max_jobs': 2, 'running': 0, 'queued': 0, 'completed': 6,
+                                   'max_fetches': 16, 'fetching': 0}
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_queue_positions(export_loop):
+    """Jobs over max_jobs wait in submission order and hear their place in line"""
+    export_loop.submit(asyncio.sleep(0)).result(5)  # Starts the loop
+    release = export_loop.loop.create_future()
+    positions = {}
+
+    async def job():
+        await asyncio.shield(release)
+
+    futures = [export_loop.submit(job()) for _ in range(2)]
+    for name in 'abc':
+        futures.append(export_loop.submit(job(), on_queued=positions.setdefault(name, []).append))
+    wait_until(lambda: export_loop.stats()['queued'] == 3)
+    assert positions == {'a': [1], 'b': [2], 'c': [3]}
+
+    # One running job ends, 'a' takes its place and the others move up
+    futures[0].cancel()
+    wait_until(lambda: export_loop.stats()['queued'] == 2)
+    assert positions == {'a': [1], 'b': [2, 1], 'c': [3, 2]}
+    assert export_loop.stats()['running'] == 2
+
+    export_loop.loop.call_soon_threadsafe(release.set_result, None)
+    for future in futures[1:]:
+        future.result(5)
+    assert export_loop.stats()['completed'] == 6
+
+
+def test_fetch_budget_is_shared_fairly():
+    """A job arriving behind a large one gets every other freed fetch slot, not the last ones"""
+    export_loop = ExportLoop(max_jobs=2, max_fetches=2)
+    finished = []
+    in_flight = []
+
+    async def job(name, pages):
+        async def fetch():
+            async with export_loop.fetch_slot():
+                in_flight.append(export_loop.fetching)
+                await asyncio.sleep(0.01)
+                finished.append(name)
+        await asyncio.gather(*(fetch() for _ in range(pages)))
+
+    try:
+        large = export_loop.submit(job('large', 10))
+        wait_until(lambda: export_loop.fetching == 2)
+        small = export_loop.submit(job('small', 2))
+        large.result(5)
+        small.result(5)
+    finally:
+        export_loop.stop()
+    assert max(in_flight) == 2
+    assert finished.index('small') < 4 and len(finished) - finished[::-1].index('small') <= 5
+
+
+def test_errors_reach_the_future(export_loop):
+    async def job():
+        raise ValueError('broken page')
+
+    with pytest.raises(ValueError):
+        export_loop.submit(job()).result(5)
+    assert export_loop.stats()['completed'] == 1
+
+
+def test_session_reuses_connections(export_loop, pages):
+    """Back to back jobs fetch over the connections the first one opened"""
+    async def job(count):
+        session = await export_loop.session()
+
+        async def fetch(number):
+            async with session.get(f"{pages}/page/{number}") as response:
+                return await response.text()
+
+        return await asyncio.gather(*(fetch(number) for number in range(count)))
+
+    for _ in range(3):
+        assert export_loop.submit(job(6)).result(5)[5] == "<h1>/page/5</h1>"
+    # 18 pages over at most limit_per_host connections
+    assert PageHandler.connections <= 2
+
+
+def test_stop_closes_session(pages):
+    export_loop = ExportLoop()
+
+    async def job():
+        return await export_loop.session()
+
+    session = export_loop.submit(job()).result(5)
+    export_loop.stop()
+    assert session.closed
+    export_loop.stop()
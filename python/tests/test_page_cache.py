@@ -0,0 +1,169 @@
+"""
+Test suite for the docs exporter's page cache
+=============================================
+This module tests page_cache.PageCache against a local stand-in server:
+pages are revalidated with conditional GETs, an unchanged page is neither
+downloaded nor parsed again, the least recently used pages go beyond the
+size cap, and a locked cache file doesn't block the event loop.
+"""
+
+import asyncio
+import sqlite3
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import pytest
+
+from src.page_cache import PageCache
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    # path -> (body, validators the server sends: 'etag', 'last-modified' or 'none')
+    pages = {}
+    downloads = []
+    conditional = []
+
+    def do_GET(self):
+        body, validators = self.pages[self.path]
+        etag = f'"{hash(body) & 0xffffffff:x}"'
+        last_modified = formatdate(1700000000 + len(body), usegmt=True)
+        if self.headers.get('If-None-Match') or self.headers.get('If-Modified-Since'):
+            type(self).conditional.append(self.path)
+        if ((validators == 'etag' and self.headers.get('If-None-Match') == etag) or
+                (validators == 'last-modified' and self.headers.get('If-Modified-Since') == last_modified)):
+            self.send_response(304)
+            self.end_headers()
+            return
+        type(self).downloads.append(self.path)
+        data = body.encode()
+        self.send_response(200)
+        if validators == 'etag':
+            self.send_header('ETag', etag)
+        elif validators == 'last-modified':
+            self.send_header('Last-Modified', last_modified)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    PageHandler.pages = {}
+    PageHandler.downloads = []
+    PageHandler.conditional = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PageCache(str(tmp_path / 'pages.sqlite3'))
+
+
+parsed = []
+
+
+def parse(html):
+    parsed.append(html)
+    return {'text': html.upper()}
+
+
+def fetch(cache, *urls):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return [await cache.fetch(session, url, parse) for url in urls]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('validators', ['etag', 'last-modified'])
+def test_unchanged_page_is_not_downloaded_or_parsed(cache, server, validators):
+    PageHandler.pages['/a'] = ('<h1>a</h1>', validators)
+    parsed.clear()
+    assert fetch(cache, f"{server}/a") == [({'text': '<H1>A</H1>'}, False)]
+    assert fetch(cache, f"{server}/a") == [({'text': '<H1>A</H1>'}, True)]
+    assert PageHandler.downloads == ['/a'] and PageHandler.conditional == ['/a']
+    assert parsed == ['<h1>a</h1>']
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_changed_page_is_fetched_again(cache, server):
+    PageHandler.pages['/a'] = ('<h1>a</h1>', 'etag')
+    fetch(cache, f"{server}/a")
+    PageHandler.pages['/a'] = ('<h1>changed</h1>', 'etag')
+    assert fetch(cache, f"{server}/a") == [({'text': '<H1>CHANGED</H1>'}, False)]
+    assert fetch(cache, f"{server}/a")[0][1]
+
+
+def test_pages_without_validators_are_not_stored(cache, server):
+    PageHandler.pages['/a'] = ('<h1>a</h1>', 'none')
+    fetch(cache, f"{server}/a", f"{server}/a")
+    assert PageHandler.downloads == ['/a', '/a'] and not PageHandler.conditional
+    assert cache.stats()['pages'] == 0
+
+
+def test_cache_is_kept_on_disk(tmp_path, server):
+    """Another process, or the next start, revalidates what this one stored"""
+    PageHandler.pages['/a'] = ('<h1>a</h1>', 'etag')
+    fetch(PageCache(str(tmp_path / 'pages.sqlite3')), f"{server}/a")
+    assert fetch(PageCache(str(tmp_path / 'pages.sqlite3')), f"{server}/a")[0][1]
+
+
+def test_least_recently_used_are_evicted(tmp_path, server, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr('src.page_cache.time', lambda: now)
+    for name in 'abc':
+        PageHandler.pages[f'/{name}'] = (name * 1000, 'etag')
+    cache = PageCache(str(tmp_path / 'pages.sqlite3'), max_bytes=2500)
+    for url in ('/a', '/b', '/a', '/c'):
+        now += 1
+        fetch(cache, server + url)
+    assert cache.get(f"{server}/b") is None
+    assert cache.get(f"{server}/a") is not None and cache.get(f"{server}/c") is not None
+    assert cache.stats()['evicted'] == 1 and cache.stats()['retained_bytes'] <= 2500
+
+
+def test_job_counts(cache, server):
+    """Each export counts its own hits and misses for its progress messages"""
+    PageHandler.pages['/a'] = ('<h1>a</h1>', 'etag')
+    PageHandler.pages['/b'] = ('<h1>b</h1>', 'etag')
+    fetch(cache, f"{server}/a")
+    job = cache.for_job()
+    assert job.describe() == ''
+    fetch(job, f"{server}/a", f"{server}/b")
+    assert (job.hits, job.misses) == (1, 1)
+    assert job.describe() == '1 unchanged from cache, 1 downloaded'
+
+
+def test_locked_file_does_not_block_the_loop(cache, server):
+    """While another process holds the write lock, the fetch waits in the executor and the loop runs on"""
+    PageHandler.pages['/a'] = ('<h1>a</h1>', 'etag')
+    cache.stats()  # Creates the table
+    other = sqlite3.connect(cache.filename, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    ticks = []
+
+    async def run():
+        async def tick():
+            while len(ticks) < 20:
+                ticks.append(len(parsed))
+                await asyncio.sleep(0.01)
+            other.execute('COMMIT')
+
+        async with aiohttp.ClientSession() as session:
+            fetched, _ = await asyncio.gather(cache.fetch(session, f"{server}/a", parse), tick())
+        return fetched
+
+    parsed.clear()
+    assert asyncio.run(run()) == ({'text': '<H1>A</H1>'}, False)
+    # The page was parsed, and its put() waiting for the lock, while the loop kept ticking
+    assert ticks[-1] == 1
+    assert cache.get(f"{server}/a") is not None
@@ -0,0 +1,204 @@
+"""
+Test suite for the docs exporter's progress stores
+==================================================
+This module tests progress_store.MemoryProgressStore and
+progress_store.SQLiteProgressStore: updates and their versions, expiry,
+the byte budget, result files, and an SQLite file shared between
+processes, whose writes from other connections wake the watcher.
+"""
+
+import multiprocessing
+import sqlite3
+import threading
+from time import sleep
+
+import pytest
+
+from src.progress_store import MemoryProgressStore, SQLiteProgressStore, make_progress_store, start_watcher
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    return make_progress_store(request.param, str(tmp_path / 'progress.sqlite3'))
+
+
+def test_update_and_get(store):
+    """Updates merge into the entry, unknown ids are not created"""
+    store.create('a', {'completed': 0, 'total': 3, 'finished': False})
+    assert store.update('a', {'completed': 2, 'message': 'Page 2'})
+    assert store.get('a') == {'completed': 2, 'total': 3, 'finished': False, 'message': 'Page 2'}
+    assert not store.update('b', {'completed': 1})
+    assert store.get('b') is None
+
+
+def test_versions(store):
+    """Every update bumps the version, an unchanged one is not read again"""
+    store.create('a', {'completed': 0})
+    version, data = store.get_newer('a', None)
+    assert data == {'completed': 0}
+    assert store.get_newer('a', version) == (version, None)
+    store.update('a', {'completed': 1})
+    assert store.get_newer('a', version) == (version + 1, {'completed': 1})
+    assert store.get_newer('b', None) is None
+
+
+def test_result_files(store, tmp_path, monkeypatch):
+    """A result file counts toward the budget and is deleted with its entry"""
+    now = 1000.0
+    monkeypatch.setattr('src.progress_store.time', lambda: now)
+    result_file = tmp_path / 'a.txt'
+    result_file.write_bytes(b'x' * 5000)
+    store.create('a', {'finished': False})
+    store.update('a', {'finished': True, 'result_file': str(result_file), 'result_bytes': 5000})
+    assert store.stats()['retained_bytes'] > 5000
+    assert result_file.exists()
+    now += store.ttl + 1
+    store.sweep()
+    assert not result_file.exists()
+    assert store.stats()['retained_bytes'] == 0
+
+
+def test_expiry(tmp_path, monkeypatch):
+    """Finished entries untouched for ttl seconds go when the next export starts"""
+    for store in (MemoryProgressStore(ttl=60), SQLiteProgressStore(str(tmp_path / 'progress.sqlite3'), ttl=60)):
+        now = 1000.0
+        monkeypatch.setattr('src.progress_store.time', lambda: now)
+        store.create('queued', {'finished': False, 'queue_position': 1})
+        store.create('old', {'finished': True})
+        now += 30
+        store.create('recent', {'finished': True})
+        now += 40
+        store.create('new', {'finished': False})
+        assert store.get('old') is None
+        assert store.get('recent') is not None
+        # Waiting in line for longer than the ttl doesn't lose the export
+        assert store.update('queued', {'queue_position': None})
+        assert store.stats()['expired'] == 1
+
+
+def test_unfinished_expiry(tmp_path, monkeypatch):
+    """An unfinished entry not updated for unfinished_ttl seconds, its worker gone, is dropped too"""
+    for store in (MemoryProgressStore(ttl=60, unfinished_ttl=600),
+                  SQLiteProgressStore(str(tmp_path / 'progress.sqlite3'), ttl=60, unfinished_ttl=600)):
+        now = 1000.0
+        monkeypatch.setattr('src.progress_store.time', lambda: now)
+        store.create('orphaned', {'finished': False, 'content': 'x' * 1000})
+        store.create('running', {'finished': False})
+        now += 500
+        store.update('running', {'completed': 1})
+        store.sweep()
+        assert store.stats()['running'] == 2
+        now += 101
+        store.sweep()
+        assert store.get('orphaned') is None
+        assert store.get('running') is not None
+        stats = store.stats()
+        assert stats['running'] == 1 and stats['expired'] == 1
+
+
+def test_expiry_sweep(store, monkeypatch):
+    """sweep() drops expired entries without a new export starting"""
+    now = 1000.0
+    monkeypatch.setattr('src.progress_store.time', lambda: now)
+    store.create('a', {'finished': True, 'content': 'x'})
+    store.create('running', {'finished': False})
+    now += store.ttl + 1
+    store.sweep()
+    assert store.get('a') is None
+    assert store.get('running') is not None
+    assert store.stats()['expired'] == 1
+
+
+def test_byte_budget(tmp_path):
+    """Over the budget the oldest finished results go first, running exports and the newest result stay"""
+    for store in (MemoryProgressStore(max_bytes=25000), SQLiteProgressStore(str(tmp_path / 'p.sqlite3'), max_bytes=25000)):
+        store.create('running', {'finished': False, 'content': None})
+        for name in ('first', 'second', 'third'):
+            store.create(name, {'finished': False, 'content': None})
+            store.update(name, {'finished': True, 'content': name[0] * 10000})
+        assert store.get('first') is None
+        assert store.get('second')['content'] == 's' * 10000
+        assert store.get('third')['content'] == 't' * 10000
+        assert store.get('running') is not None
+        stats = store.stats()
+        assert stats['jobs'] == 3 and stats['running'] == 1 and stats['evicted'] == 1
+        assert 20000 < stats['retained_bytes'] <= 25000
+        # A single result over the budget is still kept until the next one arrives
+        store.create('huge', {'finished': False})
+        store.update('huge', {'finished': True, 'content': 'h' * 50000})
+        assert store.get('huge') is not None and store.get('third') is None
+
+
+def test_sqlite_shared_between_processes(tmp_path):
+    """An export in one process is seen and updated by the others"""
+    filename = str(tmp_path / 'progress.sqlite3')
+    store = SQLiteProgressStore(filename)
+    store.create('a', {'completed': 0, 'finished': False})
+    process = multiprocessing.get_context('spawn').Process(target=update_in_process, args=(filename,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert store.get('a') == {'completed': 5, 'finished': True}
+
+
+def update_in_process(filename):
+    store = SQLiteProgressStore(filename)
+    assert store.get('a') == {'completed': 0, 'finished': False}
+    for completed in range(1, 6):
+        store.update('a', {'completed': completed})
+    store.update('a', {'finished': True})
+
+
+def test_watcher_wakes_on_other_writes(tmp_path):
+    """Only commits to the file wake the watcher, not reads or an idle file"""
+    filename = str(tmp_path / 'progress.sqlite3')
+    store = SQLiteProgressStore(filename)
+    store.create('a', {'completed': 0})
+    changed = threading.Event()
+    active = threading.Event()
+    active.set()
+    start_watcher(store, 0.01, changed.set, active)
+    assert changed.wait(5)  # Once at the start
+    changed.clear()
+    store.get('a')
+    assert not changed.wait(0.2)
+    SQLiteProgressStore(filename).update('a', {'completed': 1})
+    assert changed.wait(5)
+
+
+def test_watcher_idles_while_inactive(tmp_path, monkeypatch):
+    """Without streams to wake the watcher doesn't touch the file, and it looks again once there are"""
+    store = SQLiteProgressStore(str(tmp_path / 'progress.sqlite3'))
+    checks = []
+    data_version = store.data_version
+    monkeypatch.setattr(store, 'data_version', lambda: checks.append(1) or data_version())
+    changed = threading.Event()
+    active = threading.Event()
+    start_watcher(store, 0.01, changed.set, active)
+    assert not changed.wait(0.2) and not checks
+    active.set()
+    assert changed.wait(5)
+    active.clear()
+    sleep(0.05)
+    count = len(checks)
+    sleep(0.2)
+    assert len(checks) == count
+
+
+def test_sqlite_older_layout(tmp_path):
+    """A file from before the version column is started over"""
+    filename = str(tmp_path / 'progress.sqlite3')
+    connection = sqlite3.connect(filename)
+    connection.execute('CREATE TABLE progress (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)')
+    connection.execute("INSERT INTO progress VALUES ('a', '{}', 0)")
+    connection.commit()
+    connection.close()
+    store = SQLiteProgressStore(filename)
+    assert store.get('a') is None
+    store.create('a', {'finished': False})
+    assert store.get_newer('a', None) == (1, {'finished': False})
+
+
+def test_unknown_store():
+    with pytest.raises(ValueError):
+        make_progress_store('redis', 'progress.sqlite3')
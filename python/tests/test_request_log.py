@@ -0,0 +1,130 @@
+"""
+Test suite for the request log
+==============================
+This module tests request_log's text and JSON line formats, the cutting of
+long expressions, sampling, that RequestLog writes both log files from
+its background thread, and that worker processes can share the files.
+"""
+
+import json
+import logging
+import multiprocessing
+import queue
+
+from src.request_log import RequestFormatter, RequestLog, RequestQueueHandler, SamplingFilter
+
+FIELDS = {'ip': '1.2.3.4', 'expression': r'\frac{1}{2}', 'settings': 'TI UN', 'latency_ms': 1.23456,
+          'outcome': 'ok', 'result': '((1)/(2))'}
+MESSAGE = "%(ip)s | %(expression)s | %(result)s | %(latency_ms).2f ms | Active Settings: %(settings)s"
+
+
+def make_record(level=logging.INFO, message=MESSAGE, fields=FIELDS):
+    return logging.LogRecord('app_logger', level, __file__, 1, message, (fields,) if fields else (), None)
+
+
+def test_text_lines():
+    """Text lines keep the message format of the request log"""
+    line = RequestFormatter().format(make_record())
+    assert line.endswith(r"| INFO | 1.2.3.4 | \frac{1}{2} | ((1)/(2)) | 1.23 ms | Active Settings: TI UN")
+
+
+def test_long_expressions_are_cut():
+    """Expressions and results past max_chars are cut, 0 keeps them whole"""
+    fields = dict(FIELDS, expression="x" * 50, result="y" * 50)
+    line = RequestFormatter(max_chars=10).format(make_record(fields=fields))
+    assert "xxxxxxxxxx... (+40 chars) | yyyyyyyyyy... (+40 chars)" in line
+    assert "x" * 50 in RequestFormatter(max_chars=0).format(make_record(fields=fields))
+
+
+def test_json_lines():
+    """JSON lines carry the fields, the expression's length and hash"""
+    fields = dict(FIELDS, expression="x" * 50)
+    entry = json.loads(RequestFormatter(json_lines=True, max_chars=10).format(make_record(fields=fields)))
+    assert entry['level'] == 'INFO'
+    assert entry['ip'] == '1.2.3.4'
+    assert entry['outcome'] == 'ok'
+    assert entry['latency_ms'] == 1.235
+    assert entry['length'] == 50
+    assert entry['expression'].startswith("x" * 10 + "...")
+    assert len(entry['expression_hash']) == 16
+
+    plain = json.loads(RequestFormatter(json_lines=True).format(make_record(message="started", fields=None)))
+    assert plain['message'] == "started"
+
+
+def test_sampling_keeps_errors():
+    """A sample rate of 0 drops every INFO record and no error"""
+    sampling = SamplingFilter(0)
+    assert not sampling.filter(make_record())
+    assert sampling.filter(make_record(level=logging.ERROR))
+
+
+def test_full_queue_drops_records():
+    """Records past the queue size are counted and dropped"""
+    handler = RequestQueueHandler(queue.Queue(1))
+    handler.handle(make_record())
+    handler.handle(make_record())
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+
+
+def test_request_log_writes_both_files(tmp_path):
+    """Every record goes to app.log and the errors also to error.log"""
+    logger = logging.getLogger('test_request_log')
+    logger.setLevel(logging.INFO)
+    request_log = RequestLog(logger, str(tmp_path))
+    try:
+        logger.info(MESSAGE, FIELDS)
+        logger.error("%(ip)s | %(expression)s | TIMEOUT | %(latency_ms).2f ms", FIELDS)
+    finally:
+        request_log.stop()
+
+    app_log = (tmp_path / 'app.log').read_text(encoding='utf-8').splitlines()
+    error_log = (tmp_path / 'error.log').read_text(encoding='utf-8').splitlines()
+    assert len(app_log) == 2
+    assert len(error_log) == 1
+    assert error_log[0].endswith("| ERROR | 1.2.3.4 | \\frac{1}{2} | TIMEOUT | 1.23 ms")
+
+
+def test_worker_processes_share_the_files(tmp_path):
+    """Without rotation in the processes, their lines all land whole in the same files"""
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=log_in_process, args=(str(tmp_path), worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    app_log = (tmp_path / 'app.log').read_text(encoding='utf-8').splitlines()
+    assert len(app_log) == 4 * 200
+    assert all(line.endswith("| Active Settings: TI UN") for line in app_log)
+
+
+def log_in_process(directory, worker):
+    logger = logging.getLogger(f'test_request_log_{worker}')
+    logger.setLevel(logging.INFO)
+    request_log = RequestLog(logger, directory)
+    try:
+        for _ in range(200):
+            logger.info(MESSAGE, FIELDS)
+    finally:
+        request_log.stop()
+
+
+def test_files_reopened_after_logrotate(tmp_path):
+    """A file moved away by logrotate is recreated on the next record"""
+    logger = logging.getLogger('test_request_log_rotated')
+    logger.setLevel(logging.INFO)
+    request_log = RequestLog(logger, str(tmp_path))
+    try:
+        logger.info(MESSAGE, FIELDS)
+        request_log.listener.stop()  # Writes out the queue before the move
+        (tmp_path / 'app.log').rename(tmp_path / 'app.log.1')
+        request_log.listener.start()
+        logger.info(MESSAGE, FIELDS)
+    finally:
+        request_log.stop()
+
+    assert len((tmp_path / 'app.log.1').read_text(encoding='utf-8').splitlines()) == 1
+    assert len((tmp_path / 'app.log').read_text(encoding='utf-8').splitlines()) == 1
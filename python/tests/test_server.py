@@ -0,0 +1,337 @@
+"""
+Test suite for the Flask server
+===============================
+This module tests server.py through Flask's test client: the WSGI fast path
+answers POST /translate as the Flask view does, a translation that
+times out in the worker process pool is answered with 408, through the WSGI
+fast path, the Flask view and the batch endpoint alike, a body too deeply
+nested to parse with 400, a batch only takes its share of the backlog, a
+cached GET is revalidated by its weak ETag, the docs exporter's progress
+writes don't block its export loop, a write from another worker only wakes
+the progress streams of its own export, the result page shows a small
+export whole and a large one as its preview with a link to the download,
+exports running at once stay within EXPORT_MAX_FETCHES requests in flight, and
+an exporter taking the page cache gets an earlier export's unchanged pages
+from it and the same shared session as every other export.
+
+The server fixture, in conftest.py, imports a stand-in DocsExporter when the
+docs-exporter/ folder is not checked out.
+"""
+
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+
+@pytest.mark.parametrize('body', [
+    {'expression': r"\frac{1}{2}"},
+    {'expression': r"\sqrt{x}\cdot \pi", 'constants_on': True, 'TI_on': False},
+    {'expression': r"\frac{1}{2}", 'timings': True},
+    {'expression': 42},
+    [r"\frac{1}{2}"],
+    'not json',
+])
+def test_fast_path_answers_like_the_view(server, monkeypatch, body):
+    def post():
+        data = body if isinstance(body, str) else None
+        return server.app.test_client().post('/translate', data=data, json=None if data else body,
+                                             headers={'Origin': 'chrome-extension://abc'},
+                                             content_type='application/json')
+
+    fast = post()
+    monkeypatch.setattr(server.app, 'wsgi_app', server.app.wsgi_app.wsgi_app)
+    view = post()
+    assert fast.status_code == view.status_code
+    fast_body, view_body = fast.get_json(), view.get_json()
+    for answer in (fast_body, view_body):
+        answer.pop('timings', None)
+    assert fast_body == view_body
+    for header in ('Content-Type', 'Access-Control-Allow-Origin', 'Timing-Allow-Origin'):
+        assert fast.headers.get(header) == view.headers.get(header)
+    assert ('Server-Timing' in fast.headers) == ('Server-Timing' in view.headers)
+
+
+@pytest.fixture
+def busy_pool(server, monkeypatch):
+    """A one-worker pool whose worker is taken, so a translation waits for it until it times out"""
+    from translation_pool import TranslationPool
+    pool = TranslationPool(workers=1)
+    worker = pool._idle.get()
+    monkeypatch.setattr(server, 'translation_pool', pool)
+    monkeypatch.setattr(server, 'TRANSLATION_TIMEOUT', 0.3)
+    yield pool
+    pool._idle.put(worker)
+    pool.shutdown()
+
+
+@pytest.mark.parametrize('fast_path', [True, False])
+def test_pool_timeout_is_408(server, busy_pool, monkeypatch, fast_path):
+    if not fast_path:
+        monkeypatch.setattr(server.app, 'wsgi_app', server.app.wsgi_app.wsgi_app)
+    response = server.app.test_client().post('/translate', json={'expression': rf"\frac{{{fast_path}}}{{408}}"})
+    assert response.status_code == 408
+    assert response.get_json() == {'error': 'Translation timeout. Please try a simpler expression.'}
+
+
+def test_pool_timeout_in_batch(server, busy_pool):
+    response = server.app.test_client().post('/translate/batch', json={'expressions': [r"\frac{408}{2}"]})
+    assert response.status_code == 200
+    assert 'timeout' in response.get_json()['results'][0]['error']
+
+
+@pytest.mark.parametrize('path', ['/translate', '/translate/batch'])
+def test_deeply_nested_body_is_400(server, path):
+    """JSON nested past the parser's recursion limit, well under the size limit, is invalid JSON"""
+    body = '[' * 100000 + ']' * 100000
+    response = server.app.test_client().post(path, data=body, content_type='application/json')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('if_none_match', ['{etag}', 'W/{etag}', '"other", W/{etag}', '*'])
+def test_get_revalidated(server, if_none_match):
+    """If-None-Match compares weakly, so a W/ ETag from a compressing proxy still gets a 304"""
+    client = server.app.test_client()
+    response = client.get('/translate', query_string={'expr': r"\frac{1}{304}"})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    headers = {'If-None-Match': if_none_match.format(etag=etag)}
+    response = client.get('/translate', query_string={'expr': r"\frac{1}{304}"}, headers=headers)
+    assert response.status_code == 304 and response.headers['ETag'] == etag
+    headers = {'If-None-Match': 'W/"other"'}
+    assert client.get('/translate', query_string={'expr': r"\frac{1}{304}"}, headers=headers).status_code == 200
+
+
+def test_batch_shed_near_a_full_backlog(server, monkeypatch):
+    """A batch needs its share of the backlog free, where a single translation only needs one place"""
+    monkeypatch.setattr(server.admission, 'backlog', server.admission.max_backlog - 1)
+    client = server.app.test_client()
+    response = client.post('/translate/batch', json={'expressions': [rf"\frac{{{n}}}{{503}}" for n in range(10)]})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.post('/translate', json={'expression': r"\frac{1}{503}"}).status_code == 200
+
+
+def test_batch_items_in_flight(server, monkeypatch):
+    """A large batch never has more than TRANSLATION_BATCH_IN_FLIGHT translations in the backlog"""
+    backlogs = []
+    translation_job = server.translation_job
+
+    def counting_job(*args, **kwargs):
+        backlogs.append(server.admission.backlog)
+        return translation_job(*args, **kwargs)
+
+    monkeypatch.setattr(server, 'translation_job', counting_job)
+    monkeypatch.setattr(server, 'TRANSLATION_BATCH_IN_FLIGHT', 2)
+    expressions = [rf"\frac{{{n}}}{{4040}}" for n in range(40)]
+    response = server.app.test_client().post('/translate/batch', json={'expressions': expressions + expressions})
+    results = response.get_json()['results']
+    assert [result['result'] for result in results[:40]] == [f"(({n})/(4040))" for n in range(40)]
+    assert results[40:] == results[:40]
+    assert len(backlogs) == 40 and max(backlogs) <= 2
+
+
+def test_progress_writes_stay_off_the_export_loop(server, monkeypatch):
+    """A store write that blocks holds up the progress writer, not the exports on the loop"""
+    import docs_exporter_blueprint
+    released = threading.Event()
+    update = docs_exporter_blueprint.progress_store.update
+
+    def blocked_update(progress_id, fields):
+        released.wait(10)
+        return update(progress_id, fields)
+
+    monkeypatch.setattr(docs_exporter_blueprint.progress_store, 'update', blocked_update)
+    response = server.app.test_client().post('/docs-exporter/export', data={
+        'base_url': 'http://127.0.0.1:9', 'selected_pages': ['http://127.0.0.1:9/page']})
+    assert response.status_code == 302
+
+    async def other_export():
+        return 'ran'
+
+    try:
+        assert docs_exporter_blueprint.export_loop.submit(other_export()).result(2) == 'ran'
+    finally:
+        released.set()
+
+
+def test_watcher_wakes_only_the_changed_stream(server):
+    """Another worker's write wakes the streams of that export, and with no streams open the watcher rests"""
+    import docs_exporter_blueprint
+    from progress_store import SQLiteProgressStore
+    store = docs_exporter_blueprint.progress_store
+    other_worker = SQLiteProgressStore(store.filename)
+    for progress_id in ('watched-a', 'watched-b'):
+        store.create(progress_id, {'completed': 0, 'finished': False})
+    woken = {'watched-a': threading.Event(), 'watched-b': threading.Event()}
+    with docs_exporter_blueprint.progress_waiter('watched-a', woken['watched-a'].set), \
+            docs_exporter_blueprint.progress_waiter('watched-b', woken['watched-b'].set):
+        # Once the watcher woke b for this write, it has seen both streams
+        other_worker.update('watched-b', {'completed': 1})
+        assert woken['watched-b'].wait(5)
+        time.sleep(0.2)
+        for event in woken.values():
+            event.clear()
+        other_worker.update('watched-a', {'completed': 1})
+        assert woken['watched-a'].wait(5)
+        assert not woken['watched-b'].wait(0.3)
+    assert not docs_exporter_blueprint.progress_watching.is_set()
+
+
+@pytest.mark.parametrize('inline_bytes, shown', [(2 * 1024 * 1024, 'whole'), (1000, 'preview')])
+def test_result_page(server, monkeypatch, tmp_path, inline_bytes, shown):
+    """A result up to RESULT_INLINE_BYTES is shown whole, a larger one as its preview with a link to the download"""
+    import docs_exporter_blueprint
+    from flask import get_flashed_messages
+    content = 'x' * (docs_exporter_blueprint.RESULT_PREVIEW_CHARS + 5000)
+    result_file = tmp_path / 'result.txt'
+    result_file.write_text(content)
+    progress_id = f'result-{shown}'
+    docs_exporter_blueprint.progress_store.create(progress_id, {
+        'finished': True, 'errors': [], 'preview': content[:docs_exporter_blueprint.RESULT_PREVIEW_CHARS],
+        'truncated': True, 'result_file': str(result_file), 'result_bytes': len(content)})
+    rendered = {}
+
+    def render_template(template, **context):
+        rendered.update(context, flashed=get_flashed_messages())
+        return ''
+    monkeypatch.setattr(docs_exporter_blueprint, 'render_template', render_template)
+    monkeypatch.setattr(docs_exporter_blueprint, 'RESULT_INLINE_BYTES', inline_bytes)
+    assert server.app.test_client().get(f'/docs-exporter/result/{progress_id}').status_code == 200
+    if shown == 'whole':
+        assert rendered['content'] == content and not rendered['truncated'] and not rendered['flashed']
+    else:
+        assert rendered['content'] == content[:docs_exporter_blueprint.RESULT_PREVIEW_CHARS] and rendered['truncated']
+        assert rendered['flashed'] == [
+            f"Showing the first {docs_exporter_blueprint.RESULT_PREVIEW_CHARS:,} characters, download the whole "
+            f"export ({len(content):,} bytes) from http://localhost/docs-exporter/download/{progress_id}"]
+
+
+def serve_pages(handler):
+    """A local documentation site answered by the handler class on its own threads, and its base URL"""
+    from http.server import ThreadingHTTPServer
+    pages = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    pages.daemon_threads = True
+    threading.Thread(target=pages.serve_forever, daemon=True).start()
+    return pages, f'http://127.0.0.1:{pages.server_port}'
+
+
+def run_exports(server, base_url, page_lists):
+    """Starts one export per list of pages through /docs-exporter/export, returns their entries once all finished"""
+    import docs_exporter_blueprint
+    client = server.app.test_client()
+    progress_ids = []
+    for selected_pages in page_lists:
+        response = client.post('/docs-exporter/export', data={'base_url': base_url, 'selected_pages': selected_pages})
+        progress_ids.append(parse_qs(urlsplit(response.headers['Location']).query)['progress_id'][0])
+    deadline = time.monotonic() + 30
+    while not all(docs_exporter_blueprint.progress_store.get(progress_id).get('finished')
+                  for progress_id in progress_ids):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return [docs_exporter_blueprint.progress_store.get(progress_id) for progress_id in progress_ids]
+
+
+def test_exports_share_the_fetch_budget(server, monkeypatch):
+    """Exports running at once keep at most EXPORT_MAX_FETCHES requests in flight together"""
+    import docs_exporter_blueprint
+    from http.server import BaseHTTPRequestHandler
+    in_flight = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+
+    class Page(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                in_flight['now'] += 1
+                in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            time.sleep(0.05)
+            with lock:
+                in_flight['now'] -= 1
+            self.send_response(200)
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write(b'page')
+
+        def log_message(self, *args):
+            pass
+
+    monkeypatch.setattr(docs_exporter_blueprint, 'EXPORTER_TAKES_SESSION', False)
+    pages, base_url = serve_pages(Page)
+    try:
+        entries = run_exports(server, base_url, [
+            [f'{base_url}/{job}/{page}' for page in range(3 * docs_exporter_blueprint.EXPORT_MAX_FETCHES)]
+            for job in range(docs_exporter_blueprint.EXPORT_MAX_JOBS)])
+    finally:
+        pages.shutdown()
+    assert all(not entry['errors'] for entry in entries)
+    assert 1 < in_flight['max'] <= docs_exporter_blueprint.EXPORT_MAX_FETCHES
+
+
+class CachingExporter:
+    """A DocsExporter taking the shared session and the page cache, which fetches every page through the cache"""
+
+    def __init__(self, base_url, max_concurrent_requests=5, delay_between_requests=0.5, session=None,
+                 page_cache=None):
+        self.session = session
+        self.page_cache = page_cache
+        self.progress_callback = None
+
+    def set_progress_callback(self, callback):
+        self.progress_callback = callback
+
+    async def export_selected_pages_async(self, urls, compress_links=False):
+        parsed = []
+        for url in urls:
+            parsed.append((await self.page_cache.fetch(self.session, url, str.upper))[0])
+            self.progress_callback(len(parsed), len(urls), f"Fetched {url}")
+        return '\n\n'.join(parsed), [], []
+
+
+def test_page_cache_reused_by_the_next_export(server, monkeypatch, tmp_path):
+    """An exporter taking page_cache gets the unchanged pages of an earlier export from the cache"""
+    import docs_exporter_blueprint
+    from http.server import BaseHTTPRequestHandler
+    from page_cache import PageCache
+    downloads = []
+
+    class Page(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            downloads.append(self.path)
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(self.path)))
+            self.end_headers()
+            self.wfile.write(self.path.encode())
+
+        def log_message(self, *args):
+            pass
+
+    sessions = []
+
+    class RecordingExporter(CachingExporter):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            sessions.append(self.session)
+
+    monkeypatch.setattr(docs_exporter_blueprint, 'DocsExporter', RecordingExporter)
+    monkeypatch.setattr(docs_exporter_blueprint, 'EXPORTER_TAKES_SESSION', True)
+    monkeypatch.setattr(docs_exporter_blueprint, 'EXPORTER_TAKES_PAGE_CACHE', True)
+    monkeypatch.setattr(docs_exporter_blueprint, 'page_cache', PageCache(str(tmp_path / 'pages.sqlite3')))
+    pages, base_url = serve_pages(Page)
+    selected_pages = [f'{base_url}/a', f'{base_url}/b']
+    try:
+        first, = run_exports(server, base_url, [selected_pages])
+        second, = run_exports(server, base_url, [selected_pages])
+    finally:
+        pages.shutdown()
+    assert downloads == ['/a', '/b']
+    assert first['preview'] == second['preview'] == '/A\n\n/B'
+    assert first['message'] == 'Export completed! (0 unchanged from cache, 2 downloaded)'
+    assert second['message'] == 'Export completed! (2 unchanged from cache, 0 downloaded)'
+    # Both exports got the export loop's session, so they reused its connections
+    assert len(sessions) == 2 and sessions[0] is sessions[1] is not None
@@ -0,0 +1,84 @@
+"""
+Test suite for the static asset pipeline
+========================================
+This module tests static_assets.StaticAssets: fingerprints, the precompressed
+variants and their negotiation, that a rebuild keeps unchanged files, and
+that the nginx config only caches the current versions for good.
+"""
+
+import gzip
+from os import path
+
+import pytest
+
+from src.static_assets import StaticAssets, URL_PREFIX, IMMUTABLE
+
+SCRIPT = b"const rain = () => 'digital rain';\n" * 100
+
+
+@pytest.fixture
+def assets(tmp_path):
+    root = tmp_path / "static"
+    (root / "matrix" / "js").mkdir(parents=True)
+    (root / "matrix" / "js" / "main.js").write_bytes(SCRIPT)
+    (root / "matrix" / "glyphs.png").write_bytes(bytes(range(256)) * 20)
+    (root / "bear.ico").write_bytes(b"ico")
+    return StaticAssets(str(root), str(tmp_path / "build")).build()
+
+
+def test_compressible_files_get_variants(assets):
+    """Text gets gzip variants that decompress to the file, PNGs and tiny files do not"""
+    script = assets.assets["matrix/js/main.js"]
+    assert "gzip" in script.variants
+    with open(script.variants["gzip"], "rb") as f:
+        assert gzip.decompress(f.read()) == SCRIPT
+    assert list(assets.assets["matrix/glyphs.png"].variants) == [None]
+    assert list(assets.assets["bear.ico"].variants) == [None]
+
+
+def test_accept_encoding_negotiation(assets):
+    """The best accepted variant is chosen, the plain copy otherwise"""
+    _, file, encoding = assets.select("matrix/js/main.js", "gzip, deflate")
+    assert encoding == "gzip" and file.endswith(".gz")
+    _, file, encoding = assets.select("matrix/js/main.js", "gzip;q=0, deflate")
+    assert encoding is None and path.exists(file)
+    assert assets.select("missing.js", "gzip") is None
+
+
+def test_urls_are_fingerprinted(assets):
+    """File URLs carry the file's hash, directory URLs the hash of the tree"""
+    script = assets.assets["matrix/js/main.js"]
+    assert assets.url("matrix/js/main.js") == f"{URL_PREFIX}{script.digest}/matrix/js/main.js"
+    assert assets.url("matrix/") == f"{URL_PREFIX}{assets.version}/matrix/"
+    assert assets.is_current("matrix/js/main.js", script.digest)
+    assert assets.is_current("matrix/js/main.js", assets.version)
+    assert not assets.is_current("matrix/js/main.js", "0123456789abcdef")
+
+
+def test_rebuild_tracks_changes(assets):
+    """A rebuild keeps the fingerprints of unchanged files and changes the others"""
+    script = assets.assets["matrix/js/main.js"].digest
+    version = assets.version
+    with open(path.join(assets.root, "bear.ico"), "wb") as f:
+        f.write(b"new ico")
+
+    rebuilt = StaticAssets(assets.root, assets.build_dir).build()
+    assert rebuilt.assets["matrix/js/main.js"].digest == script
+    assert rebuilt.version != version
+    with open(rebuilt.assets["bear.ico"].variants[None], "rb") as f:
+        assert f.read() == b"new ico"
+    assert path.exists(path.join(assets.build_dir, "nginx.conf"))
+
+
+def test_nginx_caches_only_current_versions(assets):
+    """nginx serves as immutable exactly the versions is_current() accepts"""
+    with open(path.join(assets.build_dir, "nginx.conf"), encoding="utf-8") as f:
+        blocks = f.read().split("location ")[1:]
+    immutable = [block.split(" {")[0] for block in blocks if IMMUTABLE in block]
+    script = assets.assets["matrix/js/main.js"]
+    assert f'= "{URL_PREFIX}{script.digest}/matrix/js/main.js"' in immutable
+    assert f'^~ "{URL_PREFIX}{assets.version}/"' in immutable
+    assert len(immutable) == len(assets.assets) + 1
+    # Other versions match the regex location, which revalidates
+    assert all(block.startswith(("=", "^~")) for block in blocks if IMMUTABLE in block)
+    assert any(block.startswith("~ ^/static/v/") and 'Cache-Control "no-cache"' in block for block in blocks)
@@ -5,8 +5,16 @@ This module tests the translatelatex.translate() function with various
 LaTeX expressions and parameter combinations.
 """
 
+import random
+from time import monotonic, perf_counter
 import pytest
-from src.translatelatex import translate
+from src import translatelatex
+from src.translatelatex import (
+    translate, get_engine, LatexToCalcEngine, MultiReplacer, tagGroups, _tagGroupsByText,
+    _presentFunctions, SYMBOLS, GREEK_LETTERS, CONSTANTS, ARROWS, COMMON_FUNCTIONS, PATTERNS, PatternRegistry,
+    PIPELINE, STAGE_STATS, STAGE_TIMINGS, scanFeatures, TranslationTimeout, OutputTooLong
+)
+from src.translatetree import Unsupported
 
 
 # ========================================================================
@@ -484,6 +492,282 @@ def test_edge_cases():
             f"Edge case '{test_case.description}' failed\nInput: {test_case.latex_input}\nExpected: {test_case.expected_output}\nGot: {result}"
 
 
+# ========================================================================
+# ENGINE PROFILE TESTS
+# ========================================================================
+
+def test_engine_profiles_are_shared():
+    """get_engine() returns one prebuilt engine per settings profile"""
+    assert get_engine() is get_engine(TI_on=True, units_on=True)
+    assert get_engine(e_on=True) is not get_engine(e_on=False)
+    # truthy values share the profile of True
+    assert get_engine(g_on=1) is get_engine(g_on=True)
+
+
+def test_engine_translate_matches_module_translate():
+    """A reused engine gives the same result as translate()"""
+    engine = LatexToCalcEngine(TI_on=True, SC_on=False, units_on=True, g_on=True)
+    for test_case in BASIC_TESTS + COMBINED_PARAMS_TESTS:
+        expected = translate(test_case.latex_input, g_on=True)
+        assert engine.translate(test_case.latex_input) == expected
+        # translating twice on the same engine must not leak state
+        assert engine.translate(test_case.latex_input) == expected
+
+
+def test_tables_are_read_only():
+    """The shared translation tables cannot be modified by callers"""
+    with pytest.raises(TypeError):
+        SYMBOLS["\\newcommand"] = "x"
+    assert get_engine().symbols is SYMBOLS
+
+
+# ========================================================================
+# REPLACEMENT TABLE TESTS
+# ========================================================================
+
+def sequential_replace(table, expression):
+    for key, value in table.items():
+        expression = expression.replace(key, value)
+    return expression
+
+
+@pytest.mark.parametrize("table", [SYMBOLS, GREEK_LETTERS, CONSTANTS, ARROWS],
+                         ids=["symbols", "greek", "constants", "arrows"])
+def test_multi_replacer_matches_sequential_replace(table):
+    """MultiReplacer gives the same text as replacing the keys one by one in dict order"""
+    # min_run=2 merges every run that is allowed to be merged
+    replacer = MultiReplacer(table, min_run=2)
+    # Keys, values and loose characters glued together produce the overlaps
+    # and replacement chains the merged scans must respect
+    fragments = list(table) + list(table.values()) + ["\\", " ", "{", "}", "x", "R", "_", "not", "left"]
+    rng = random.Random(0)
+    for _ in range(3000):
+        expression = "".join(rng.choice(fragments) for _ in range(rng.randint(1, 8)))
+        assert replacer.replace(expression) == sequential_replace(table, expression), \
+            f"Input: {expression!r}"
+
+
+def test_multi_replacer_keeps_table_order():
+    """Entries that can interact are never merged into one scan"""
+    table = {"\\equiv": "≡", "\\not\\equiv": "≢", "\\a": "", "\\b": "x"}
+    replacer = MultiReplacer(table, min_run=2)
+    # "\\equiv" runs first, so "\\not\\equiv" can no longer match
+    assert replacer.replace("\\not\\equiv") == "\\not≡"
+    # deleting "\\a" joins "\\" and "b" into a new "\\b"
+    assert replacer.replace("\\\\ab") == "x"
+
+
+# ========================================================================
+# BRACKET TAGGING TESTS
+# ========================================================================
+
+def test_tag_groups_numbering():
+    """Groups are tagged from the longest down, tag 0 is the wrapper"""
+    assert tagGroups("(a)(b)", "(", ")", "$") == "$1$(a)$1$$2$(b)$2$"
+    assert tagGroups("((a))", "(", ")", "$") == "$1$($2$(a)$2$)$1$"
+    # unbalanced: only the leftmost complete group is tagged
+    assert tagGroups("(a)+(b", "(", ")", "$") == "$0$(a)$0$+(b"
+
+
+@pytest.mark.parametrize("brackets", [("(", ")", "$"), ("{", "}", "£"), ("¤", "d", "§"), ("「", "」", "Ɛ")],
+                         ids=["parentheses", "braces", "integrals", "matrices"])
+def test_tag_groups_matches_text_tagging(brackets):
+    """The stack-based tagger gives the same text as the original capture/replace loop"""
+    opening, closing, tagChar = brackets
+    alphabet = [opening, closing, opening, closing, "a", "b", tagChar]
+    rng = random.Random(0)
+    for _ in range(3000):
+        expression = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+        assert tagGroups(expression, opening, closing, tagChar) == \
+            _tagGroupsByText(expression, opening, closing, tagChar), f"Input: {expression!r}"
+
+
+# ========================================================================
+# PRECOMPILED PATTERN TESTS
+# ========================================================================
+
+def test_present_functions_matches_count():
+    """The pre-scan reports exactly the functions expression.count() would find"""
+    fragments = ["\\", "\\\\", "sin", "sinh", "arc", "cos", "ln", "int", "sign", "x", " "]
+    rng = random.Random(0)
+    for _ in range(3000):
+        expression = "".join(rng.choice(fragments) for _ in range(rng.randint(0, 8)))
+        expected = {func for func in COMMON_FUNCTIONS if expression.count("\\" + func) > 0}
+        assert _presentFunctions(expression) == expected, f"Input: {expression!r}"
+
+
+def test_translate_triggers_no_compiles():
+    """All function and fixlist patterns are compiled at import, the stages' own on their first use"""
+    expression = r"\sin ^2\left(x\right)+\arccos \frac{1}{2}+\ln x\cdot \sqrt{2}"
+    translate(expression)
+    stats = PATTERNS.stats()
+    translate(expression)
+    assert PATTERNS.stats() == stats
+
+
+def test_runtime_compiles_counts_stage_patterns(monkeypatch):
+    """A stage pattern compiled after import is counted once, however often it is used"""
+    registry = PatternRegistry()
+    registry.loaded = True
+    monkeypatch.setattr("src.translatelatex.PATTERNS", registry)
+    translate(r"\frac{1}{2}")
+    stats = registry.stats()
+    assert stats["runtime_compiles"] == stats["compiles"] > 0
+    translate(r"\frac{3}{4}")
+    assert registry.stats() == stats
+
+
+# ========================================================================
+# FEATURE SCAN TESTS
+# ========================================================================
+
+def test_skipped_stages_are_no_ops():
+    """A stage whose construct the scan did not find leaves the expression unchanged"""
+    test_cases = (BASIC_TESTS + SC_MODE_TESTS + CONSTANTS_TESTS + SPECIAL_SYMBOLS_TESTS
+                  + UNITS_TESTS + COMBINED_PARAMS_TESTS)
+    fragments = [case.latex_input for case in test_cases] + ["ab", "ba", "r", "ow", "\\arcsin \\left(x\\right)"]
+    rng = random.Random(0)
+    for settings in [{}, {"TI_on": False, "SC_on": True}, {"units_on": False, "constants_on": True}]:
+        engine = get_engine(**settings)
+        for _ in range(300):
+            expression = engine.applyTags(engine.prepare("".join(rng.sample(fragments, 3))))
+            for stage, feature in PIPELINE:
+                result = getattr(engine, stage)(expression)
+                if not scanFeatures(expression) & feature:
+                    assert result == expression, f"{stage} changed {expression!r}"
+                expression = result
+
+
+def test_stage_skip_counters():
+    """Each translation through the regex stages counts its skipped stages"""
+    before = STAGE_STATS.stats()
+    translate(r"\frac{1}{2}")
+    after = STAGE_STATS.stats()
+    assert after["translations"] == before["translations"] + 1
+    assert after["skipped"]["translateSum"] == before["skipped"]["translateSum"] + 1
+    assert after["skipped"]["translateFractions"] == before["skipped"]["translateFractions"]
+
+
+# ========================================================================
+# PROFILING TESTS
+# ========================================================================
+
+def test_profiled_translation():
+    """A timings dict gets the duration of every stage that ran, the result is unchanged"""
+    expression = r"\frac{1}{2}+\sin \left(x\right)\text{m}"
+    timings = {}
+    assert translate(expression, timings=timings) == translate(expression)
+    assert {"prepare", "applyTags", "translateUnits1", "translateCommonFunctions", "translateFractions",
+            "translateUnits2", "cleanUp", "insertMultiplication", "applyFixes"} <= set(timings)
+    assert "translateSum" not in timings
+    assert all(seconds >= 0 for seconds in timings.values())
+
+    count = STAGE_TIMINGS.stats()["translateFractions"]["count"]
+    translate(r"\frac{3}{4}", timings={})
+    histogram = STAGE_TIMINGS.stats()["translateFractions"]
+    assert histogram["count"] == count + 1
+    assert sum(histogram["buckets_ms"].values()) == histogram["count"]
+
+
+# ========================================================================
+# TREE BACKEND TESTS
+# ========================================================================
+
+TREE_PROFILES = [
+    {},
+    {"TI_on": False, "SC_on": True},
+    {"constants_on": True, "e_on": True, "i_on": True},
+    {"coulomb_on": True, "g_on": True, "units_on": False},
+]
+
+
+@pytest.mark.parametrize("settings", TREE_PROFILES, ids=["default", "SC", "constants_e_i", "coulomb_g"])
+def test_tree_backend_matches_regex_pipeline(settings):
+    """Every test expression translates the same with engine="tree" """
+    test_cases = (BASIC_TESTS + SC_MODE_TESTS + CONSTANTS_TESTS + SPECIAL_SYMBOLS_TESTS
+                  + UNITS_TESTS + COMBINED_PARAMS_TESTS)
+    for test_case in test_cases:
+        expected = translate(test_case.latex_input, **settings)
+        assert translate(test_case.latex_input, engine="tree", **settings) == expected, \
+            f"Input: {test_case.latex_input}\nSettings: {settings}"
+
+
+def test_tree_backend_matches_random_structures():
+    """Random nests of supported and unsupported constructs give the regex pipeline's output"""
+    atoms = ["x", "2", "+", "^2", "ab", "\\cdot ", "\\pi ", "e", "g", "k", "left", "{}", "_1", "\\sum "]
+    rng = random.Random(0)
+
+    def expression(depth):
+        parts = []
+        for _ in range(rng.randint(1, 3)):
+            kind = rng.randrange(8) if depth else 0
+            inner, other = (expression(depth - 1), expression(depth - 1)) if depth else ("", "")
+            parts.append([
+                rng.choice(atoms),
+                "{" + inner + "}",
+                "\\left(" + inner + "\\right)",
+                "\\frac{" + inner + "}{" + other + "}",
+                "\\sqrt{" + inner + "}",
+                "\\sqrt[" + inner + "]{" + other + "}",
+                "\\" + rng.choice(COMMON_FUNCTIONS) + " \\left(" + inner + "\\right)",
+                "^{" + inner + "}",
+            ][kind])
+        return "".join(parts)
+
+    for _ in range(500):
+        latex = expression(2)
+        settings = rng.choice(TREE_PROFILES)
+        assert translate(latex, engine="tree", **settings) == translate(latex, **settings), \
+            f"Input: {latex!r}\nSettings: {settings}"
+
+
+def test_tree_backend_falls_back():
+    """Unsupported constructs are left to the regex pipeline, unknown engines are rejected"""
+    engine = get_engine()
+    assert engine.tree.translate(engine.prepare(r"\frac{\sqrt[3]{x}}{\sin \left(x\right)}")) == \
+        "((root(x,3))/(sin(x)))"
+    with pytest.raises(Unsupported):
+        engine.tree.translate(engine.prepare(r"\sum_{n=1}^{10}\left(n\right)"))
+    assert translate(r"\sum_{n=1}^{10}\left(n\right)", engine="tree") == translate(r"\sum_{n=1}^{10}\left(n\right)")
+    with pytest.raises(ValueError):
+        translate("x", engine="parser")
+
+
+# ========================================================================
+# LIMIT TESTS
+# ========================================================================
+
+def test_deadline_stops_backtracking_stage():
+    """A single backtracking match in translateSum, about 20 s without a deadline, stops at it"""
+    expression = r"\sum_{i=1}^{n}" * 400 + "x"
+    start = perf_counter()
+    with pytest.raises(TranslationTimeout) as error:
+        translate(expression, deadline=monotonic() + 0.2)
+    assert perf_counter() - start < 2
+    assert error.value.stage in {"prepare", "applyTags", "translateSum"}
+
+
+def test_output_growth_cap(monkeypatch):
+    """An expression outgrowing its cap aborts with the stage that grew it"""
+    monkeypatch.setattr(translatelatex, "MIN_OUTPUT_LIMIT", 0)
+    monkeypatch.setattr(translatelatex, "MAX_OUTPUT_GROWTH", 1)
+    with pytest.raises(OutputTooLong) as error:
+        translate(r"\frac{1}{2}")
+    assert error.value.stage == "applyTags"
+    assert "applyTags" in str(error.value)
+
+
+@pytest.mark.parametrize("settings", TREE_PROFILES, ids=["default", "SC", "constants_e_i", "coulomb_g"])
+def test_guarded_twin_matches_regex_pipeline(settings):
+    """The regex-module twin used for long expressions with a deadline translates the same"""
+    test_cases = (BASIC_TESTS + SC_MODE_TESTS + CONSTANTS_TESTS + SPECIAL_SYMBOLS_TESTS
+                  + UNITS_TESTS + COMBINED_PARAMS_TESTS)
+    twin = get_engine(**settings).guardedTwin()
+    for test_case in test_cases:
+        assert twin.translate(test_case.latex_input, deadline=monotonic() + 60) == \
+            translate(test_case.latex_input, **settings), f"Input: {test_case.latex_input}\nSettings: {settings}"
+
+
 # ========================================================================
 # HELPER FUNCTION FOR MANUAL TESTING
 # ========================================================================
@@ -0,0 +1,76 @@
+"""
+Test suite for the translation result cache
+===========================================
+This module tests translation_cache.TranslationCache key normalisation,
+LRU eviction and the entry/byte bounds.
+"""
+
+from src.translation_cache import TranslationCache
+
+
+DEFAULT_SETTINGS = {
+    "TI_on": True,
+    "SC_on": False,
+    "constants_on": False,
+    "coulomb_on": False,
+    "e_on": False,
+    "i_on": False,
+    "g_on": False,
+    "units_on": True
+}
+
+
+def test_hit_and_miss_counters():
+    """A stored result is returned and counted as a hit"""
+    cache = TranslationCache(max_entries=8)
+    assert cache.get(r"\frac{1}{2}", DEFAULT_SETTINGS) is None
+    cache.put(r"\frac{1}{2}", DEFAULT_SETTINGS, "((1)/(2))")
+    assert cache.get(r"\frac{1}{2}", DEFAULT_SETTINGS) == "((1)/(2))"
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_settings_are_part_of_the_key():
+    """The same expression with different flags must not share an entry"""
+    cache = TranslationCache(max_entries=8)
+    cache.put("e^x", DEFAULT_SETTINGS, "e^x")
+    assert cache.get("e^x", dict(DEFAULT_SETTINGS, e_on=True)) is None
+    # Missing flags fall back to translate()'s defaults
+    assert cache.get("e^x", {}) == "e^x"
+
+
+def test_lru_eviction_by_entries():
+    """The least recently used entry is evicted first"""
+    cache = TranslationCache(max_entries=2)
+    cache.put("a", DEFAULT_SETTINGS, "a")
+    cache.put("b", DEFAULT_SETTINGS, "b")
+    cache.get("a", DEFAULT_SETTINGS)
+    cache.put("c", DEFAULT_SETTINGS, "c")
+
+    assert cache.get("b", DEFAULT_SETTINGS) is None
+    assert cache.get("a", DEFAULT_SETTINGS) == "a"
+    assert cache.get("c", DEFAULT_SETTINGS) == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_bound():
+    """Entries are evicted to stay under the byte budget, oversized results are not stored"""
+    cache = TranslationCache(max_entries=100, max_bytes=1000)
+    cache.put("x" * 2000, DEFAULT_SETTINGS, "x")
+    assert cache.stats()["entries"] == 0
+
+    for i in range(20):
+        cache.put(f"expr{i}", DEFAULT_SETTINGS, "y" * 100)
+    stats = cache.stats()
+    assert stats["bytes"] <= 1000
+    assert stats["evictions"] > 0
+
+
+def test_disabled_cache():
+    """A zero bound disables caching entirely"""
+    cache = TranslationCache(max_entries=0)
+    cache.put("a", DEFAULT_SETTINGS, "a")
+    assert cache.get("a", DEFAULT_SETTINGS) is None
@@ -0,0 +1,67 @@
+"""
+Test suite for the translation worker pool
+==========================================
+This module tests translation_pool.TranslationPool results, error passing,
+and that a timed-out translation has its worker killed and replaced unless
+it stops at its deadline by itself.
+"""
+
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from time import monotonic
+
+import pytest
+
+from src.translatelatex import translate, TranslationTimeout
+from src.translation_pool import TranslationPool
+
+# Takes seconds to translate, far past the timeouts below
+SLOW_EXPRESSION = "+".join(rf"\sin ^2\left({term}x\right)" for term in range(3000))
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = TranslationPool(workers=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_results_match_translate(pool):
+    """Workers return what translate() returns in this process"""
+    for expression in (r"\frac{1}{2}", r"\sqrt{x}\cdot \pi ", r"\sin \left(x\right)"):
+        assert pool.translate(expression, 10) == translate(expression)
+    assert pool.translate("x^2", 10, TI_on=False, SC_on=True) == translate("x^2", TI_on=False, SC_on=True)
+
+
+def test_timings_are_returned(pool):
+    """The stage timings measured in the worker are copied into the caller's dict"""
+    timings = {}
+    pool.translate(r"\frac{1}{2}", 10, timings=timings)
+    assert "translateFractions" in timings
+
+
+def test_errors_are_raised(pool):
+    """An exception in the worker is raised to the caller and the worker is reused"""
+    with pytest.raises(ValueError):
+        pool.translate("x", 10, engine="unknown")
+    assert pool.stats()["idle"] == 2
+
+
+def test_timed_out_worker_is_replaced(pool):
+    """A translation past its timeout is killed and the pool keeps all its workers"""
+    recycled = pool.stats()["recycled"]
+    with pytest.raises(FuturesTimeoutError):
+        pool.translate(SLOW_EXPRESSION, 0.2)
+
+    stats = pool.stats()
+    assert stats["recycled"] == recycled + 1
+    assert stats["busy"] == 0
+    assert stats["idle"] == 2
+    assert pool.translate(r"\frac{1}{2}", 10) == "((1)/(2))"
+
+
+def test_deadline_stops_the_translation_in_the_worker(pool):
+    """With a deadline the worker stops by itself and is not recycled"""
+    recycled = pool.stats()["recycled"]
+    with pytest.raises(TranslationTimeout):
+        pool.translate(SLOW_EXPRESSION, 10, deadline=monotonic() + 0.2)
+    assert pool.stats()["recycled"] == recycled